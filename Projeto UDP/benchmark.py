@@ -0,0 +1,204 @@
+import socket
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import filecmp
+import tempfile
+import threading
+import itertools
+import subprocess
+import argparse
+import re
+from proxy_perdas import Degradacao, ProxyDegradacao
+
+# --- Configurações ---
+DIRETORIO_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+IP = "127.0.0.1"
+TIMEOUT_SERVIDOR_PRONTO = 10 # Segundos esperando o servidor abrir o socket
+TIMEOUT_METRICAS_SERVIDOR = 5 # Segundos esperando o servidor exportar as métricas da sessão
+ARQUIVO_RESULTADOS = "resultados_benchmark.json"
+
+# Resumo impresso pelo cliente no fim do download: "[MÉTRICAS] <bytes> bytes em <segundos>s ..."
+PADRAO_METRICAS_CLIENTE = re.compile(r"\[MÉTRICAS\] (\d+) bytes em ([\d.]+)s")
+
+
+def porta_livre():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((IP, 0))
+        return sock.getsockname()[1]
+
+def lista(tipo):
+    """Conversor do argparse para listas separadas por vírgula (ex.: 0,0.01,0.05)."""
+    return lambda texto: [tipo(item) for item in texto.split(",") if item.strip()]
+
+def gerar_arquivo(caminho, tamanho, semente):
+    """Arquivo pseudoaleatório (incompressível), igual para a mesma semente."""
+    rng = random.Random(semente)
+    with open(caminho, 'wb') as f:
+        restante = tamanho
+        while restante > 0:
+            bloco = min(restante, 1 << 20)
+            f.write(rng.randbytes(bloco))
+            restante -= bloco
+
+def iniciar_servidor(diretorio, porta, janela, segmento, argumentos):
+    """Sobe o servidor com o arquivo de teste no diretório de trabalho e espera ele começar a escutar."""
+    comando = [sys.executable, "-u", os.path.join(DIRETORIO_SCRIPTS, "servidor.py"), "--ip", IP, "--porta", str(porta),
+               "--janela-maxima", str(janela), "--segmento-maximo", str(segmento), "--metricas", "json"]
+    if argumentos.controle:
+        comando += ["--controle", argumentos.controle]
+    log = open(os.path.join(diretorio, "servidor.log"), 'w')
+    processo = subprocess.Popen(comando, cwd=diretorio, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+    limite = time.time() + TIMEOUT_SERVIDOR_PRONTO
+    while time.time() < limite:
+        with open(log.name, encoding='utf-8', errors='replace') as f:
+            if "Aguardando requisições" in f.read():
+                return processo, log
+        if processo.poll() is not None:
+            break
+        time.sleep(0.05)
+    processo.kill()
+    log.close()
+    raise RuntimeError(f"servidor não iniciou (veja {log.name})")
+
+def metricas_servidor(diretorio, esperadas):
+    """Soma os contadores das sessões exportadas pelo servidor (uma linha por faixa/fluxo)."""
+    caminho = os.path.join(diretorio, "metricas_servidor.jsonl")
+    limite = time.time() + TIMEOUT_METRICAS_SERVIDOR
+    linhas = []
+    while time.time() < limite:
+        if os.path.exists(caminho):
+            with open(caminho, encoding='utf-8') as f:
+                linhas = [json.loads(linha) for linha in f if linha.strip()]
+            if len(linhas) >= esperadas:
+                break
+        time.sleep(0.05)
+    contadores = {}
+    for linha in linhas:
+        for nome, valor in linha["contadores"].items():
+            contadores[nome] = contadores.get(nome, 0) + valor
+    return contadores, len(linhas)
+
+def executar_caso(caso, argumentos):
+    """Executa uma transferência servidor -> proxy -> cliente e retorna o registro de resultados."""
+    diretorio = tempfile.mkdtemp(prefix="benchmark_udp_")
+    dir_servidor = os.path.join(diretorio, "servidor")
+    dir_cliente = os.path.join(diretorio, "cliente")
+    os.makedirs(dir_servidor)
+    os.makedirs(dir_cliente)
+    nome_arquivo = "arquivo_teste.bin"
+    gerar_arquivo(os.path.join(dir_servidor, nome_arquivo), caso["tamanho"], caso["semente"])
+
+    resultado = dict(caso, ok=False, erro=None)
+    porta_servidor, porta_proxy = porta_livre(), porta_livre()
+    opcoes = dict(perda=caso["perda"], rajada_media=argumentos.rajada_media, corrupcao=argumentos.corrupcao,
+                  atraso=argumentos.atraso, jitter=argumentos.jitter, reordenacao=argumentos.reordenacao)
+    # Sementes distintas em cada sentido, mas fixas por caso: a mesma varredura gera as mesmas perdas
+    volta = Degradacao(semente=caso["semente"], **opcoes)
+    ida = Degradacao(semente=caso["semente"] + 1, **opcoes)
+    parar = threading.Event()
+    processo = log = None
+    proxy = ProxyDegradacao(porta_proxy, (IP, porta_servidor), ida, volta)
+    thread_proxy = threading.Thread(target=proxy.executar, args=(parar,), daemon=True)
+    thread_proxy.start()
+    try:
+        processo, log = iniciar_servidor(dir_servidor, porta_servidor, caso["janela"], caso["segmento"], argumentos)
+        entrada = f"{IP}\n{porta_proxy}\n{nome_arquivo}\n\n{argumentos.fluxos}\n{argumentos.fec or ''}\n"
+        inicio = time.time()
+        try:
+            cliente = subprocess.run([sys.executable, "-u", os.path.join(DIRETORIO_SCRIPTS, "cliente1.py")], cwd=dir_cliente,
+                                     input=entrada, capture_output=True, text=True, timeout=argumentos.timeout)
+            saida = cliente.stdout + cliente.stderr
+        except subprocess.TimeoutExpired as e:
+            saida = (e.stdout or b"").decode('utf-8', 'replace') if isinstance(e.stdout, bytes) else (e.stdout or "")
+            resultado["erro"] = f"cliente excedeu {argumentos.timeout}s"
+        resultado["tempo_total_s"] = round(time.time() - inicio, 4)
+        with open(os.path.join(dir_cliente, "cliente.log"), 'w', encoding='utf-8') as f:
+            f.write(saida)
+
+        encontrado = PADRAO_METRICAS_CLIENTE.search(saida)
+        if encontrado:
+            resultado["tempo_transferencia_s"] = float(encontrado.group(2))
+        recebido = os.path.join(dir_cliente, f"recebido_{nome_arquivo}")
+        if resultado["erro"] is None:
+            if not os.path.exists(recebido):
+                resultado["erro"] = "arquivo não foi salvo"
+            elif not filecmp.cmp(os.path.join(dir_servidor, nome_arquivo), recebido, shallow=False):
+                resultado["erro"] = "arquivo recebido difere do original"
+            else:
+                resultado["ok"] = True
+        tempo = resultado.get("tempo_transferencia_s") or resultado["tempo_total_s"]
+        resultado["vazao_mbps"] = round(caso["tamanho"] * 8 / tempo / 1e6, 3) if resultado["ok"] and tempo > 0 else None
+
+        contadores, sessoes = metricas_servidor(dir_servidor, argumentos.fluxos)
+        resultado["sessoes_servidor"] = sessoes
+        resultado["segmentos_enviados"] = contadores.get("segmentos_enviados")
+        resultado["retransmissoes"] = contadores.get("segmentos_retransmitidos")
+        resultado["paridades"] = contadores.get("paridades")
+        resultado["bytes_rede_servidor"] = contadores.get("bytes_rede")
+    except RuntimeError as e:
+        resultado["erro"] = str(e)
+    finally:
+        if processo is not None:
+            processo.kill()
+            processo.wait()
+            log.close()
+        parar.set()
+        thread_proxy.join()
+        proxy.fechar()
+        resultado["proxy_ida"] = dict(ida.estatisticas)
+        resultado["proxy_volta"] = dict(volta.estatisticas)
+        if resultado["ok"] and not argumentos.manter:
+            shutil.rmtree(diretorio, ignore_errors=True)
+        else:
+            resultado["diretorio"] = diretorio # Logs do servidor e do cliente para investigar a falha
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Varredura de desempenho servidor/cliente em loopback, através do proxy de perdas.")
+    parser.add_argument("--tamanhos", type=lista(int), default=[100_000, 1_000_000], help="tamanhos de arquivo em bytes")
+    parser.add_argument("--janelas", type=lista(int), default=[64, 1024], help="janela máxima do servidor, em segmentos")
+    parser.add_argument("--segmentos", type=lista(int), default=[1024, 8192], help="tamanho máximo de segmento do servidor, em bytes")
+    parser.add_argument("--perdas", type=lista(float), default=[0.0, 0.01, 0.05], help="taxas de perda do proxy")
+    parser.add_argument("--rajada-media", type=float, default=1.0, help="tamanho médio das rajadas de perda (1 = perdas independentes)")
+    parser.add_argument("--corrupcao", type=float, default=0.0, help="probabilidade de corromper um pacote")
+    parser.add_argument("--atraso", type=float, default=0.0, help="atraso fixo em cada sentido (segundos)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="variação do atraso (± segundos)")
+    parser.add_argument("--reordenacao", type=float, default=0.0, help="probabilidade de reordenar um pacote")
+    parser.add_argument("--controle", choices=('aimd', 'cubic'), default=None, help="controle de congestionamento do servidor")
+    parser.add_argument("--fluxos", type=int, default=1, help="fluxos paralelos do cliente")
+    parser.add_argument("--fec", default=None, help="proporção de FEC N:K pedida pelo cliente")
+    parser.add_argument("--repeticoes", type=int, default=1, help="execuções de cada combinação")
+    parser.add_argument("--semente", type=int, default=1, help="semente base (arquivo e perdas)")
+    parser.add_argument("--timeout", type=float, default=300, help="tempo máximo de cada download (segundos)")
+    parser.add_argument("--manter", action="store_true", help="mantém os diretórios temporários mesmo quando o caso passa")
+    parser.add_argument("--saida", default=ARQUIVO_RESULTADOS, help=f"arquivo JSON de resultados (padrão: {ARQUIVO_RESULTADOS})")
+    argumentos = parser.parse_args()
+
+    combinacoes = list(itertools.product(argumentos.tamanhos, argumentos.janelas, argumentos.segmentos,
+                                         argumentos.perdas, range(argumentos.repeticoes)))
+    print(f"Executando {len(combinacoes)} casos...")
+    print(f"{'tamanho':>10} {'janela':>6} {'segmento':>8} {'perda':>6} {'ok':>3} {'tempo(s)':>9} {'Mbit/s':>9} {'retransm.':>9}")
+    resultados = []
+    for tamanho, janela, segmento, perda, repeticao in combinacoes:
+        caso = dict(tamanho=tamanho, janela=janela, segmento=segmento, perda=perda, repeticao=repeticao,
+                    semente=argumentos.semente + repeticao * 1000)
+        resultado = executar_caso(caso, argumentos)
+        resultados.append(resultado)
+        tempo = resultado.get("tempo_transferencia_s") or resultado.get("tempo_total_s") or 0
+        vazao = f"{resultado['vazao_mbps']:.2f}" if resultado.get("vazao_mbps") is not None else "-"
+        print(f"{tamanho:>10} {janela:>6} {segmento:>8} {perda:>6} {'sim' if resultado['ok'] else 'não':>3} "
+              f"{tempo:>9.3f} {vazao:>9} {str(resultado.get('retransmissoes', '-')):>9}"
+              + (f"  ({resultado['erro']}; veja {resultado.get('diretorio')})" if resultado["erro"] else ""))
+
+    fixos = {chave: getattr(argumentos, chave) for chave in
+             ("rajada_media", "corrupcao", "atraso", "jitter", "reordenacao", "controle", "fluxos", "fec", "semente")}
+    with open(argumentos.saida, 'w', encoding='utf-8') as f:
+        json.dump({"data": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                   "parametros": fixos, "resultados": resultados}, f, ensure_ascii=False, indent=2)
+    falhas = sum(not resultado["ok"] for resultado in resultados)
+    print(f"\nResultados gravados em '{argumentos.saida}' ({len(resultados) - falhas} ok, {falhas} com falha).")
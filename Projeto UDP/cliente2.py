@@ -1,29 +1,959 @@
 import socket
-import hashlib
+import os
+import errno
+import shutil
 import time
 import math
+import threading
+import struct
+from bisect import bisect_right
+from protocolo import (montar_pacote, montar_ack, analisar_pacote, xor_segmentos, ler_paridade, descomprimir_payload,
+                       ler_info_lote, bases_do_lote, assinatura_lote, novo_digesto, CODECS, CHECKSUM_PADRAO,
+                       ler_info, SOBRECARGA_PACOTE, TAMANHO_MAXIMO_UDP,
+                       TIPO_DADOS, TIPO_EOF, TIPO_ACK_EOF, TIPO_ERRO, TIPO_INFO, TIPO_INFO_LOTE, TIPO_PARIDADE)
+from metricas import MetricasTransferencia, exportar_metricas, NIVEL_INFO, NIVEL_PACOTE
 
 # --- Configurações ---
 ENCODING = 'raw-unicode-escape'
-BUFFER_SIZE = 2048        # Buffer de recepção (maior para caber segmento + cabeçalho)
+SEGMENT_SIZE = 1024       # Tamanho dos dados por segmento se o INFO falhar (padrão do servidor)
+SEGMENT_SIZE_DESEJADO = 65000 # Tamanho de segmento pedido no INFO; o servidor pode reduzir (máximo dele, MTU do caminho)
+SEGMENTOS_NO_RCVBUF = 64  # O SO_RCVBUF é dimensionado para caber pelo menos este número de segmentos
+BUFFERS_RECEPCAO = 8      # Buffers de recepção pré-alocados por faixa (mais são criados se os fora de ordem retiverem todos)
+BLOCO_PREALOCACAO = 1024 * 1024 # O arquivo de destino cresce em blocos deste tamanho
 RECEIVE_TIMEOUT = 5.0   # Timeout principal do cliente esperando pacotes (segundos)
 MAX_TIMEOUTS_CONSECUTIVOS = 3 # Número de timeouts seguidos antes de desistir
+ACKS_ATRASADOS = True   # Agrupa ACKs de segmentos em ordem (um ACK cumulativo confirma vários)
+SEGMENTOS_POR_ACK = 2   # Com ACKs atrasados, envia um ACK a cada N segmentos em ordem...
+ATRASO_MAXIMO_ACK = 0.01 # ...ou quando este tempo (segundos) se esgotar
+MAX_FLUXOS_PARALELOS = 16 # Limite de sockets/sessões simultâneos em um download paralelo
+DIARIO_GRAVAR_A_CADA = 256 # Grava o diário de segmentos recebidos a cada N segmentos novos
+MAX_FAIXAS_RETOMADA = 32  # Ao retomar, no máximo este número de GETs de faixa (lacunas próximas são unidas)
+JUNTAR_LACUNAS_ATE = 16   # Trechos já recebidos menores que isso são baixados de novo em vez de abrir outra faixa
+FEC_MAXIMO_BLOCO = 64     # Maior N aceito na proporção de FEC N:K
+MAX_ARQUIVOS_POR_LOTE = 4096 # Vários arquivos pedidos de uma vez são divididos em lotes de até N arquivos...
+TAMANHO_MAXIMO_REQUISICAO = TAMANHO_MAXIMO_UDP - 512 # ...e cuja lista caiba em um datagrama (com folga para as opções do GET)
+TAMANHO_MAXIMO_DOWNLOAD = None # Recusa, antes do GET, downloads maiores que isso (bytes); None = sem limite
+RESERVA_DISCO = 16 * 1024 * 1024 # Recusa o download se ele deixar menos que isso livre no disco
+MOSTRAR_PROGRESSO = True  # Mostra porcentagem, vazão e tempo restante quando o tamanho é conhecido (INFO)
+INTERVALO_PROGRESSO = 1.0 # Segundos entre as linhas de progresso
+COMPRESSAO = True         # Anuncia no GET os codecs disponíveis (zstd/lz4 se instalados, zlib sempre)
+CHECKSUM = CHECKSUM_PADRAO # Checksum dos pacotes e digest do arquivo: 'crc32' ou 'adler32' (baratos), 'md5' ou 'sha256'
+NIVEL_LOG = NIVEL_INFO    # NIVEL_PACOTE mostra cada segmento recebido (deixa a recepção bem mais lenta)
+EXPORTAR_METRICAS = None  # None, 'json' (uma linha por download) ou 'prometheus'
+ARQUIVO_METRICAS = "metricas_cliente" # Recebe a extensão .jsonl ou .prom conforme o formato
 
-def calculate_hash(data_bytes):
-    """Calcula o hash MD5 dos bytes fornecidos."""
-    return hashlib.md5(data_bytes).hexdigest().encode(ENCODING)
+# Diário (journal) do download: MAGICO(4) | SEGMENT_SIZE(4) | TAMANHO_ARQUIVO(8) | VERSAO_ARQUIVO(8),
+# seguido de um bitmap com 1 bit por segmento já validado e gravado no '.parcial'
+CABECALHO_DIARIO = struct.Struct("!4sIQQ")
+MAGICO_DIARIO = b"UDPD"
 
-def send_ack(sock, address, seq_num, encoding):
-    """Envia uma mensagem ACK para o número de sequência especificado."""
+def send_ack(sock, address, seq_num, fora_de_ordem):
+    """Envia um ACK cumulativo (tudo antes de seq_num recebido) com o bitmap SACK dos segmentos fora de ordem."""
     try:
-        ack_msg = f"ACK|{seq_num}".encode(encoding)
+        ack_msg = montar_ack(seq_num, fora_de_ordem, CHECKSUM)
         sock.sendto(ack_msg, address)
-        # print(f"ACK para {seq_num} enviado.") # Descomente para depuração detalhada de ACKs
+        # print(f"ACK cumulativo {seq_num} enviado.") # Descomente para depuração detalhada de ACKs
     except socket.error as e:
         print(f"Erro de socket ao enviar ACK para {seq_num}: {e}")
     except Exception as e:
         print(f"Erro inesperado ao enviar ACK para {seq_num}: {e}")
 
+def criar_socket(segment_size=SEGMENT_SIZE):
+    """Cria o socket UDP do cliente, com SO_RCVBUF ampliado (conforme o segmento) e timeout de recepção."""
+    cliente = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Tentar aumentar o buffer de recebimento (SO_RCVBUF) - Opcional, mas pode ajudar
+    try:
+        default_rcvbuf = cliente.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        print(f"Tamanho original do buffer de recebimento (SO_RCVBUF): {default_rcvbuf}")
+        new_rcvbuf = max(2 * 1024 * 1024, SEGMENTOS_NO_RCVBUF * (segment_size + SOBRECARGA_PACOTE)) # Tentar 2MB ou mais
+        cliente.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, new_rcvbuf)
+        actual_rcvbuf = cliente.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        print(f"Tentativa de definir SO_RCVBUF para {new_rcvbuf}, valor atual: {actual_rcvbuf}")
+    except Exception as e:
+        print(f"Aviso: Não foi possível alterar SO_RCVBUF: {e}")
+
+    # Definir timeout principal para recebimento
+    cliente.settimeout(RECEIVE_TIMEOUT)
+    return cliente
+
+def requisitar_info(server_address, alvo, tipo_esperado):
+    """Envia 'INFO <alvo>' (com algumas tentativas) e retorna (tipo, payload) da resposta, ou (None, None)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(RECEIVE_TIMEOUT / MAX_TIMEOUTS_CONSECUTIVOS)
+    try:
+        for tentativa in range(MAX_TIMEOUTS_CONSECUTIVOS):
+            sock.sendto(f"INFO {alvo}?segmento={SEGMENT_SIZE_DESEJADO}&checksum={CHECKSUM}".encode(ENCODING), server_address)
+            try:
+                dados, endereco = sock.recvfrom(TAMANHO_MAXIMO_UDP) # A resposta de um lote pode ser grande
+                tipo, _, _, payload, checksum_ok = analisar_pacote(dados)
+            except socket.timeout:
+                print(f"Timeout esperando resposta do INFO ({tentativa + 1}/{MAX_TIMEOUTS_CONSECUTIVOS})")
+                continue
+            except ValueError as e:
+                print(f"Resposta do INFO malformada: {e}")
+                continue
+            if endereco != server_address or not checksum_ok:
+                continue
+            if tipo in (TIPO_ERRO, tipo_esperado):
+                return tipo, payload
+        return None, None
+    finally:
+        sock.close()
+
+def consultar_metadados(server_address, nome_arquivo):
+    """Pergunta ao servidor (INFO) os metadados do arquivo e negocia o tamanho do segmento.
+
+    Retorna (tamanho, segment_size, versao, digest, mensagem_erro): tamanho
+    é None se o servidor não respondeu ou recusou (e segment_size fica no
+    padrão); versao identifica o conteúdo do arquivo remoto (mtime); digest (do arquivo inteiro, no algoritmo CHECKSUM) é None se o servidor
+    não o enviou; mensagem_erro vem preenchida se ele enviou Erro.
+    """
+    tipo, payload = requisitar_info(server_address, f"/{nome_arquivo}", TIPO_INFO)
+    if tipo == TIPO_ERRO:
+        return None, SEGMENT_SIZE, None, None, bytes(payload).decode(ENCODING, errors='replace')
+    if tipo == TIPO_INFO:
+        try:
+            tamanho, segment_size, _, versao, digesto = ler_info(payload)
+        except ValueError as e:
+            return None, SEGMENT_SIZE, None, None, f"resposta do INFO malformada ({e})"
+        return tamanho, segment_size, versao, digesto, None
+    return None, SEGMENT_SIZE, None, None, None
+
+def consultar_lote(server_address, nomes_arquivos):
+    """INFO de um lote: retorna (segment_size, tamanhos, mensagem_erro).
+
+    tamanhos tem um valor por arquivo (None = não existe no servidor), ou é
+    None se o servidor não respondeu ou recusou o lote.
+    """
+    tipo, payload = requisitar_info(server_address, "".join(f"/{nome}" for nome in nomes_arquivos), TIPO_INFO_LOTE)
+    if tipo == TIPO_ERRO:
+        return SEGMENT_SIZE, None, bytes(payload).decode(ENCODING, errors='replace')
+    if tipo == TIPO_INFO_LOTE:
+        try:
+            segment_size, tamanhos = ler_info_lote(payload)
+        except ValueError as e:
+            return SEGMENT_SIZE, None, f"resposta do INFO malformada ({e})"
+        if len(tamanhos) == len(nomes_arquivos):
+            return segment_size, tamanhos, None
+    return SEGMENT_SIZE, None, None
+
+def verificar_limites(tamanho, diretorio="."):
+    """Confere, antes do GET, se um download de 'tamanho' bytes cabe nos limites locais; retorna o motivo da recusa ou None."""
+    if TAMANHO_MAXIMO_DOWNLOAD is not None and tamanho > TAMANHO_MAXIMO_DOWNLOAD:
+        return f"{tamanho} bytes excedem o limite de {TAMANHO_MAXIMO_DOWNLOAD} bytes por download"
+    try:
+        livre = shutil.disk_usage(diretorio).free
+    except OSError:
+        return None
+    if tamanho + RESERVA_DISCO > livre:
+        return f"{tamanho} bytes não cabem no disco ({livre} bytes livres, reserva de {RESERVA_DISCO})"
+    return None
+
+def dividir_em_lotes(nomes_arquivos):
+    """Agrupa os arquivos em lotes que caibam em uma requisição (MAX_ARQUIVOS_POR_LOTE, TAMANHO_MAXIMO_REQUISICAO)."""
+    lotes = [[]]
+    tamanho = 0
+    for nome in nomes_arquivos:
+        tamanho_nome = len(nome.encode(ENCODING)) + 1 # '/' antes de cada nome
+        if lotes[-1] and (len(lotes[-1]) >= MAX_ARQUIVOS_POR_LOTE or tamanho + tamanho_nome > TAMANHO_MAXIMO_REQUISICAO):
+            lotes.append([])
+            tamanho = 0
+        lotes[-1].append(nome)
+        tamanho += tamanho_nome
+    return lotes
+
+class Progresso:
+    """Mostra o andamento de um download de tamanho conhecido: porcentagem, vazão e tempo restante.
+
+    Compartilhado pelas faixas de um download paralelo (cada segmento novo
+    chama avancar); imprime no máximo uma linha a cada INTERVALO_PROGRESSO.
+    """
+
+    def __init__(self, total_bytes, ja_recebidos=0):
+        self.total_bytes = total_bytes
+        self.recebidos = ja_recebidos # Inclui o que já estava no disco (retomada)
+        self.recebidos_inicio = ja_recebidos
+        self.inicio = time.time()
+        self.proximo_relatorio = self.inicio + INTERVALO_PROGRESSO
+        self.completo = False
+        self.trava = threading.Lock()
+
+    def avancar(self, quantidade):
+        with self.trava:
+            self.recebidos += quantidade
+            agora = time.time()
+            if self.completo or (agora < self.proximo_relatorio and self.recebidos < self.total_bytes):
+                return
+            self.completo = self.recebidos >= self.total_bytes
+            self.proximo_relatorio = agora + INTERVALO_PROGRESSO
+            vazao = (self.recebidos - self.recebidos_inicio) / max(agora - self.inicio, 1e-6)
+            restante = f", faltam ~{(self.total_bytes - self.recebidos) / vazao:.1f}s" if vazao > 0 and not self.completo else ""
+            porcentagem = min(self.recebidos / self.total_bytes, 1.0) * 100 if self.total_bytes else 100.0
+            print(f"[PROGRESSO] {porcentagem:5.1f}% ({min(self.recebidos, self.total_bytes)} de {self.total_bytes} bytes), "
+                  f"{vazao / 1e6:.2f} MB/s{restante}")
+
+
+class BuffersRecepcao:
+    """Buffers de recepção pré-alocados, reaproveitados a cada datagrama (recvfrom_into em vez de recvfrom).
+
+    receber() devolve um memoryview do trecho recebido, sem criar um bytes
+    por pacote: cabeçalho, checksum e payload são lidos ali mesmo, e o
+    payload vai direto para o EscritorArquivo e para o digest. O buffer é
+    reutilizado no próximo receber(), a não ser que seja retido: um segmento
+    fora de ordem fica no próprio buffer até entrar no digest (reter/liberar),
+    e enquanto isso os próximos pacotes usam os outros.
+    """
+
+    def __init__(self, quantidade, tamanho):
+        self.tamanho = tamanho
+        self.visoes = [memoryview(bytearray(tamanho)) for _ in range(quantidade)]
+        self.livres = list(range(quantidade))
+        self.atual = None # Índice do buffer do último pacote (None se foi retido)
+
+    def receber(self, sock):
+        """Recebe um datagrama; retorna (memoryview dos dados, endereço)."""
+        if self.atual is not None:
+            self.livres.append(self.atual)
+        if not self.livres: # Todos retidos por segmentos fora de ordem
+            self.livres.append(len(self.visoes))
+            self.visoes.append(memoryview(bytearray(self.tamanho)))
+        self.atual = self.livres.pop()
+        tamanho, endereco = sock.recvfrom_into(self.visoes[self.atual])
+        return self.visoes[self.atual][:tamanho], endereco
+
+    def reter(self, dados):
+        """Impede que o buffer do último pacote seja reutilizado enquanto 'dados' (uma fatia dele) for necessário.
+
+        Retorna o índice a devolver com liberar(), ou None se 'dados' não
+        está no buffer (ex.: payload descomprimido ou reconstruído pelo FEC).
+        """
+        if self.atual is None or not isinstance(dados, memoryview) or dados.obj is not self.visoes[self.atual].obj:
+            return None
+        indice, self.atual = self.atual, None
+        return indice
+
+    def liberar(self, indice):
+        if indice is not None:
+            self.livres.append(indice)
+
+
+class EscritorArquivo:
+    """Grava cada segmento diretamente na sua posição (seq * segment_size) no arquivo de destino.
+
+    Os dados vão para um arquivo '.parcial', pré-alocado em blocos, com
+    escritas posicionais; segmentos fora de ordem não precisam ficar em
+    memória e não há etapa de montagem no final. Pode ser compartilhado
+    entre vários fluxos de um download paralelo.
+
+    Quando o tamanho do arquivo remoto é conhecido, um diário ('.diario')
+    registra quais segmentos já estão no disco; se o download for
+    interrompido, a próxima execução retoma a partir dele.
+    """
+
+    def __init__(self, caminho_destino, tamanho_remoto=None, segment_size=SEGMENT_SIZE, versao_remota=0):
+        self.caminho_destino = caminho_destino
+        self.segment_size = segment_size
+        self.versao_remota = versao_remota # mtime do arquivo no servidor (INFO); muda se o conteúdo mudar
+        self.caminho_parcial = caminho_destino + ".parcial"
+        self.caminho_diario = caminho_destino + ".diario"
+        self.tamanho_remoto = tamanho_remoto
+        self.tamanho_alocado = 0
+        self.tamanho_final = 0 # Maior posição escrita até agora
+        self.trava = threading.Lock() # Protege a pré-alocação, o diário (e o lseek+write sem pwrite)
+
+        self.recebidos = None # Bitmap do diário (None = sem diário)
+        self.segmentos_retomados = 0
+        self.fd_diario = None
+        if tamanho_remoto is not None:
+            self.recebidos = self.carregar_diario()
+        retomado = self.recebidos is not None
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if not retomado:
+            flags |= os.O_TRUNC
+        self.fd = os.open(self.caminho_parcial, flags, 0o644)
+
+        if retomado:
+            self.segmentos_retomados = sum(bin(byte).count("1") for byte in self.recebidos)
+            self.tamanho_alocado = os.fstat(self.fd).st_size
+            self.fd_diario = os.open(self.caminho_diario, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        elif tamanho_remoto is not None:
+            self.recebidos = bytearray((self.total_segmentos + 7) // 8)
+            self.fd_diario = os.open(self.caminho_diario, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+            os.write(self.fd_diario, CABECALHO_DIARIO.pack(MAGICO_DIARIO, segment_size, tamanho_remoto, versao_remota) + self.recebidos)
+        if tamanho_remoto is not None:
+            self.prealocar(tamanho_remoto)
+        self.sujos = None # Faixa [inicio, fim) de bytes do bitmap ainda não gravada
+        self.novos_desde_gravacao = 0
+
+    @property
+    def total_segmentos(self):
+        """Número de segmentos do arquivo remoto, ou None se o tamanho não é conhecido."""
+        return math.ceil(self.tamanho_remoto / self.segment_size) if self.tamanho_remoto is not None else None
+
+    def prealocar(self, tamanho):
+        """Reserva o arquivo inteiro de uma vez: sem crescimento aos blocos e, sem espaço, a falha vem já no início."""
+        if tamanho <= self.tamanho_alocado:
+            return
+        try:
+            os.posix_fallocate(self.fd, 0, tamanho)
+        except AttributeError: # Windows não tem posix_fallocate
+            os.ftruncate(self.fd, tamanho)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            os.ftruncate(self.fd, tamanho) # Sistema de arquivos sem suporte: arquivo esparso
+        self.tamanho_alocado = tamanho
+
+    def digest(self, algoritmo):
+        """Digest do conteúdo do '.parcial' (até o tamanho remoto), relendo do disco."""
+        digesto = novo_digesto(algoritmo)
+        posicao = 0
+        while posicao < self.tamanho_remoto:
+            tamanho_bloco = min(BLOCO_PREALOCACAO, self.tamanho_remoto - posicao)
+            if hasattr(os, 'pread'):
+                bloco = os.pread(self.fd, tamanho_bloco, posicao)
+            else: # Windows não tem pread
+                with self.trava:
+                    os.lseek(self.fd, posicao, os.SEEK_SET)
+                    bloco = os.read(self.fd, tamanho_bloco)
+            if not bloco:
+                break
+            digesto.update(bloco)
+            posicao += len(bloco)
+        return digesto.digest()
+
+    @property
+    def retomado(self):
+        return self.segmentos_retomados > 0
+
+    def carregar_diario(self):
+        """Lê o diário de uma execução anterior, se ele for do mesmo arquivo remoto."""
+        if not os.path.exists(self.caminho_parcial):
+            return None
+        try:
+            with open(self.caminho_diario, 'rb') as f:
+                conteudo = f.read()
+        except OSError:
+            return None
+        tamanho_bitmap = (self.total_segmentos + 7) // 8
+        if len(conteudo) != CABECALHO_DIARIO.size + tamanho_bitmap:
+            return None
+        if CABECALHO_DIARIO.unpack_from(conteudo) != (MAGICO_DIARIO, self.segment_size, self.tamanho_remoto, self.versao_remota):
+            return None # Arquivo remoto mudou (tamanho ou versão) ou foi negociado outro tamanho de segmento
+        return bytearray(conteudo[CABECALHO_DIARIO.size:])
+
+    def ja_recebido(self, num_seq):
+        return self.recebidos is not None and bool(self.recebidos[num_seq >> 3] & (0x80 >> (num_seq & 7)))
+
+    def escrever(self, num_seq, dados):
+        posicao = num_seq * self.segment_size
+        fim = posicao + len(dados)
+        if fim > self.tamanho_alocado:
+            with self.trava:
+                if fim > self.tamanho_alocado:
+                    self.tamanho_alocado = (fim // BLOCO_PREALOCACAO + 1) * BLOCO_PREALOCACAO
+                    os.ftruncate(self.fd, self.tamanho_alocado)
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, dados, posicao)
+        else: # Windows não tem pwrite
+            with self.trava:
+                os.lseek(self.fd, posicao, os.SEEK_SET)
+                os.write(self.fd, dados)
+        self.tamanho_final = max(self.tamanho_final, fim)
+        if self.recebidos is not None:
+            self.marcar_recebido(num_seq)
+
+    def marcar_recebido(self, num_seq):
+        """Marca o segmento no bitmap (só depois de os dados estarem no '.parcial')."""
+        indice = num_seq >> 3
+        with self.trava:
+            self.recebidos[indice] |= 0x80 >> (num_seq & 7)
+            if self.sujos is None:
+                self.sujos = (indice, indice + 1)
+            else:
+                self.sujos = (min(self.sujos[0], indice), max(self.sujos[1], indice + 1))
+            self.novos_desde_gravacao += 1
+            if self.novos_desde_gravacao >= DIARIO_GRAVAR_A_CADA:
+                self.gravar_diario()
+
+    def gravar_diario(self):
+        """Grava no disco apenas o trecho alterado do bitmap (chamar com a trava)."""
+        if self.sujos is None:
+            return
+        inicio, fim = self.sujos
+        trecho = bytes(self.recebidos[inicio:fim])
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd_diario, trecho, CABECALHO_DIARIO.size + inicio)
+        else:
+            os.lseek(self.fd_diario, CABECALHO_DIARIO.size + inicio, os.SEEK_SET)
+            os.write(self.fd_diario, trecho)
+        self.sujos = None
+        self.novos_desde_gravacao = 0
+
+    def faixas_faltando(self):
+        """Faixas [inicio, fim) de segmentos que ainda não estão no disco.
+
+        Lacunas separadas por poucos segmentos já recebidos são unidas, e o
+        total de faixas é limitado a MAX_FAIXAS_RETOMADA: baixar de novo
+        alguns segmentos sai mais barato que abrir outra sessão.
+        """
+        faixas = []
+        for num_seq in range(self.total_segmentos):
+            if self.ja_recebido(num_seq):
+                continue
+            if faixas and faixas[-1][1] == num_seq:
+                faixas[-1][1] = num_seq + 1
+            else:
+                faixas.append([num_seq, num_seq + 1])
+        if len(faixas) > 1:
+            lacunas = sorted(faixas[i + 1][0] - faixas[i][1] for i in range(len(faixas) - 1))
+            excesso = len(faixas) - MAX_FAIXAS_RETOMADA
+            limite = max(JUNTAR_LACUNAS_ATE, lacunas[excesso - 1] if excesso > 0 else 0)
+            unidas = [faixas[0]]
+            for faixa in faixas[1:]:
+                if faixa[0] - unidas[-1][1] <= limite:
+                    unidas[-1][1] = faixa[1]
+                else:
+                    unidas.append(faixa)
+            faixas = unidas
+        return [tuple(faixa) for faixa in faixas]
+
+    def concluir(self):
+        """Ajusta o tamanho do arquivo, renomeia para o nome definitivo e apaga o diário."""
+        self.fechar()
+        self.publicar()
+
+    def fechar(self):
+        """Ajusta o tamanho do '.parcial' e fecha os descritores; o arquivo continua com o nome provisório."""
+        if self.tamanho_remoto is not None:
+            self.tamanho_final = self.tamanho_remoto # Inclui segmentos recebidos em execuções anteriores
+        os.ftruncate(self.fd, self.tamanho_final)
+        os.close(self.fd)
+        self.fd = None
+        if self.fd_diario is not None:
+            os.close(self.fd_diario)
+            self.fd_diario = None
+
+    def publicar(self):
+        """Renomeia o '.parcial' já fechado para o nome definitivo e apaga o diário."""
+        os.replace(self.caminho_parcial, self.caminho_destino)
+        if self.recebidos is not None:
+            os.remove(self.caminho_diario)
+
+    def pausar(self):
+        """Grava o diário e mantém o '.parcial' para uma retomada futura."""
+        with self.trava:
+            self.gravar_diario()
+        os.close(self.fd_diario)
+        os.close(self.fd)
+
+    def descartar(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        if self.fd_diario is not None:
+            os.close(self.fd_diario)
+        for caminho in (self.caminho_parcial, self.caminho_diario):
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+class EscritorLote:
+    """Distribui os segmentos de um lote entre os arquivos de destino, um EscritorArquivo por fluxo.
+
+    O fluxo i (i-ésimo arquivo do pedido) ocupa os números de sequência
+    [base_i, base_i + segmentos_i) da sessão. Cada arquivo é criado quando
+    chega o primeiro segmento dele e fechado assim que todos os seus
+    segmentos estão no disco, então só os arquivos em andamento ficam
+    abertos. Os completos continuam como '.parcial' até o fim do lote: o
+    digest do EOF cobre o lote inteiro, e só depois de ele conferir os
+    arquivos recebem o nome definitivo (concluir).
+    """
+
+    def __init__(self, caminhos_destino, tamanhos, segment_size=SEGMENT_SIZE):
+        self.caminhos_destino = caminhos_destino
+        self.tamanhos = tamanhos
+        self.segment_size = segment_size
+        self.bases, self.total_segmentos = bases_do_lote(tamanhos, segment_size)
+        self.faltando = [math.ceil((tamanho or 0) / segment_size) for tamanho in tamanhos]
+        self.escritores = {} # {fluxo: EscritorArquivo} dos arquivos em andamento
+        self.completos = {} # {fluxo: EscritorArquivo} já fechados, à espera do digest do lote
+        self.concluidos = set() # Fluxos já salvos com o nome definitivo
+
+    def fluxo(self, num_seq):
+        # Arquivos vazios têm a mesma base do seguinte; bisect_right fica com o último, que é o dono do segmento
+        return bisect_right(self.bases, num_seq) - 1
+
+    def escrever(self, num_seq, dados):
+        fluxo = self.fluxo(num_seq)
+        escritor = self.escritores.get(fluxo)
+        if escritor is None:
+            escritor = EscritorArquivo(self.caminhos_destino[fluxo], None, self.segment_size)
+            escritor.prealocar(self.tamanhos[fluxo])
+            self.escritores[fluxo] = escritor
+        escritor.escrever(num_seq - self.bases[fluxo], dados)
+        self.faltando[fluxo] -= 1
+        if self.faltando[fluxo] == 0:
+            escritor.fechar()
+            self.completos[fluxo] = self.escritores.pop(fluxo)
+
+    def concluir(self):
+        """Lote conferido: salva os arquivos completos com o nome definitivo e cria os vazios."""
+        for fluxo, escritor in self.completos.items():
+            escritor.publicar()
+            self.concluidos.add(fluxo)
+        self.completos.clear()
+        for fluxo, tamanho in enumerate(self.tamanhos):
+            if tamanho == 0:
+                EscritorArquivo(self.caminhos_destino[fluxo], None, self.segment_size).concluir()
+                self.concluidos.add(fluxo)
+
+    def descartar(self):
+        """Apaga os arquivos incompletos e os completos não conferidos (lote sem EOF ou com digest errado)."""
+        for escritor in list(self.escritores.values()) + list(self.completos.values()):
+            escritor.descartar()
+        self.escritores.clear()
+        self.completos.clear()
+
+
+class RecepcaoFaixa:
+    """Recebe uma faixa de segmentos [inicio, fim) de um arquivo em um socket próprio.
+
+    Um download simples usa uma única faixa com o arquivo inteiro; no modo
+    paralelo cada fluxo tem a sua, todas gravando no mesmo EscritorArquivo.
+
+    Com FEC (N, K), o servidor envia K paridades a cada N segmentos e um
+    segmento perdido ou corrompido pode ser reconstruído localmente, sem
+    esperar a retransmissão.
+
+    Um lote usa uma única faixa com todos os arquivos ('arq1/arq2/...'),
+    gravando em um EscritorLote; 'assinatura' vem do INFO_LOTE.
+
+    O digest da faixa é calculado conforme os segmentos entram em ordem
+    (os fora de ordem esperam em memória, no máximo uma janela) e conferido
+    com o que o servidor envia no EOF, sem reler o arquivo.
+
+    Quando o número de segmentos é conhecido (INFO), a faixa sabe que está
+    completa assim que a última lacuna se fecha: confirma na hora e, se o
+    INFO trouxe o digest do arquivo ('digest_esperado', faixa = arquivo
+    inteiro), já confere os dados; aí um EOF perdido não invalida o download.
+    """
+
+    def __init__(self, server_address, nome_arquivo, escritor, segmentos_ignorados, inicio=0, fim=None, rotulo="", fec=None,
+                 assinatura=None, progresso=None, digest_esperado=None):
+        self.server_address = server_address
+        self.nome_arquivo = nome_arquivo
+        self.escritor = escritor
+        self.segmentos_ignorados = segmentos_ignorados
+        self.inicio = inicio
+        self.fim = fim
+        self.rotulo = rotulo
+        self.segment_size = escritor.segment_size
+        self.buffers = BuffersRecepcao(BUFFERS_RECEPCAO, self.segment_size + SOBRECARGA_PACOTE) # Cabe o maior pacote (paridade)
+
+        # --- Estado da Recepção ---
+        self.metricas = MetricasTransferencia('cliente')
+        self.segmentos_corrompidos_log = set() # Apenas para log
+        self.eof_confirmado = False
+        self.erro_servidor = False
+        self.timeouts_consecutivos = 0
+        self.ultimo_ack_enviado = -1 # Para rastrear ACKs enviados
+        self.proximo_segmento_esperado = inicio
+        self.segmentos_fora_de_ordem = set() # Já gravados no disco, apenas aguardando os anteriores
+        self.digesto = novo_digesto(CHECKSUM)
+        self.pendentes_digesto = {} # {seq: (dados, buffer retido)} dos fora de ordem, até entrarem no digest
+        self.digest_invalido = False
+        self.fim_dados = fim if fim is not None else escritor.total_segmentos # None se o tamanho não é conhecido
+        self.progresso = progresso
+        self.digest_esperado = digest_esperado
+        self.verificada_localmente = False # Dados completos e digest conferido com o do INFO, antes do EOF
+        self.acks_pendentes = 0 # Segmentos em ordem ainda não confirmados (ACK atrasado)
+        self.prazo_ack = None   # Momento limite para enviar o ACK atrasado
+
+        # --- Estado do FEC ---
+        self.fec = fec
+        self.assinatura = assinatura
+        self.grupos_fec = {} # {(inicio_bloco, grupo): [xor_tamanhos, xor_inteiro, paridade]} dos segmentos já recebidos
+
+    def log(self, mensagem, nivel=NIVEL_INFO):
+        if nivel <= NIVEL_LOG:
+            print(f"{self.rotulo}{mensagem}")
+
+    @property
+    def total_segmentos_recebidos(self):
+        return self.metricas.contadores["segmentos_recebidos"]
+
+    @property
+    def concluida(self):
+        """EOF confirmado (ou dados completos e conferidos com o INFO), sem erro do servidor e sem lacunas na faixa."""
+        return ((self.eof_confirmado or self.verificada_localmente) and not self.erro_servidor
+                and not self.segmentos_fora_de_ordem and not self.digest_invalido)
+
+    @property
+    def dados_completos(self):
+        return self.fim_dados is not None and self.proximo_segmento_esperado >= self.fim_dados
+
+    def ao_completar(self):
+        """Última lacuna preenchida: confere o digest do INFO (se houver) e passa a esperar só o EOF."""
+        self.log(f"[COMPLETO] Todos os segmentos da faixa recebidos ({self.fim_dados - self.inicio}). Aguardando o EOF do servidor.")
+        self.metricas.entrar_fase('eof')
+        if self.digest_esperado is None:
+            return
+        if self.digesto.digest() == self.digest_esperado:
+            self.verificada_localmente = True
+        else:
+            self.log(f"[INTEGRIDADE] Digest {CHECKSUM} dos dados recebidos ({self.digesto.digest().hex()}) "
+                     f"difere do informado no INFO ({self.digest_esperado.hex()}).")
+            self.digest_invalido = True
+
+    def confirmar_segmentos(self):
+        """Envia imediatamente o ACK cumulativo + SACK do estado atual."""
+        send_ack(self.cliente, self.server_address, self.proximo_segmento_esperado, self.segmentos_fora_de_ordem)
+        self.metricas.contar("acks")
+        self.acks_pendentes = 0
+        self.prazo_ack = None
+
+    def executar(self):
+        try:
+            self.cliente = criar_socket(self.escritor.segment_size)
+        except socket.error as e:
+            self.log(f"Erro ao criar o socket: {e}")
+            return
+
+        # 2) --- Envio da Requisição Inicial ---
+        parametros = [f"segmento={self.segment_size}"]
+        if self.fim is not None: # Requisição de faixa
+            parametros += [f"inicio={self.inicio}", f"fim={self.fim}"]
+        if self.fec is not None:
+            parametros.append(f"fec={self.fec[0]}:{self.fec[1]}")
+        if COMPRESSAO:
+            parametros.append("codecs=" + ",".join(CODECS))
+        parametros.append(f"checksum={CHECKSUM}")
+        if self.assinatura is not None:
+            parametros.append(f"assinatura={self.assinatura}")
+        mensagem_get = f"GET /{self.nome_arquivo}" + ("?" + "&".join(parametros) if parametros else "")
+        self.requisicao = mensagem_get.encode(ENCODING)
+        try:
+            self.cliente.sendto(self.requisicao, self.server_address)
+            self.metricas.entrar_fase('requisicao')
+            resumo_get = mensagem_get[4:] if len(mensagem_get) <= 200 else f"{mensagem_get[4:200]}..." # Lotes podem ser longos
+            self.log(f"Solicitação enviada para {self.server_address[0]}:{self.server_address[1]}: '{resumo_get}'")
+        except socket.error as e:
+            self.log(f"Erro de socket ao enviar requisição GET: {e}")
+            self.cliente.close()
+            return
+
+        self.log("\nAguardando segmentos do arquivo...")
+        try:
+            self.receber()
+        finally:
+            self.log("Fechando o socket do cliente.")
+            self.cliente.close()
+            self.metricas.encerrar()
+
+    def receber(self):
+        """Loop de recepção dos segmentos e envio de ACKs, até o EOF (ou desistência)."""
+        cliente = self.cliente
+        while not self.eof_confirmado and self.timeouts_consecutivos < MAX_TIMEOUTS_CONSECUTIVOS:
+            try:
+                # Com um ACK atrasado pendente, espera só até o prazo dele
+                if self.prazo_ack is not None:
+                    cliente.settimeout(max(self.prazo_ack - time.time(), 0.0001))
+                dados, endereco_servidor = self.buffers.receber(cliente)
+                if self.prazo_ack is not None:
+                    cliente.settimeout(RECEIVE_TIMEOUT)
+
+                # Reinicia contador de timeouts se receber algo
+                self.timeouts_consecutivos = 0
+
+                # Verificar se é do servidor esperado
+                if endereco_servidor != self.server_address:
+                    self.log(f"Recebido pacote de endereço inesperado {endereco_servidor}. Ignorando.")
+                    continue
+                self.metricas.contar("bytes_rede", len(dados))
+
+                # --- Interpretar o cabeçalho binário ---
+                try:
+                    tipo, flags, numero_sequencia, segmento_dados, checksum_ok = analisar_pacote(dados)
+                except ValueError as e:
+                    self.log(f"Pacote malformado recebido: {e}. Ignorado. Dados: {bytes(dados[:60])}")
+                    continue
+
+                # 4) Validação do Checksum (cobre cabeçalho e payload)
+                if not checksum_ok:
+                    self.log(f"[CORRUPÇÃO] Checksum inválido para pacote (seq {numero_sequencia}). Ignorado. ACK NÃO enviado.")
+                    self.segmentos_corrompidos_log.add(numero_sequencia)
+                    self.metricas.contar("segmentos_corrompidos")
+                    continue # Não processa, não envia ACK
+
+                # --- Verificar mensagem de ERRO do servidor ---
+                if tipo == TIPO_ERRO:
+                    try:
+                        mensagem_erro = bytes(segmento_dados).decode(ENCODING)
+                        self.log(f"\n[ERRO DO SERVIDOR] {mensagem_erro}")
+                    except Exception: # Erro no decode
+                         self.log(f"\n[ERRO DO SERVIDOR] Mensagem de erro malformada recebida: {bytes(segmento_dados[:50])}")
+                    self.erro_servidor = True
+                    self.eof_confirmado = True # Considera fim, mas com erro
+                    break # Sai do loop principal
+
+                # --- Verificar mensagem de EOF do servidor ---
+                if tipo == TIPO_EOF:
+                     self.log("[EOF RECEBIDO] EOF recebido e validado.")
+                     if segmento_dados and segmento_dados != self.digesto.digest():
+                         if not self.digest_invalido:
+                             self.log(f"[INTEGRIDADE] Digest {CHECKSUM} dos dados recebidos ({self.digesto.digest().hex()}) "
+                                      f"difere do enviado pelo servidor ({segmento_dados.hex()}).")
+                         self.digest_invalido = True
+                     if self.metricas.fase_atual != 'eof':
+                         self.metricas.entrar_fase('eof')
+                     # Enviar ACK_EOF de forma confiável (tenta algumas vezes)
+                     ack_eof_msg = montar_pacote(TIPO_ACK_EOF, checksum=CHECKSUM)
+                     for i in range(3): # Tenta enviar ACK_EOF algumas vezes
+                          try:
+                              cliente.sendto(ack_eof_msg, self.server_address)
+                              self.log(f"ACK_EOF enviado (tentativa {i+1}).")
+                              self.eof_confirmado = True
+                              break
+                              # O servidor também retransmite EOF, então deve funcionar
+                          except Exception as e:
+                               self.log(f"Erro ao enviar ACK_EOF (tentativa {i+1}): {e}")
+                          time.sleep(0.1) # Pequena pausa entre envios de ACK_EOF
+                     continue # Processou EOF, espera próximo pacote (ou sai do loop)
+
+                # --- Processar Segmento de Dados (ou de Paridade) ---
+                if tipo in (TIPO_DADOS, TIPO_PARIDADE):
+                    try:
+                        if self.metricas.fase_atual == 'requisicao':
+                            self.metricas.entrar_fase('recepcao')
+                        if tipo == TIPO_DADOS:
+                            self.metricas.contar("bytes_payload", len(segmento_dados))
+                            segmento_dados = descomprimir_payload(flags, segmento_dados)
+                            self.processar_segmento(numero_sequencia, segmento_dados)
+                        else:
+                            self.processar_paridade(numero_sequencia, flags, segmento_dados)
+                    except OSError as e:
+                        self.log(f"Erro ao gravar segmento no arquivo de destino: {e}")
+                        self.eof_confirmado = False # Garante que não vai salvar
+                        break
+                    except Exception as e:
+                         self.log(f"Erro inesperado ao processar segmento {numero_sequencia}: {e}")
+                else:
+                    self.log(f"Pacote de tipo inesperado ({tipo}) recebido. Ignorado.")
+
+            except socket.timeout:
+                if self.prazo_ack is not None: # Era só o prazo do ACK atrasado
+                    cliente.settimeout(RECEIVE_TIMEOUT)
+                    self.confirmar_segmentos()
+                    continue
+                if self.verificada_localmente:
+                    self.log("EOF não chegou, mas os dados já estão completos e conferidos com o digest do INFO.")
+                    break
+                self.timeouts_consecutivos += 1
+                self.log(f"Timeout esperando por dados... ({self.timeouts_consecutivos}/{MAX_TIMEOUTS_CONSECUTIVOS})")
+                if not self.eof_confirmado and self.timeouts_consecutivos >= MAX_TIMEOUTS_CONSECUTIVOS:
+                     self.log("Número máximo de timeouts consecutivos atingido. Desistindo.")
+                     break # Sai do loop principal
+                if self.metricas.fase_atual == 'requisicao': # Nada chegou ainda: o GET pode ter se perdido
+                     self.log("Reenviando a requisição GET.")
+                     cliente.sendto(self.requisicao, self.server_address)
+                # Se não atingiu o max, continua esperando no loop
+
+            except ConnectionResetError:
+                 self.log("Erro: Servidor parece ter fechado a conexão inesperadamente (ConnectionResetError).")
+                 self.eof_confirmado = False # Garante que não vai salvar
+                 break
+            except Exception as e:
+                self.log(f"Erro inesperado no loop de recepção: {e}")
+                self.eof_confirmado = False # Garante que não vai salvar
+                break # Sai em caso de erro grave
+
+    def processar_segmento(self, numero_sequencia, segmento_dados):
+        # >>> SIMULAÇÃO DE PERDA <<<
+        if numero_sequencia in self.segmentos_ignorados:
+            self.log(f"[Simulação de perda] Segmento {numero_sequencia} ignorado. ACK NÃO enviado.")
+            # Opcional: Remover para permitir aceitação futura?
+            self.segmentos_ignorados.discard(numero_sequencia)
+            return # Pula o resto, não envia ACK
+
+        if self.fim is not None and not self.inicio <= numero_sequencia < self.fim:
+            self.log(f"Segmento {numero_sequencia} fora da faixa [{self.inicio}, {self.fim}). Ignorado.")
+            return
+
+        if self.aceitar_segmento(numero_sequencia, segmento_dados) and self.fec is not None:
+            self.acumular_fec(numero_sequencia, segmento_dados)
+
+    def aceitar_segmento(self, numero_sequencia, segmento_dados):
+        """Grava um segmento válido e envia o ACK; retorna True se ele ainda não tinha sido recebido."""
+        # Segmento Válido - Armazenar e Enviar ACK
+        self.ultimo_ack_enviado = max(self.ultimo_ack_enviado, numero_sequencia) # Atualiza log
+
+        if numero_sequencia == self.proximo_segmento_esperado:
+            self.log(f"Segmento {numero_sequencia} recebido OK (em ordem).", NIVEL_PACOTE)
+            self.escritor.escrever(numero_sequencia, segmento_dados)
+            self.digesto.update(segmento_dados)
+            self.metricas.contar("segmentos_recebidos")
+            self.metricas.contar("bytes_dados", len(segmento_dados))
+            if self.progresso is not None:
+                self.progresso.avancar(len(segmento_dados))
+            self.proximo_segmento_esperado += 1
+            preencheu_lacuna = bool(self.segmentos_fora_de_ordem)
+
+            while self.proximo_segmento_esperado in self.segmentos_fora_de_ordem:
+                # Já está no disco e foi confirmado (SACK) quando chegou
+                self.log(f"Segmento {self.proximo_segmento_esperado} (fora de ordem) agora está em sequência.", NIVEL_PACOTE)
+                self.segmentos_fora_de_ordem.discard(self.proximo_segmento_esperado)
+                dados_pendentes, buffer_retido = self.pendentes_digesto.pop(self.proximo_segmento_esperado)
+                self.digesto.update(dados_pendentes)
+                self.buffers.liberar(buffer_retido)
+                self.proximo_segmento_esperado += 1
+
+            self.acks_pendentes += 1
+            completou = self.dados_completos
+            if preencheu_lacuna or completou or not ACKS_ATRASADOS or self.acks_pendentes >= SEGMENTOS_POR_ACK:
+                self.confirmar_segmentos() # Envia ACK (o último segue na hora: o servidor só manda o EOF depois dele)
+            elif self.prazo_ack is None:
+                self.prazo_ack = time.time() + ATRASO_MAXIMO_ACK
+            if completou:
+                self.ao_completar()
+            return True
+
+        elif numero_sequencia > self.proximo_segmento_esperado:
+            novo = numero_sequencia not in self.segmentos_fora_de_ordem
+            if novo:
+                self.log(f"Segmento {numero_sequencia} recebido OK (fora de ordem). Gravando na posição do arquivo.", NIVEL_PACOTE)
+                self.escritor.escrever(numero_sequencia, segmento_dados)
+                self.segmentos_fora_de_ordem.add(numero_sequencia)
+                self.pendentes_digesto[numero_sequencia] = (segmento_dados, self.buffers.reter(segmento_dados))
+                self.metricas.contar("segmentos_recebidos")
+                self.metricas.contar("segmentos_fora_de_ordem")
+                self.metricas.contar("bytes_dados", len(segmento_dados))
+                if self.progresso is not None:
+                    self.progresso.avancar(len(segmento_dados))
+            else:
+                self.metricas.contar("segmentos_duplicados")
+            # Fora de ordem (novo ou duplicado): ACK imediato, para o servidor saber da lacuna
+            self.confirmar_segmentos()
+            return novo
+
+        else:
+            self.log(f"Segmento {numero_sequencia} duplicado (antigo) recebido.", NIVEL_PACOTE)
+            self.metricas.contar("segmentos_duplicados")
+            self.confirmar_segmentos() # Reenvia ACK para garantir
+            return False
+
+    def recebido(self, numero_sequencia):
+        return numero_sequencia < self.proximo_segmento_esperado or numero_sequencia in self.segmentos_fora_de_ordem
+
+    def acumular_fec(self, numero_sequencia, segmento_dados):
+        """Soma (XOR) um segmento novo ao seu grupo de paridade e tenta reconstruir o que falta."""
+        segmentos_por_bloco, paridades_no_bloco = self.fec
+        inicio_bloco = self.inicio + (numero_sequencia - self.inicio) // segmentos_por_bloco * segmentos_por_bloco
+        chave = (inicio_bloco, (numero_sequencia - inicio_bloco) % paridades_no_bloco)
+        grupo = self.grupos_fec.setdefault(chave, [0, 0, None])
+        xor_tamanhos, xor_inteiro, _ = xor_segmentos([segmento_dados], self.segment_size)
+        grupo[0] ^= xor_tamanhos
+        grupo[1] ^= xor_inteiro
+        self.tentar_recuperar(chave)
+
+    def processar_paridade(self, inicio_bloco, indice_grupo, payload):
+        self.metricas.contar("paridades")
+        if self.fec is None:
+            self.log(f"Paridade do bloco {inicio_bloco} recebida sem FEC pedido. Ignorada.")
+            return
+        try:
+            segmentos_no_bloco, paridades_no_bloco, xor_tamanhos, xor_inteiro = ler_paridade(payload, self.segment_size)
+        except ValueError as e:
+            self.log(f"Paridade malformada recebida: {e}. Ignorada.")
+            return
+        if paridades_no_bloco != self.fec[1] or indice_grupo >= paridades_no_bloco or segmentos_no_bloco > self.fec[0]:
+            self.log(f"Paridade do bloco {inicio_bloco} não corresponde ao FEC pedido {self.fec}. Ignorada.")
+            return
+        chave = (inicio_bloco, indice_grupo)
+        self.grupos_fec.setdefault(chave, [0, 0, None])[2] = (segmentos_no_bloco, xor_tamanhos, xor_inteiro)
+        self.tentar_recuperar(chave)
+
+    def tentar_recuperar(self, chave):
+        """Se falta só um segmento do grupo e a paridade chegou, reconstrói esse segmento."""
+        grupo = self.grupos_fec[chave]
+        inicio_bloco, indice_grupo = chave
+        segmentos_por_bloco, paridades_no_bloco = self.fec
+        segmentos_no_bloco = grupo[2][0] if grupo[2] is not None else segmentos_por_bloco
+        faltando = [seq for seq in range(inicio_bloco + indice_grupo, inicio_bloco + segmentos_no_bloco, paridades_no_bloco)
+                    if not self.recebido(seq)]
+        if not faltando: # Grupo completo: a paridade não é mais necessária
+            del self.grupos_fec[chave]
+            return
+        if len(faltando) > 1 or grupo[2] is None:
+            return
+        _, xor_tamanhos, xor_inteiro = grupo[2]
+        tamanho = xor_tamanhos ^ grupo[0]
+        del self.grupos_fec[chave]
+        if tamanho > self.segment_size:
+            self.log(f"[FEC] Paridade inconsistente para o segmento {faltando[0]}. Aguardando retransmissão.")
+            return
+        self.log(f"[FEC] Segmento {faltando[0]} reconstruído a partir da paridade do bloco {inicio_bloco}.")
+        self.metricas.contar("segmentos_recuperados_fec")
+        self.aceitar_segmento(faltando[0], (xor_inteiro ^ grupo[1]).to_bytes(self.segment_size, "big")[:tamanho])
+
+    def relatar_falha(self):
+        """Explica por que esta faixa não foi concluída."""
+        if self.digest_invalido:
+            self.log("[ERRO FINAL] Transferência concluída, mas o digest dos dados não confere com o do servidor. Arquivo descartado.")
+        elif self.eof_confirmado and not self.erro_servidor:
+            self.log(f"[ERRO FINAL] Transferência concluída, mas restaram {len(self.segmentos_fora_de_ordem)} segmentos fora de ordem: {sorted(self.segmentos_fora_de_ordem)}.")
+            self.log(f"Isso indica que segmentos anteriores a estes nunca foram recebidos (falta o segmento {self.proximo_segmento_esperado}).")
+        elif self.timeouts_consecutivos >= MAX_TIMEOUTS_CONSECUTIVOS:
+            self.log("\n[ERRO FINAL] Transferência falhou devido a timeouts excessivos esperando dados do servidor.")
+            self.log(f"Próximo segmento que era esperado em ordem: {self.proximo_segmento_esperado}")
+            self.log(f"Segmentos recebidos fora de ordem: {sorted(self.segmentos_fora_de_ordem)}")
+            self.log(f"Total de segmentos recebidos e validados (em ordem + fora de ordem): {self.total_segmentos_recebidos}")
+            self.log(f"Último ACK enviado foi para (aprox): {self.ultimo_ack_enviado}") # Nota: ACKs agora são mais frequentes
+        else: # Falha por outro motivo (Erro do servidor, EOF não confirmado, etc)
+            self.log("\n[ERRO FINAL] Transferência não concluída com sucesso.")
+            if not self.eof_confirmado and self.total_segmentos_recebidos > 0:
+                self.log("EOF não foi confirmado pelo servidor.")
+
+
+def baixar_lote(server_address, nomes_arquivos, segmentos_ignorados, fec):
+    """Baixa vários arquivos em uma única sessão (um só GET e um só EOF).
+
+    Retorna (métricas, arquivos salvos, {arquivo: motivo da falha}). Os
+    arquivos só são salvos se o lote terminar com o digest do EOF
+    conferido; senão nenhum fica no disco, como no download simples.
+    """
+    segment_size, tamanhos, mensagem_erro = consultar_lote(server_address, nomes_arquivos)
+    if tamanhos is None:
+        motivo = mensagem_erro or "servidor não respondeu ao INFO"
+        return None, [], {nome: motivo for nome in nomes_arquivos}
+    falhas = {nome: "não encontrado no servidor" for nome, tamanho in zip(nomes_arquivos, tamanhos) if tamanho is None}
+    tamanho_total = sum(tamanho or 0 for tamanho in tamanhos)
+    recusa = verificar_limites(tamanho_total)
+    if recusa is not None:
+        return None, [], {nome: f"lote recusado: {recusa}" for nome in nomes_arquivos}
+    escritor = EscritorLote([f"recebido_{nome}" for nome in nomes_arquivos], tamanhos, segment_size)
+    print(f"Lote de {len(nomes_arquivos)} arquivos: {tamanho_total} bytes em "
+          f"{escritor.total_segmentos} segmentos de {segment_size} bytes.")
+    recepcao = RecepcaoFaixa(server_address, "/".join(nomes_arquivos), escritor, segmentos_ignorados, fec=fec,
+                             assinatura=assinatura_lote(tamanhos, segment_size),
+                             progresso=Progresso(tamanho_total) if MOSTRAR_PROGRESSO else None)
+    recepcao.executar()
+    if recepcao.concluida:
+        escritor.concluir()
+    else:
+        recepcao.relatar_falha()
+        escritor.descartar()
+    salvos = []
+    motivo = "digest do lote não confere com o do servidor" if recepcao.digest_invalido else "transferência do lote não foi concluída"
+    for fluxo, nome in enumerate(nomes_arquivos):
+        if fluxo in escritor.concluidos:
+            salvos.append(nome)
+        elif nome not in falhas:
+            falhas[nome] = motivo
+    return recepcao.metricas, salvos, falhas
+
 
 # --- Obter informações do usuário ---
 while True:
@@ -47,8 +977,10 @@ while True:
         print("Porta inválida. Por favor, digite um número inteiro.")
 
 while True:
-    nome_arquivo = input("Digite o nome do arquivo que deseja solicitar (ex: meu_arquivo.txt): ")
-    if nome_arquivo: # Verifica se não está vazio
+    nome_arquivo = input("Digite o nome do arquivo que deseja solicitar (ex: meu_arquivo.txt), ou vários separados por vírgula: ")
+    nomes_arquivos = [nome.strip() for nome in nome_arquivo.split(",") if nome.strip()]
+    if nomes_arquivos: # Verifica se não está vazio
+         nome_arquivo = nomes_arquivos[0]
          break
     else:
          print("Nome do arquivo não pode ser vazio.")
@@ -64,257 +996,179 @@ if segmentos_ignorados_str.strip():
     except ValueError:
         print("Entrada inválida para segmentos a ignorar. Nenhum segmento será ignorado.")
 
-# --- Inicialização do Socket ---
-try:
-    cliente = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+# Download paralelo: o arquivo é dividido em faixas, cada uma em um socket/sessão
+fluxos_str = input(f"Digite o número de fluxos paralelos (1 a {MAX_FLUXOS_PARALELOS}), ou deixe em branco para 1: ")
+fluxos = 1
+if fluxos_str.strip():
+    try:
+        fluxos = min(max(int(fluxos_str), 1), MAX_FLUXOS_PARALELOS)
+    except ValueError:
+        print("Entrada inválida para fluxos paralelos. Usando 1 fluxo.")
 
-    # Tentar aumentar o buffer de recebimento (SO_RCVBUF) - Opcional, mas pode ajudar
+# FEC: o servidor manda K segmentos de paridade a cada N de dados e o cliente reconstrói perdas sem retransmissão
+fec_str = input("Digite a proporção de FEC como N:K (K paridades a cada N segmentos, ex: 8:1), ou deixe em branco para desativar: ")
+fec = None
+if fec_str.strip():
     try:
-        default_rcvbuf = cliente.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-        print(f"Tamanho original do buffer de recebimento (SO_RCVBUF): {default_rcvbuf}")
-        new_rcvbuf = 2 * 1024 * 1024 # Tentar 2MB
-        cliente.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, new_rcvbuf)
-        actual_rcvbuf = cliente.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-        print(f"Tentativa de definir SO_RCVBUF para {new_rcvbuf}, valor atual: {actual_rcvbuf}")
-    except Exception as e:
-        print(f"Aviso: Não foi possível alterar SO_RCVBUF: {e}")
+        segmentos_por_bloco, paridades_no_bloco = map(int, fec_str.strip().split(":"))
+        if not 1 <= paridades_no_bloco <= segmentos_por_bloco <= FEC_MAXIMO_BLOCO:
+            raise ValueError
+        fec = (segmentos_por_bloco, paridades_no_bloco)
+    except ValueError:
+        print(f"Entrada inválida para FEC (use N:K com 1 <= K <= N <= {FEC_MAXIMO_BLOCO}). FEC desativado.")
 
-    # Definir timeout principal para recebimento
-    cliente.settimeout(RECEIVE_TIMEOUT)
+server_address = (ip_servidor, porta_servidor)
 
-except socket.error as e:
-    print(f"Erro ao criar o socket: {e}")
+# --- Vários Arquivos: uma sessão por lote, com um fluxo por arquivo ---
+if len(nomes_arquivos) > 1:
+    if fluxos > 1:
+        print("Download em lote usa um único fluxo por lote. Ignorando os fluxos paralelos.")
+    metricas_download = MetricasTransferencia('cliente', arquivo=f"lote de {len(nomes_arquivos)} arquivos")
+    metricas_download.transferencias = 0
+    salvos, falhas = [], {}
+    for lote in dividir_em_lotes(nomes_arquivos):
+        metricas_lote, salvos_lote, falhas_lote = baixar_lote(server_address, lote, segmentos_ignorados, fec)
+        if metricas_lote is not None:
+            metricas_download.somar(metricas_lote)
+        salvos += salvos_lote
+        falhas.update(falhas_lote)
+    metricas_download.encerrar()
+    print(f"\n{len(salvos)} de {len(nomes_arquivos)} arquivos recebidos e salvos como 'recebido_<nome>'.")
+    for nome, motivo in falhas.items():
+        print(f"[ERRO] '{nome}': {motivo}.")
+    print(f"\n[MÉTRICAS] {metricas_download.resumo()}")
+    if EXPORTAR_METRICAS == 'json':
+        exportar_metricas(metricas_download, 'json', ARQUIVO_METRICAS + ".jsonl")
+    elif EXPORTAR_METRICAS == 'prometheus':
+        exportar_metricas(metricas_download, 'prometheus', ARQUIVO_METRICAS + ".prom")
     exit()
-except Exception as e:
-     print(f"Erro inesperado na inicialização: {e}")
-     exit()
 
-# 2) --- Envio da Requisição Inicial ---
-mensagem_get = f"GET /{nome_arquivo}"
-server_address = (ip_servidor, porta_servidor)
+# --- Metadados do Arquivo Remoto (diário, divisão em faixas, progresso e conferência final) ---
+tamanho_arquivo, segment_size, versao_arquivo, digest_arquivo, mensagem_erro = consultar_metadados(server_address, nome_arquivo)
+if mensagem_erro is not None:
+    print(f"\n[ERRO DO SERVIDOR] {mensagem_erro}")
+    print("\n[ERRO FINAL] Transferência não concluída com sucesso.")
+    exit()
+if tamanho_arquivo is None:
+    print("Não foi possível obter o tamanho do arquivo. Download em 1 fluxo, sem diário para retomada.")
+else:
+    print(f"Arquivo remoto: {tamanho_arquivo} bytes em {math.ceil(tamanho_arquivo / segment_size)} segmentos de {segment_size} bytes"
+          f"{f' (digest {CHECKSUM} {digest_arquivo.hex()})' if digest_arquivo else ''}.")
+    recusa = verificar_limites(tamanho_arquivo)
+    if recusa is not None:
+        print(f"\n[RECUSADO] Download não iniciado: {recusa}.")
+        exit()
+
+# --- Arquivo de Destino ---
+nome_arquivo_local = f"recebido_{nome_arquivo}"
 try:
-    cliente.sendto(mensagem_get.encode(ENCODING), server_address)
-    print(f"Solicitação enviada para {ip_servidor}:{porta_servidor}: '{nome_arquivo}'")
-except socket.error as e:
-    print(f"Erro de socket ao enviar requisição GET: {e}")
-    cliente.close()
+    escritor = EscritorArquivo(nome_arquivo_local, tamanho_arquivo, segment_size, versao_arquivo)
+except OSError as e:
+    print(f"Erro ao criar o arquivo de destino '{nome_arquivo_local}': {e}")
     exit()
-except Exception as e:
-     print(f"Erro inesperado ao enviar GET: {e}")
-     cliente.close()
-     exit()
 
+# --- Divisão em Faixas ---
+faixas = [(0, None)] # Arquivo inteiro em uma única requisição
+if escritor.retomado:
+    # Retomada: pede ao servidor só o que falta
+    faixas = escritor.faixas_faltando()
+    print(f"Retomando download: {escritor.segmentos_retomados} de {escritor.total_segmentos} segmentos já estavam no disco. "
+          f"Pedindo {len(faixas)} faixa(s) faltante(s): {faixas[:5]}{' ...' if len(faixas) > 5 else ''}")
+elif fluxos > 1 and tamanho_arquivo is not None:
+    total_segmentos = escritor.total_segmentos
+    fluxos = min(fluxos, max(total_segmentos, 1))
+    # Divisão equilibrada: com ceil por fluxo, as últimas faixas podiam ficar vazias (ex.: 5 segmentos em 4 fluxos)
+    faixas = [(i * total_segmentos // fluxos, (i + 1) * total_segmentos // fluxos) for i in range(fluxos)]
+    print(f"Arquivo com {tamanho_arquivo} bytes ({total_segmentos} segmentos) será baixado em {len(faixas)} fluxos paralelos.")
 
 # --- Recepção dos Segmentos e Envio de ACKs ---
-segmentos_recebidos = {}
-segmentos_corrompidos_log = set() # Apenas para log
-eof_confirmado = False
-timeouts_consecutivos = 0
-ultimo_ack_enviado = -1 # Para rastrear ACKs enviados
-proximo_segmento_esperado = 0
-segmentos_fora_de_ordem = {} 
-
-print("\nAguardando segmentos do arquivo...")
-
-while not eof_confirmado and timeouts_consecutivos < MAX_TIMEOUTS_CONSECUTIVOS:
-    try:
-        dados, endereco_servidor = cliente.recvfrom(BUFFER_SIZE)
-
-        # Reinicia contador de timeouts se receber algo
-        timeouts_consecutivos = 0
-
-        # Verificar se é do servidor esperado
-        if endereco_servidor != server_address:
-            print(f"Recebido pacote de endereço inesperado {endereco_servidor}. Ignorando.")
-            continue
-
-        # --- Verificar mensagem de ERRO do servidor ---
-        # Supõe formato "Erro|Mensagem"
-        is_error = False
-        if len(dados) > 5 and dados[:5] == b"Erro|":
-            try:
-                mensagem_erro = dados.split(b"|", 1)[1].decode(ENCODING)
-                print(f"\n[ERRO DO SERVIDOR] {mensagem_erro}")
-            except Exception: # Erro no split ou decode
-                 print(f"\n[ERRO DO SERVIDOR] Mensagem de erro malformada recebida: {dados[:50]}")
-            eof_confirmado = True # Considera fim, mas com erro
-            break # Sai do loop principal
-
-        # --- Verificar mensagem de EOF do servidor ---
-        # Supõe formato "EOF|HASH"
-        is_eof = False
-        if len(dados) > 4 and dados[:4] == b"EOF|":
-             is_eof = True
-             try:
-                 hash_eof_recv = dados.split(b"|")[1]
-                 if calculate_hash(b"EOF") == hash_eof_recv:
-                      print("[EOF RECEBIDO] EOF recebido e validado.")
-                      # Enviar ACK_EOF de forma confiável (tenta algumas vezes)
-                      ack_eof_msg = b"ACK_EOF"
-                      for i in range(3): # Tenta enviar ACK_EOF algumas vezes
-                           try:
-                               cliente.sendto(ack_eof_msg, server_address)
-                               print(f"ACK_EOF enviado (tentativa {i+1}).")
-                               eof_confirmado = True
-                               break
-                               # Consideramos confirmado após enviar algumas vezes
-                               # O servidor também retransmite EOF, então deve funcionar
-                           except Exception as e:
-                                print(f"Erro ao enviar ACK_EOF (tentativa {i+1}): {e}")
-                           time.sleep(0.1) # Pequena pausa entre envios de ACK_EOF
-                     # eof_confirmado = True
-                      #break # Sai do loop principal, EOF confirmado
-                 else:
-                      print("[CORRUPÇÃO EOF] Hash inválido no EOF recebido. Ignorado.")
-                      # Não envia ACK_EOF, espera servidor reenviar EOF
-             except Exception as e:
-                  print(f"Erro ao processar EOF: {e}. Ignorado.")
-             continue # Processou EOF (bem ou mal), espera próximo pacote
-
-
-        # --- Processar Segmento de Dados ---
-        if not is_error and not is_eof:
+metricas_download = MetricasTransferencia('cliente', arquivo=nome_arquivo) # Soma das faixas
+metricas_download.transferencias = 0
+progresso = None
+if MOSTRAR_PROGRESSO and tamanho_arquivo is not None:
+    progresso = Progresso(tamanho_arquivo, min(escritor.segmentos_retomados * segment_size, tamanho_arquivo))
+# Faixa única com o arquivo inteiro: o digest do INFO é conferido na própria recepção; senão, relendo o arquivo no fim
+digest_na_recepcao = digest_arquivo if faixas == [(0, None)] else None
+recepcoes = [RecepcaoFaixa(server_address, nome_arquivo, escritor, segmentos_ignorados, inicio, fim,
+                           rotulo=f"[faixa {i + 1}] " if len(faixas) > 1 else "", fec=fec,
+                           progresso=progresso, digest_esperado=digest_na_recepcao)
+             for i, (inicio, fim) in enumerate(faixas)]
+if len(recepcoes) == 1:
+    recepcoes[0].executar()
+else:
+    # Até 'fluxos' faixas ao mesmo tempo, cada uma em seu socket/thread
+    pendentes = list(recepcoes)
+    def trabalhador():
+        while pendentes:
             try:
-                # Formato: SEQ(4)|HASH(32)|PAYLOAD
-                partes = dados.split(b"|", 2) # Separa SEQ, HASH, PAYLOAD
-                
-                if len(partes) < 3:
-                     print(f"Segmento de dados malformado. Ignorado.")
-                     continue
-                
-                seq_num_bytes = partes[0]
-                hash_recebido = partes[1] # Hash já está em bytes codificados
-                segmento_dados = partes[2]
-                numero_sequencia = int(seq_num_bytes.decode(ENCODING))
-
-                # >>> SIMULAÇÃO DE PERDA <<<
-                if numero_sequencia in segmentos_ignorados:
-                    print(f"[Simulação de perda] Segmento {numero_sequencia} ignorado. ACK NÃO enviado.")
-                    # Opcional: Remover para permitir aceitação futura?
-                    segmentos_ignorados.discard(numero_sequencia)
-                    continue # Pula o resto, não envia ACK
-
-                # 4) Validação de Hash
-                hash_calculado = calculate_hash(segmento_dados)
-                if hash_calculado != hash_recebido:
-                    print(f"[CORRUPÇÃO] Hash inválido para segmento {numero_sequencia}. Ignorado. ACK NÃO enviado.")
-                    segmentos_corrompidos_log.add(numero_sequencia)
-                    continue # Não processa, não envia ACK
-
-                # Segmento Válido - Armazenar e Enviar ACK
-                ultimo_ack_enviado = max(ultimo_ack_enviado, numero_sequencia) # Atualiza log
-            
-                if numero_sequencia == proximo_segmento_esperado:
-                    print(f"Segmento {numero_sequencia} recebido OK (em ordem).")
-                    segmentos_recebidos[numero_sequencia] = segmento_dados
-                    send_ack(cliente, server_address, numero_sequencia, ENCODING) # Envia ACK
-                    proximo_segmento_esperado += 1
-
-                    while proximo_segmento_esperado in segmentos_fora_de_ordem:
-                        print(f"Processando segmento {proximo_segmento_esperado} do buffer.")
-                        segmento_buffered = segmentos_fora_de_ordem.pop(proximo_segmento_esperado)
-                        segmentos_recebidos[proximo_segmento_esperado] = segmento_buffered
-                        # ACK já foi enviado quando ele entrou no buffer
-                        proximo_segmento_esperado += 1
-
-                elif numero_sequencia > proximo_segmento_esperado:
-                    # Duplicado válido - Reenviar ACK
-                    # print(f"Segmento {numero_sequencia} duplicado válido recebido.")
-                    if numero_sequencia not in segmentos_fora_de_ordem and numero_sequencia not in segmentos_recebidos:
-                        print(f"Segmento {numero_sequencia} recebido OK (fora de ordem). Armazenando no buffer.")
-                        segmentos_fora_de_ordem[numero_sequencia] = segmento_dados
-                        send_ack(cliente, server_address, numero_sequencia, ENCODING) # Envia ACK imediatamente
-                    else:
-                         # Duplicado de algo já no buffer ou já processado
-                         # print(f"Segmento {numero_sequencia} duplicado (fora de ordem) recebido.")
-                         send_ack(cliente, server_address, numero_sequencia, ENCODING) # Reenvia ACK
-
-
-                else:
-                    print(f"Segmento {numero_sequencia} duplicado (antigo) recebido.")
-                    send_ack(cliente, server_address, numero_sequencia, ENCODING) # Reenvia ACK para garantir
-
-            except (ValueError, IndexError, UnicodeDecodeError) as e:
-                seq_bytes_repr = seq_num_bytes if 'seq_num_bytes' in locals() else b'N/A'
-                print(f"Erro ao processar segmento de dados (SeqBytes: {seq_bytes_repr}): {e}. Ignorado. Dados: {dados[:60]}")
-                continue
-            except Exception as e:
-                 print(f"Erro inesperado ao processar segmento: {e}")
-
-    except socket.timeout:
-        timeouts_consecutivos += 1
-        print(f"Timeout esperando por dados... ({timeouts_consecutivos}/{MAX_TIMEOUTS_CONSECUTIVOS})")
-        if not eof_confirmado and timeouts_consecutivos >= MAX_TIMEOUTS_CONSECUTIVOS:
-             print("Número máximo de timeouts consecutivos atingido. Desistindo.")
-             break # Sai do loop principal
-        # Se não atingiu o max, continua esperando no loop
-
-    except ConnectionResetError:
-         print("Erro: Servidor parece ter fechado a conexão inesperadamente (ConnectionResetError).")
-         eof_confirmado = False # Garante que não vai salvar
-         break
-    except Exception as e:
-        print(f"Erro inesperado no loop de recepção: {e}")
-        eof_confirmado = False # Garante que não vai salvar
-        break # Sai em caso de erro grave
-
+                recepcao = pendentes.pop(0)
+            except IndexError:
+                return
+            recepcao.executar()
+    threads = [threading.Thread(target=trabalhador) for _ in range(min(fluxos, len(recepcoes)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+# --- Verificação Final ---
+for recepcao in recepcoes:
+    metricas_download.somar(recepcao.metricas)
+metricas_download.encerrar()
+arquivo_salvo = False
+digest_final_invalido = False
+total_segmentos_recebidos = metricas_download.contadores["segmentos_recebidos"]
+concluidas = all(recepcao.concluida for recepcao in recepcoes) # EOF (ou digest do INFO) em todas as faixas, sem erro e sem lacunas
+if concluidas and digest_arquivo is not None and digest_na_recepcao is None:
+    # Várias faixas ou retomada: cada EOF só cobre a sua faixa; o arquivo montado é conferido inteiro
+    print("\nConferindo o arquivo montado com o digest informado pelo servidor...")
+    if escritor.digest(CHECKSUM) != digest_arquivo:
+        print(f"[INTEGRIDADE] Digest {CHECKSUM} do arquivo montado difere do informado no INFO ({digest_arquivo.hex()}).")
+        digest_final_invalido = True
+        concluidas = False
+if concluidas:
+    print("\nTransferência concluída. Verificando integridade final...")
+    # Os dados já estão no disco; as lacunas e os digests foram conferidos em cada faixa.
 
-# --- Verificação Final e Montagem ---
-if eof_confirmado and not any(isinstance(v, bytes) and v.startswith(b"Erro|") for v in segmentos_recebidos.values()): # Checa se EOF foi confirmado E não houve erro explícito do servidor
-    print("\nTransferência concluída (EOF confirmado). Verificando integridade final...")
-    # Idealmente, precisaríamos saber o número total de segmentos esperado do EOF
-    # para garantir que não faltou nada, mas a lógica de ACKs no servidor
-    # já garante isso se a janela deslizante chegou ao fim (base == total_segmentos).
-    # Vamos apenas montar o que temos em ordem.
-
-    if not segmentos_recebidos:
+    if total_segmentos_recebidos == 0:
          print("Nenhum segmento de dados foi recebido.")
-    elif len(segmentos_fora_de_ordem) > 0:
-         print(f"[ERRO FINAL] Transferência concluída, mas restaram {len(segmentos_fora_de_ordem)} segmentos no buffer fora de ordem: {sorted(segmentos_fora_de_ordem.keys())}.")
-         print("Isso indica que segmentos anteriores a estes nunca foram recebidos.")
-         # Você pode optar por salvar o arquivo parcial ou não aqui.
-    else:
-        print("Montando o arquivo...")
-        arquivo_completo = b""
-        chaves_ordenadas = sorted(segmentos_recebidos.keys())
-        expected_final_check = 0
-        completo = True
-        for chave in chaves_ordenadas:
-            if chave == expected_final_check:
-                arquivo_completo += segmentos_recebidos[chave]
-                expected_final_check += 1
-            else:
-                print(f"[ERRO DE MONTAGEM FINAL] Falta o segmento {expected_final_check}. Sequência quebrada em {chave}.")
-                completo = False
-                break
+    try:
+        escritor.concluir()
+        arquivo_salvo = True
+        print(f"Arquivo '{nome_arquivo}' recebido ({escritor.tamanho_final} bytes) e salvo como '{nome_arquivo_local}'.")
+        print(f"Número total de segmentos de dados recebidos: {total_segmentos_recebidos}")
+        segmentos_corrompidos_log = set().union(*(recepcao.segmentos_corrompidos_log for recepcao in recepcoes))
+        if segmentos_corrompidos_log:
+             print(f"Segmentos detectados como corrompidos (e ignorados): {sorted(list(segmentos_corrompidos_log))}")
+        bytes_payload = metricas_download.contadores["bytes_payload"]
+        bytes_dados = metricas_download.contadores["bytes_dados"]
+        if bytes_payload < bytes_dados:
+             print(f"Compressão: {bytes_payload} bytes de dados recebidos pela rede para {bytes_dados} bytes gravados ({bytes_payload / bytes_dados:.0%}).")
+        if fec is not None:
+             print(f"Segmentos reconstruídos por FEC (sem retransmissão): {metricas_download.contadores['segmentos_recuperados_fec']}")
 
-        if completo:
-             # Salvar o arquivo recebido localmente
-             nome_arquivo_local = f"recebido_{nome_arquivo}"
-             try:
-                 with open(nome_arquivo_local, 'wb') as arquivo_destino:
-                     arquivo_destino.write(arquivo_completo)
-                 print(f"Arquivo '{nome_arquivo}' recebido ({len(arquivo_completo)} bytes) e salvo como '{nome_arquivo_local}'.")
-                 print(f"Número total de segmentos de dados recebidos: {len(segmentos_recebidos)}")
-                 if segmentos_corrompidos_log:
-                      print(f"Segmentos detectados como corrompidos (e ignorados): {sorted(list(segmentos_corrompidos_log))}")
-
-             except IOError as e:
-                 print(f"Erro ao salvar o arquivo recebido: {e}")
-        else:
-             print("Arquivo não foi salvo devido a segmentos faltando na sequência final.")
-
-elif timeouts_consecutivos >= MAX_TIMEOUTS_CONSECUTIVOS :
-    print("\n[ERRO FINAL] Transferência falhou devido a timeouts excessivos esperando dados do servidor.")
-    print(f"Próximo segmento que era esperado em ordem: {proximo_segmento_esperado}")
-    print(f"Segmentos recebidos fora de ordem (no buffer): {sorted(segmentos_fora_de_ordem.keys())}")
-    print(f"Total de segmentos recebidos e validados (em ordem + fora de ordem): {len(segmentos_recebidos) + len(segmentos_fora_de_ordem)}")
-    print(f"Último ACK enviado foi para (aprox): {ultimo_ack_enviado}") # Nota: ACKs agora são mais frequentes
-else: # Falha por outro motivo (Erro do servidor, EOF não confirmado, etc)
-     print("\n[ERRO FINAL] Transferência não concluída com sucesso.")
-     if not eof_confirmado and len(segmentos_recebidos) > 0:
-          print("EOF não foi confirmado pelo servidor.")
+    except OSError as e:
+        print(f"Erro ao salvar o arquivo recebido: {e}")
+else:
+    for recepcao in recepcoes:
+        if not recepcao.concluida:
+            recepcao.relatar_falha()
+    if digest_final_invalido:
+        print("[ERRO FINAL] Todas as faixas terminaram, mas o arquivo montado não confere com o servidor. Arquivo descartado.")
+    print("Arquivo não foi salvo.")
+
+# --- Métricas ---
+print(f"\n[MÉTRICAS] {metricas_download.resumo()}")
+if EXPORTAR_METRICAS == 'json':
+    exportar_metricas(metricas_download, 'json', ARQUIVO_METRICAS + ".jsonl")
+elif EXPORTAR_METRICAS == 'prometheus':
+    exportar_metricas(metricas_download, 'prometheus', ARQUIVO_METRICAS + ".prom")
 
 # --- Finalização ---
-print("Fechando o socket do cliente.")
-cliente.close()
\ No newline at end of file
+if not arquivo_salvo:
+    # Com o digest inválido não há como saber quais segmentos estão errados: retomar reaproveitaria o erro
+    digest_invalido = digest_final_invalido or any(recepcao.digest_invalido for recepcao in recepcoes)
+    if escritor.recebidos is not None and any(escritor.recebidos) and not digest_invalido:
+        escritor.pausar()
+        print(f"Dados parciais mantidos em '{escritor.caminho_parcial}'. Execute novamente para retomar o download.")
+    else:
+        escritor.descartar()
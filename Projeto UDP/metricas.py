@@ -0,0 +1,207 @@
+import json
+import os
+import time
+from bisect import bisect_left
+
+# --- Níveis de Log ---
+# NIVEL_LOG (em cada script) escolhe até onde os prints vão. Logs por pacote
+# ficam em NIVEL_PACOTE: com eles ligados o loop de recepção/envio fica bem
+# mais lento, então só servem para depuração.
+NIVEL_ERRO = 0
+NIVEL_INFO = 1
+NIVEL_PACOTE = 2
+
+# Limites superiores (segundos) dos baldes do histograma de RTT
+LIMITES_RTT = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Contadores de uma transferência: (nome, descrição)
+CONTADORES = (
+    ("segmentos_enviados", "Segmentos de dados enviados pela primeira vez"),
+    ("segmentos_retransmitidos", "Segmentos de dados reenviados após timeout"),
+    ("segmentos_confirmados", "Segmentos de dados confirmados por ACK"),
+    ("segmentos_recebidos", "Segmentos de dados novos recebidos e gravados"),
+    ("segmentos_corrompidos", "Pacotes descartados por checksum inválido"),
+    ("segmentos_fora_de_ordem", "Segmentos novos recebidos fora de ordem"),
+    ("segmentos_duplicados", "Segmentos de dados recebidos de novo"),
+    ("segmentos_recuperados_fec", "Segmentos reconstruídos a partir da paridade"),
+    ("paridades", "Pacotes de paridade (FEC) enviados ou recebidos"),
+    ("acks", "ACKs enviados ou recebidos"),
+    ("bytes_rede", "Bytes de datagramas enviados ou recebidos na transferência"),
+    ("bytes_payload", "Bytes de payload dos segmentos de dados como trafegaram (comprimidos ou não)"),
+    ("bytes_dados", "Bytes do arquivo entregues (base do goodput)"),
+)
+
+
+def escapar_rotulo(valor):
+    """Escapa um valor de rótulo para o formato texto do Prometheus (barra invertida, aspas e quebra de linha)."""
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricasTransferencia:
+    """Contadores, histograma de RTT e tempo em cada fase de uma transferência.
+
+    Também serve para agregar várias transferências (somar): o servidor
+    mantém o total desde que iniciou e o cliente soma as faixas paralelas.
+    Em um total que atravessa períodos ociosos, tempo_ativo = 0.0 faz o
+    goodput usar a soma das durações das transferências somadas, e não o
+    tempo desde a criação do total.
+    """
+
+    def __init__(self, papel, **rotulos):
+        self.papel = papel # 'servidor' ou 'cliente'
+        self.rotulos = rotulos
+        self.contadores = {nome: 0 for nome, _ in CONTADORES}
+        self.histograma_rtt = [0] * (len(LIMITES_RTT) + 1) # Último balde = acima do maior limite
+        self.soma_rtt = 0.0
+        self.amostras_rtt = 0
+        self.fases = {} # {fase: segundos}
+        self.fase_atual = None
+        self.inicio_fase = None
+        self.transferencias = 1
+        self.tempo_ativo = None # Soma das durações das transferências somadas (None = usa a duração)
+        self.inicio = time.time()
+        self.fim = None
+
+    def contar(self, nome, quantidade=1):
+        self.contadores[nome] += quantidade
+
+    def observar_rtt(self, rtt):
+        self.histograma_rtt[bisect_left(LIMITES_RTT, rtt)] += 1
+        self.soma_rtt += rtt
+        self.amostras_rtt += 1
+
+    def entrar_fase(self, fase):
+        """Fecha a fase atual (acumulando o tempo gasto nela) e começa outra."""
+        agora = time.time()
+        if self.fase_atual is not None:
+            self.fases[self.fase_atual] = self.fases.get(self.fase_atual, 0.0) + agora - self.inicio_fase
+        self.fase_atual = fase
+        self.inicio_fase = agora
+
+    def encerrar(self):
+        self.entrar_fase(None)
+        self.fim = time.time()
+
+    @property
+    def duracao(self):
+        return (self.fim if self.fim is not None else time.time()) - self.inicio
+
+    @property
+    def tempo_goodput(self):
+        return self.duracao if self.tempo_ativo is None else self.tempo_ativo
+
+    @property
+    def goodput(self):
+        """Bytes do arquivo entregues por segundo (de transferência ativa, em um total com tempo_ativo)."""
+        tempo = self.tempo_goodput
+        return self.contadores["bytes_dados"] / tempo if tempo > 0 else 0.0
+
+    def somar(self, outra):
+        """Acumula os contadores, o histograma e as fases de outra transferência."""
+        for nome, valor in outra.contadores.items():
+            self.contadores[nome] += valor
+        for i, quantidade in enumerate(outra.histograma_rtt):
+            self.histograma_rtt[i] += quantidade
+        self.soma_rtt += outra.soma_rtt
+        self.amostras_rtt += outra.amostras_rtt
+        for fase, segundos in outra.fases.items():
+            self.fases[fase] = self.fases.get(fase, 0.0) + segundos
+        self.transferencias += outra.transferencias
+        if self.tempo_ativo is not None:
+            self.tempo_ativo += outra.tempo_goodput
+
+    def para_dict(self):
+        return {
+            "papel": self.papel,
+            **self.rotulos,
+            "inicio": self.inicio,
+            "duracao_s": round(self.duracao, 6),
+            "transferencias": self.transferencias,
+            **({"tempo_ativo_s": round(self.tempo_ativo, 6)} if self.tempo_ativo is not None else {}),
+            "contadores": dict(self.contadores),
+            "goodput_bytes_por_s": round(self.goodput, 1),
+            "rtt": {
+                "amostras": self.amostras_rtt,
+                "media_s": self.soma_rtt / self.amostras_rtt if self.amostras_rtt else None,
+                "histograma": {(f"<={limite}" if i < len(LIMITES_RTT) else f">{LIMITES_RTT[-1]}"): quantidade
+                               for i, (limite, quantidade) in enumerate(zip(LIMITES_RTT + (None,), self.histograma_rtt))},
+            },
+            "fases_s": {fase: round(segundos, 6) for fase, segundos in self.fases.items()},
+        }
+
+    @classmethod
+    def de_dict(cls, dados):
+        """Reconstrói métricas exportadas com para_dict (ex.: recebidas de outro processo)."""
+        campos = ("papel", "inicio", "duracao_s", "transferencias", "tempo_ativo_s", "contadores", "goodput_bytes_por_s", "rtt", "fases_s")
+        metricas = cls(dados["papel"], **{chave: valor for chave, valor in dados.items() if chave not in campos})
+        metricas.inicio = dados["inicio"]
+        metricas.fim = metricas.inicio + dados["duracao_s"]
+        metricas.transferencias = dados["transferencias"]
+        metricas.tempo_ativo = dados.get("tempo_ativo_s")
+        metricas.contadores.update(dados["contadores"])
+        metricas.histograma_rtt = list(dados["rtt"]["histograma"].values())
+        metricas.amostras_rtt = dados["rtt"]["amostras"]
+        metricas.soma_rtt = (dados["rtt"]["media_s"] or 0.0) * metricas.amostras_rtt
+        metricas.fases = dict(dados["fases_s"])
+        return metricas
+
+    def para_prometheus(self, prefixo="udp"):
+        """Formato texto de exposição do Prometheus (contadores, histograma de RTT, fases e goodput)."""
+        base = {"papel": self.papel, **self.rotulos}
+        def rotulos(**extras):
+            pares = {**base, **extras}
+            return "{" + ",".join(f'{chave}="{escapar_rotulo(valor)}"' for chave, valor in pares.items()) + "}"
+        linhas = []
+        for nome, descricao in CONTADORES:
+            linhas += [f"# HELP {prefixo}_{nome}_total {descricao}.", f"# TYPE {prefixo}_{nome}_total counter",
+                       f"{prefixo}_{nome}_total{rotulos()} {self.contadores[nome]}"]
+        linhas += [f"# HELP {prefixo}_transferencias_total Transferências contabilizadas.",
+                   f"# TYPE {prefixo}_transferencias_total counter",
+                   f"{prefixo}_transferencias_total{rotulos()} {self.transferencias}"]
+        linhas += [f"# HELP {prefixo}_rtt_segundos RTT medido a partir dos ACKs.", f"# TYPE {prefixo}_rtt_segundos histogram"]
+        acumulado = 0
+        for limite, quantidade in zip(LIMITES_RTT, self.histograma_rtt):
+            acumulado += quantidade
+            linhas.append(f"{prefixo}_rtt_segundos_bucket{rotulos(le=limite)} {acumulado}")
+        linhas += [f"{prefixo}_rtt_segundos_bucket{rotulos(le='+Inf')} {self.amostras_rtt}",
+                   f"{prefixo}_rtt_segundos_sum{rotulos()} {self.soma_rtt}",
+                   f"{prefixo}_rtt_segundos_count{rotulos()} {self.amostras_rtt}"]
+        linhas += [f"# HELP {prefixo}_fase_segundos_total Tempo gasto em cada fase da transferência.",
+                   f"# TYPE {prefixo}_fase_segundos_total counter"]
+        linhas += [f"{prefixo}_fase_segundos_total{rotulos(fase=fase)} {segundos}" for fase, segundos in self.fases.items()]
+        linhas += [f"# HELP {prefixo}_goodput_bytes_por_segundo Bytes do arquivo entregues por segundo.",
+                   f"# TYPE {prefixo}_goodput_bytes_por_segundo gauge",
+                   f"{prefixo}_goodput_bytes_por_segundo{rotulos()} {self.goodput}"]
+        return "\n".join(linhas) + "\n"
+
+    def resumo(self):
+        """Uma linha legível com os números principais."""
+        c = self.contadores
+        rtt = f", RTT médio {self.soma_rtt / self.amostras_rtt * 1000:.2f} ms" if self.amostras_rtt else ""
+        if self.papel == 'servidor':
+            detalhes = (f"enviados {c['segmentos_enviados']}, retransmitidos {c['segmentos_retransmitidos']}, "
+                        f"confirmados {c['segmentos_confirmados']}, paridades {c['paridades']}")
+        else:
+            detalhes = (f"recebidos {c['segmentos_recebidos']}, fora de ordem {c['segmentos_fora_de_ordem']}, "
+                        f"duplicados {c['segmentos_duplicados']}, corrompidos {c['segmentos_corrompidos']}, "
+                        f"recuperados por FEC {c['segmentos_recuperados_fec']}")
+        tempo = f"{self.duracao:.3f}s" if self.tempo_ativo is None else f"{self.tempo_ativo:.3f}s de transferência"
+        return f"{c['bytes_dados']} bytes em {tempo} (goodput {self.goodput / 1e6:.2f} MB/s); {detalhes}{rtt}"
+
+
+def exportar_metricas(metricas, formato, caminho):
+    """Grava as métricas: 'json' acrescenta uma linha ao arquivo, 'prometheus' reescreve o arquivo inteiro."""
+    try:
+        if formato == 'json':
+            with open(caminho, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(metricas.para_dict(), ensure_ascii=False) + "\n")
+        elif formato == 'prometheus':
+            # Arquivo temporário + rename: quem coleta (ex.: textfile do node_exporter) nunca vê o arquivo pela metade
+            temporario = caminho + ".tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                f.write(metricas.para_prometheus())
+            os.replace(temporario, caminho)
+        else:
+            raise ValueError(f"formato de métricas desconhecido: {formato}")
+    except (OSError, ValueError) as e:
+        print(f"Aviso: não foi possível exportar as métricas para '{caminho}': {e}")
@@ -0,0 +1,312 @@
+import struct
+import hashlib
+import zlib
+import math
+
+# Compressores opcionais: usados só se estiverem instalados
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# --- Formato Binário dos Pacotes ---
+# Cabeçalho fixo (12 bytes, big-endian):
+#   VERSAO(1) | TIPO(1) | FLAGS(1) | TAM_CHECKSUM(1) | SEQ(4) | TAMANHO(4)
+# seguido de TAM_CHECKSUM bytes de checksum bruto e de TAMANHO bytes de payload.
+# O checksum cobre o cabeçalho fixo e o payload, então um número de
+# sequência corrompido também é detectado. Os bits FLAGS_CHECKSUM de FLAGS
+# indicam o algoritmo (CHECKSUMS); o restante de FLAGS depende do tipo.
+#
+# DADOS: os bits FLAGS_CODEC de FLAGS indicam o codec usado no payload (0 = sem
+# compressão). Cada segmento é comprimido isoladamente e pode ser descomprimido
+# fora de ordem.
+#
+# ACK: SEQ é o ACK cumulativo (todos os segmentos < SEQ foram recebidos) e o
+# payload é um bitmap SACK: o bit i (MSB primeiro) indica que o segmento
+# SEQ + 1 + i também já foi recebido.
+#
+# EOF: o payload é o digest (no algoritmo do checksum) de todos os dados da
+# faixa enviada, na ordem dos segmentos, para conferência de ponta a ponta.
+#
+# INFO: antes do GET, o cliente pergunta os metadados do arquivo. A resposta
+# traz tamanho, tamanho de segmento negociado, total de segmentos e a versão
+# do arquivo (mtime em ns, para o cliente saber se um download interrompido
+# ainda é do mesmo conteúdo), seguidos do digest do arquivo inteiro (no algoritmo de 'checksum=' do INFO) quando o
+# servidor o tem; sem digest, o payload termina no INFO_ARQUIVO.
+VERSAO = 6
+CABECALHO = struct.Struct("!BBBBII")
+
+TIPO_DADOS = 1
+TIPO_ACK = 2
+TIPO_EOF = 3
+TIPO_ACK_EOF = 4
+TIPO_ERRO = 5
+TIPO_INFO = 6 # Resposta a "INFO /arquivo": payload INFO_ARQUIVO
+TIPO_PARIDADE = 7 # FEC: SEQ = 1º segmento do bloco, FLAGS = índice do grupo, payload CABECALHO_PARIDADE + XOR
+TIPO_INFO_LOTE = 8 # Resposta a "INFO /arq1/arq2/...": SEGMENT_SIZE(4) seguido de um TAMANHO(8) por arquivo
+
+# TAMANHO_ARQUIVO(8) | SEGMENT_SIZE(4) | TOTAL_SEGMENTOS(8) | VERSAO_ARQUIVO(8), seguido do digest opcional
+INFO_ARQUIVO = struct.Struct("!QIQQ")
+
+# Lote: vários arquivos ('/arq1/arq2/...') em uma única sessão. O arquivo i do
+# pedido é o fluxo i e ocupa os números de sequência [base_i, base_i + segmentos_i),
+# logo depois do fluxo anterior; os dois lados calculam as bases (bases_do_lote)
+# a partir dos tamanhos do INFO_LOTE. Arquivos inexistentes têm TAMANHO_AUSENTE
+# e nenhum segmento.
+INFO_LOTE = struct.Struct("!I") # SEGMENT_SIZE(4)
+TAMANHO_LOTE = struct.Struct("!Q")
+TAMANHO_AUSENTE = 0xFFFFFFFFFFFFFFFF
+
+# Paridade (FEC): o bloco tem SEGMENTOS_NO_BLOCO segmentos a partir de SEQ e é
+# dividido em PARIDADES_NO_BLOCO grupos intercalados; o grupo j tem os segmentos
+# SEQ + j, SEQ + j + K, ... A paridade é o XOR dos dados do grupo (completados
+# com zeros até o maior deles) e XOR_TAMANHOS o XOR dos seus tamanhos; ela tem o
+# tamanho do maior segmento do grupo, nunca mais que o SEGMENT_SIZE. O XOR é
+# feito sobre os dados originais, não sobre o payload comprimido (o cliente
+# reconstrói o segmento já descomprimido), então com compressão a sobrecarga do
+# FEC é de até PARIDADES_NO_BLOCO segmentos originais por bloco, mesmo que os
+# segmentos do grupo tenham saído bem menores na rede.
+CABECALHO_PARIDADE = struct.Struct("!HHI") # SEGMENTOS_NO_BLOCO(2) | PARIDADES_NO_BLOCO(2) | XOR_TAMANHOS(4)
+
+SACK_MAX_BYTES = 32 # O bitmap SACK cobre até 256 segmentos após o ACK cumulativo
+
+NOMES_TIPOS = {
+    TIPO_DADOS: "DADOS",
+    TIPO_ACK: "ACK",
+    TIPO_EOF: "EOF",
+    TIPO_ACK_EOF: "ACK_EOF",
+    TIPO_ERRO: "Erro",
+    TIPO_INFO: "INFO",
+    TIPO_PARIDADE: "PARIDADE",
+    TIPO_INFO_LOTE: "INFO_LOTE",
+}
+
+class ChecksumZlib:
+    """CRC32/Adler-32 do zlib com a mesma interface incremental (update/digest) do hashlib."""
+
+    def __init__(self, funcao, inicial):
+        self.funcao = funcao
+        self.valor = inicial
+
+    def update(self, dados):
+        self.valor = self.funcao(dados, self.valor)
+
+    def digest(self):
+        return self.valor.to_bytes(4, "big")
+
+def checksum_zlib(funcao, inicial):
+    """Cálculo direto (sem objeto intermediário) de um checksum do zlib sobre várias partes: é o caminho de cada pacote."""
+    def calcular(partes):
+        valor = inicial
+        for parte in partes:
+            valor = funcao(parte, valor)
+        return valor.to_bytes(4, "big")
+    return calcular
+
+def checksum_hashlib(construtor):
+    def calcular(partes):
+        h = construtor()
+        for parte in partes:
+            h.update(parte)
+        return h.digest()
+    return calcular
+
+# Checksums por pacote: {nome: (id nos FLAGS, tamanho em bytes, construtor incremental, cálculo das partes)}.
+# CRC32 e Adler-32 bastam para detectar corrupção e custam bem menos CPU que um hash criptográfico.
+CHECKSUMS = {
+    "crc32": (0, 4, lambda: ChecksumZlib(zlib.crc32, 0), checksum_zlib(zlib.crc32, 0)),
+    "adler32": (1, 4, lambda: ChecksumZlib(zlib.adler32, 1), checksum_zlib(zlib.adler32, 1)),
+    "md5": (2, 16, hashlib.md5, checksum_hashlib(hashlib.md5)),
+    "sha256": (3, 32, hashlib.sha256, checksum_hashlib(hashlib.sha256)),
+}
+CHECKSUMS_POR_ID = {checksum_id: nome for nome, (checksum_id, _, _, _) in CHECKSUMS.items()}
+CHECKSUM_PADRAO = "crc32"
+FLAGS_CHECKSUM = 0xC0 # Bits altos de FLAGS: id do algoritmo do checksum
+DESLOCAMENTO_CHECKSUM = 6
+TAM_CHECKSUM_MAXIMO = max(tamanho for _, tamanho, _, _ in CHECKSUMS.values())
+
+# Bytes além do segmento no maior pacote (paridade): um datagrama precisa de SEGMENT_SIZE + isso
+SOBRECARGA_PACOTE = CABECALHO.size + TAM_CHECKSUM_MAXIMO + CABECALHO_PARIDADE.size
+TAMANHO_MAXIMO_UDP = 65507 # Maior payload de um datagrama UDP sobre IPv4
+
+FLAGS_CODEC = 0x07
+
+# {nome: (id nos FLAGS, comprimir, descomprimir)}, em ordem de preferência
+CODECS = {}
+if zstandard is not None:
+    CODECS["zstd"] = (3, lambda dados: zstandard.ZstdCompressor().compress(dados),
+                      lambda dados: zstandard.ZstdDecompressor().decompress(dados))
+if lz4 is not None:
+    CODECS["lz4"] = (2, lz4.frame.compress, lz4.frame.decompress)
+CODECS["zlib"] = (1, zlib.compress, zlib.decompress)
+CODECS_POR_ID = {codec_id: nome for nome, (codec_id, _, _) in CODECS.items()}
+
+def novo_digesto(algoritmo=CHECKSUM_PADRAO):
+    """Objeto incremental (update/digest) do algoritmo, para o digest de um arquivo inteiro."""
+    return CHECKSUMS[algoritmo][2]()
+
+def calcular_checksum(*partes, algoritmo=CHECKSUM_PADRAO):
+    """Calcula o checksum bruto das partes fornecidas."""
+    return CHECKSUMS[algoritmo][3](partes)
+
+def montar_cabecalho(tipo, seq, tamanho, flags=0, checksum=CHECKSUM_PADRAO):
+    """Monta só o cabeçalho fixo (útil quando o checksum já é conhecido)."""
+    checksum_id, tam_checksum, _, _ = CHECKSUMS[checksum]
+    return CABECALHO.pack(VERSAO, tipo, flags | checksum_id << DESLOCAMENTO_CHECKSUM, tam_checksum, seq, tamanho)
+
+def escrever_cabecalho(buffer, tipo, seq, tamanho, flags=0, checksum=CHECKSUM_PADRAO):
+    """Como montar_cabecalho, mas escreve no início de um buffer já alocado (reaproveitado entre pacotes)."""
+    checksum_id, tam_checksum, _, _ = CHECKSUMS[checksum]
+    CABECALHO.pack_into(buffer, 0, VERSAO, tipo, flags | checksum_id << DESLOCAMENTO_CHECKSUM, tam_checksum, seq, tamanho)
+
+def montar_pacote(tipo, seq=0, payload=b"", flags=0, checksum=CHECKSUM_PADRAO):
+    """Monta um pacote binário: cabeçalho fixo + checksum + payload."""
+    cabecalho = montar_cabecalho(tipo, seq, len(payload), flags, checksum)
+    return cabecalho + calcular_checksum(cabecalho, payload, algoritmo=checksum) + payload
+
+def analisar_pacote(dados):
+    """Interpreta um pacote binário.
+
+    Retorna (tipo, flags, seq, payload, checksum_ok); os bits do algoritmo
+    do checksum já vêm retirados de flags. Gera ValueError se o pacote
+    estiver malformado (versão desconhecida, truncado etc.).
+    """
+    if len(dados) < CABECALHO.size:
+        raise ValueError(f"pacote curto demais ({len(dados)} bytes)")
+    versao, tipo, flags, tam_checksum, seq, tamanho = CABECALHO.unpack_from(dados, 0)
+    if versao != VERSAO:
+        raise ValueError(f"versão de protocolo desconhecida ({versao})")
+    algoritmo = CHECKSUMS_POR_ID[flags >> DESLOCAMENTO_CHECKSUM]
+    if tam_checksum != CHECKSUMS[algoritmo][1]:
+        raise ValueError(f"checksum {algoritmo} com {tam_checksum} bytes")
+    inicio_payload = CABECALHO.size + tam_checksum
+    if len(dados) != inicio_payload + tamanho:
+        raise ValueError(f"tamanho inconsistente (esperado {inicio_payload + tamanho}, recebido {len(dados)})")
+    checksum_recebido = dados[CABECALHO.size:inicio_payload]
+    payload = dados[inicio_payload:]
+    checksum_ok = calcular_checksum(dados[:CABECALHO.size], payload, algoritmo=algoritmo) == checksum_recebido
+    return tipo, flags & ~FLAGS_CHECKSUM, seq, payload, checksum_ok
+
+def montar_ack(cumulativo, fora_de_ordem, checksum=CHECKSUM_PADRAO):
+    """Monta um ACK cumulativo com o bitmap SACK dos segmentos recebidos fora de ordem."""
+    bitmap = bytearray(SACK_MAX_BYTES) if fora_de_ordem else bytearray()
+    ultimo_bit = -1
+    if fora_de_ordem:
+        for i in range(SACK_MAX_BYTES * 8):
+            if cumulativo + 1 + i in fora_de_ordem:
+                bitmap[i >> 3] |= 0x80 >> (i & 7)
+                ultimo_bit = i
+    return montar_pacote(TIPO_ACK, cumulativo, bytes(bitmap[:ultimo_bit // 8 + 1]), checksum=checksum)
+
+def ler_sack(cumulativo, bitmap):
+    """Retorna os números de sequência confirmados seletivamente pelo bitmap."""
+    return [cumulativo + 1 + i for i in range(len(bitmap) * 8) if bitmap[i >> 3] & (0x80 >> (i & 7))]
+
+def xor_segmentos(payloads, segment_size):
+    """XOR dos payloads (completados com zeros até segment_size) e dos seus tamanhos.
+
+    Retorna (xor_tamanhos, xor_inteiro, maior_tamanho).
+    """
+    xor_tamanhos = 0
+    xor_inteiro = 0
+    maior_tamanho = 0
+    for payload in payloads:
+        xor_tamanhos ^= len(payload)
+        maior_tamanho = max(maior_tamanho, len(payload))
+        # Deslocar equivale a completar com zeros à direita, sem copiar o payload (que pode ser um memoryview)
+        xor_inteiro ^= int.from_bytes(payload, "big") << 8 * (segment_size - len(payload))
+    return xor_tamanhos, xor_inteiro, maior_tamanho
+
+def montar_paridade(inicio_bloco, indice_grupo, segmentos_no_bloco, paridades_no_bloco, payloads, segment_size,
+                    checksum=CHECKSUM_PADRAO):
+    """Monta o pacote de paridade do grupo indice_grupo de um bloco (payloads = segmentos do grupo).
+
+    A paridade só tem o tamanho do maior segmento do grupo: os bytes além dele são zeros.
+    """
+    xor_tamanhos, xor_inteiro, maior_tamanho = xor_segmentos(payloads, segment_size)
+    xor_inteiro >>= 8 * (segment_size - maior_tamanho)
+    payload = CABECALHO_PARIDADE.pack(segmentos_no_bloco, paridades_no_bloco, xor_tamanhos) + xor_inteiro.to_bytes(maior_tamanho, "big")
+    return montar_pacote(TIPO_PARIDADE, inicio_bloco, payload, flags=indice_grupo, checksum=checksum)
+
+def ler_paridade(payload, segment_size):
+    """Retorna (segmentos_no_bloco, paridades_no_bloco, xor_tamanhos, xor_inteiro) de um pacote de paridade.
+
+    xor_inteiro volta completado com zeros até segment_size, como o de xor_segmentos.
+    """
+    if len(payload) < CABECALHO_PARIDADE.size:
+        raise ValueError(f"paridade curta demais ({len(payload)} bytes)")
+    tamanho = len(payload) - CABECALHO_PARIDADE.size
+    if tamanho > segment_size:
+        raise ValueError(f"paridade de {tamanho} bytes maior que o segmento ({segment_size} bytes)")
+    segmentos_no_bloco, paridades_no_bloco, xor_tamanhos = CABECALHO_PARIDADE.unpack_from(payload)
+    xor_inteiro = int.from_bytes(payload[CABECALHO_PARIDADE.size:], "big") << 8 * (segment_size - tamanho)
+    return segmentos_no_bloco, paridades_no_bloco, xor_tamanhos, xor_inteiro
+
+def payload_info_lote(segment_size, tamanhos):
+    """Payload do INFO_LOTE (tamanho None = arquivo não encontrado)."""
+    return INFO_LOTE.pack(segment_size) + b"".join(
+        TAMANHO_LOTE.pack(TAMANHO_AUSENTE if tamanho is None else tamanho) for tamanho in tamanhos)
+
+def ler_info_lote(payload):
+    """Retorna (segment_size, tamanhos) de um INFO_LOTE. Gera ValueError se estiver malformado."""
+    if len(payload) < INFO_LOTE.size or (len(payload) - INFO_LOTE.size) % TAMANHO_LOTE.size:
+        raise ValueError(f"INFO_LOTE com tamanho inválido ({len(payload)} bytes)")
+    (segment_size,) = INFO_LOTE.unpack_from(payload)
+    tamanhos = [None if tamanho == TAMANHO_AUSENTE else tamanho
+                for (tamanho,) in TAMANHO_LOTE.iter_unpack(payload[INFO_LOTE.size:])]
+    return segment_size, tamanhos
+
+def payload_info(tamanho, segment_size, versao, digesto=b""):
+    """Payload da resposta ao INFO de um arquivo (digesto vazio = servidor não tem o digest)."""
+    return INFO_ARQUIVO.pack(tamanho, segment_size, math.ceil(tamanho / segment_size), versao) + digesto
+
+def ler_info(payload):
+    """Retorna (tamanho, segment_size, total_segmentos, versao, digest ou None). Gera ValueError se inconsistente."""
+    if len(payload) < INFO_ARQUIVO.size:
+        raise ValueError(f"INFO com tamanho inválido ({len(payload)} bytes)")
+    tamanho, segment_size, total_segmentos, versao = INFO_ARQUIVO.unpack_from(payload)
+    if segment_size == 0 or total_segmentos != math.ceil(tamanho / segment_size):
+        raise ValueError(f"{total_segmentos} segmentos não correspondem a {tamanho} bytes em segmentos de {segment_size}")
+    return tamanho, segment_size, total_segmentos, versao, bytes(payload[INFO_ARQUIVO.size:]) or None
+
+def bases_do_lote(tamanhos, segment_size):
+    """Primeiro número de sequência de cada fluxo do lote, e o total de segmentos."""
+    bases = []
+    total = 0
+    for tamanho in tamanhos:
+        bases.append(total)
+        total += math.ceil((tamanho or 0) / segment_size)
+    return bases, total
+
+def assinatura_lote(tamanhos, segment_size):
+    """Resumo (CRC32 em hexadecimal) dos tamanhos do lote, enviado no GET para o servidor conferir que nada mudou desde o INFO."""
+    return f"{zlib.crc32(payload_info_lote(segment_size, tamanhos)):08x}"
+
+def comprimir(nome_codec, dados):
+    """Comprime um segmento; retorna (flags, payload), ou (0, dados) se não compensar."""
+    codec_id, comprimir_dados, _ = CODECS[nome_codec]
+    comprimido = comprimir_dados(dados)
+    if len(comprimido) >= len(dados):
+        return 0, dados
+    return codec_id, comprimido
+
+def descomprimir_payload(flags, payload):
+    """Desfaz a compressão indicada nos FLAGS de um segmento de dados. Gera ValueError se falhar."""
+    codec_id = flags & FLAGS_CODEC
+    if codec_id == 0:
+        return payload
+    nome_codec = CODECS_POR_ID.get(codec_id)
+    if nome_codec is None:
+        raise ValueError(f"codec {codec_id} não suportado")
+    try:
+        return CODECS[nome_codec][2](payload)
+    except Exception as e:
+        raise ValueError(f"falha ao descomprimir com {nome_codec}: {e}")
+
+def eh_pacote_binario(dados):
+    """Distingue pacotes binários das requisições em texto (GET ...)."""
+    return len(dados) > 0 and dados[0] == VERSAO
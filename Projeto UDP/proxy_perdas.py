@@ -0,0 +1,171 @@
+import socket
+import selectors
+import heapq
+import random
+import time
+import argparse
+
+# --- Configurações ---
+PORTA_PROXY = 10001
+SERVIDOR = ("127.0.0.1", 10000)
+BUFFER_SIZE = 65535 # Maior datagrama UDP
+ATRASO_REORDENACAO = 0.01 # Atraso extra (segundos) dos pacotes escolhidos para chegar fora de ordem
+
+class Degradacao:
+    """Decide o que acontece com cada datagrama: perda, corrupção, atraso/jitter e reordenação.
+
+    A perda pode ser aleatória (independente por pacote) ou em rajadas,
+    pelo modelo de Gilbert-Elliott: no estado "ruim" todo pacote se perde,
+    a rajada dura em média 'rajada_media' pacotes e as transições são
+    calibradas para que a taxa média de perda continue sendo 'perda'.
+    Com a mesma semente, a sequência de decisões se repete.
+    """
+
+    def __init__(self, perda=0.0, rajada_media=1.0, corrupcao=0.0, atraso=0.0, jitter=0.0, reordenacao=0.0, semente=None):
+        if not 0 <= perda < 1:
+            raise ValueError(f"perda deve estar em [0, 1): {perda}")
+        self.rng = random.Random(semente)
+        self.perda = perda
+        self.rajada_media = max(rajada_media, 1.0)
+        self.corrupcao = corrupcao
+        self.atraso = atraso
+        self.jitter = jitter
+        self.reordenacao = reordenacao
+        # Gilbert-Elliott: P(ruim -> bom) = 1 / rajada_media; P(bom -> ruim) mantém a perda média
+        self.p_sair_rajada = 1 / self.rajada_media
+        self.p_entrar_rajada = perda * self.p_sair_rajada / (1 - perda)
+        self.em_rajada = False
+        self.estatisticas = {"recebidos": 0, "perdidos": 0, "corrompidos": 0, "reordenados": 0}
+
+    def perder(self):
+        if self.rajada_media == 1.0:
+            return self.rng.random() < self.perda
+        if self.em_rajada:
+            self.em_rajada = self.rng.random() >= self.p_sair_rajada
+        else:
+            self.em_rajada = self.rng.random() < self.p_entrar_rajada
+        return self.em_rajada
+
+    def processar(self, dados, agora):
+        """Retorna (instante de entrega, dados possivelmente corrompidos), ou None se o pacote se perdeu."""
+        self.estatisticas["recebidos"] += 1
+        if self.perder():
+            self.estatisticas["perdidos"] += 1
+            return None
+        if dados and self.rng.random() < self.corrupcao:
+            posicao = self.rng.randrange(len(dados))
+            dados = dados[:posicao] + bytes([dados[posicao] ^ (1 << self.rng.randrange(8))]) + dados[posicao+1:]
+            self.estatisticas["corrompidos"] += 1
+        atraso = max(self.atraso + self.rng.uniform(-self.jitter, self.jitter), 0.0)
+        if self.rng.random() < self.reordenacao:
+            atraso += ATRASO_REORDENACAO
+            self.estatisticas["reordenados"] += 1
+        return agora + atraso, dados
+
+
+class ProxyDegradacao:
+    """Proxy UDP entre clientes e o servidor, aplicando uma Degradacao em cada sentido.
+
+    Cada cliente ganha um socket próprio em direção ao servidor, então o
+    servidor continua vendo um endereço distinto por cliente (e por fluxo
+    de um download paralelo).
+    """
+
+    def __init__(self, porta, servidor, ida, volta, ip="127.0.0.1"):
+        self.servidor = servidor
+        self.ida = ida     # Cliente -> servidor (requisições e ACKs)
+        self.volta = volta # Servidor -> cliente (dados)
+        self.escuta = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.escuta.bind((ip, porta))
+        self.escuta.setblocking(False)
+        self.seletor = selectors.DefaultSelector()
+        self.seletor.register(self.escuta, selectors.EVENT_READ)
+        self.sockets_clientes = {} # {endereço do cliente: socket em direção ao servidor}
+        self.clientes_por_socket = {}
+        self.agendados = [] # Heap de (instante de entrega, ordem, socket, dados, destino)
+        self.ordem = 0
+
+    def socket_do_cliente(self, endereco):
+        sock = self.sockets_clientes.get(endereco)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect(self.servidor)
+            sock.setblocking(False)
+            self.seletor.register(sock, selectors.EVENT_READ)
+            self.sockets_clientes[endereco] = sock
+            self.clientes_por_socket[sock] = endereco
+        return sock
+
+    def agendar(self, degradacao, sock, dados, destino, agora):
+        resultado = degradacao.processar(dados, agora)
+        if resultado is not None:
+            instante, dados = resultado
+            heapq.heappush(self.agendados, (instante, self.ordem, sock, dados, destino))
+            self.ordem += 1
+
+    def executar(self, parar=None):
+        """Encaminha pacotes até 'parar' (threading.Event) ser acionado."""
+        while parar is None or not parar.is_set():
+            espera = 0.1
+            if self.agendados:
+                espera = min(max(self.agendados[0][0] - time.time(), 0), espera)
+            for chave, _ in self.seletor.select(espera):
+                agora = time.time()
+                sock = chave.fileobj
+                while True:
+                    try:
+                        dados, endereco = sock.recvfrom(BUFFER_SIZE)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except ConnectionRefusedError:
+                        continue # Servidor ainda não subiu (ou já caiu)
+                    if sock is self.escuta:
+                        self.agendar(self.ida, self.socket_do_cliente(endereco), dados, None, agora)
+                    else:
+                        self.agendar(self.volta, self.escuta, dados, self.clientes_por_socket[sock], agora)
+            agora = time.time()
+            while self.agendados and self.agendados[0][0] <= agora:
+                _, _, sock, dados, destino = heapq.heappop(self.agendados)
+                try:
+                    if destino is None:
+                        sock.send(dados)
+                    else:
+                        sock.sendto(dados, destino)
+                except OSError:
+                    pass # Datagrama perdido "de verdade"
+
+    def fechar(self):
+        for sock in [self.escuta, *self.sockets_clientes.values()]:
+            self.seletor.unregister(sock)
+            sock.close()
+        self.seletor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proxy UDP que injeta perda, corrupção, atraso, jitter e reordenação.")
+    parser.add_argument("--porta", type=int, default=PORTA_PROXY, help=f"porta onde os clientes se conectam (padrão: {PORTA_PROXY})")
+    parser.add_argument("--servidor", default=f"{SERVIDOR[0]}:{SERVIDOR[1]}", help="endereço IP:PORTA do servidor real")
+    parser.add_argument("--perda", type=float, default=0.0, help="taxa média de perda (0 a 1)")
+    parser.add_argument("--rajada-media", type=float, default=1.0, help="tamanho médio das rajadas de perda (1 = perdas independentes)")
+    parser.add_argument("--corrupcao", type=float, default=0.0, help="probabilidade de inverter um bit do pacote")
+    parser.add_argument("--atraso", type=float, default=0.0, help="atraso fixo em cada sentido (segundos)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="variação uniforme do atraso (± segundos)")
+    parser.add_argument("--reordenacao", type=float, default=0.0, help="probabilidade de um pacote ser atrasado para chegar fora de ordem")
+    parser.add_argument("--so-dados", action="store_true", help="degrada só o sentido servidor -> cliente (ACKs passam intactos)")
+    parser.add_argument("--semente", type=int, default=None, help="semente do gerador aleatório (reprodutibilidade)")
+    argumentos = parser.parse_args()
+
+    ip_servidor, porta_servidor = argumentos.servidor.rsplit(":", 1)
+    opcoes = dict(perda=argumentos.perda, rajada_media=argumentos.rajada_media, corrupcao=argumentos.corrupcao,
+                  atraso=argumentos.atraso, jitter=argumentos.jitter, reordenacao=argumentos.reordenacao)
+    volta = Degradacao(semente=argumentos.semente, **opcoes)
+    ida = Degradacao() if argumentos.so_dados else Degradacao(semente=None if argumentos.semente is None else argumentos.semente + 1, **opcoes)
+    proxy = ProxyDegradacao(argumentos.porta, (ip_servidor, int(porta_servidor)), ida, volta)
+    print(f"Proxy escutando em 127.0.0.1:{argumentos.porta}, encaminhando para {argumentos.servidor} com {opcoes}")
+    try:
+        proxy.executar()
+    except KeyboardInterrupt:
+        print(f"\nCliente -> servidor: {ida.estatisticas}")
+        print(f"Servidor -> cliente: {volta.estatisticas}")
+    finally:
+        proxy.fechar()
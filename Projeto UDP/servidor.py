@@ -1,226 +1,1532 @@
 import socket
 import os
-import hashlib
+import argparse
 import time
 import math
+import selectors
+import mmap
+import heapq
+import ipaddress
+import struct
+import sys
+import json
+import signal
+import subprocess
+from bisect import bisect_right
+from collections import OrderedDict
+from protocolo import (montar_pacote, escrever_cabecalho, calcular_checksum, analisar_pacote, eh_pacote_binario,
+                       ler_sack, montar_paridade, comprimir, novo_digesto, CODECS, CHECKSUMS, CHECKSUM_PADRAO, NOMES_TIPOS, VERSAO,
+                       SOBRECARGA_PACOTE, TAMANHO_MAXIMO_UDP, payload_info, payload_info_lote, bases_do_lote, assinatura_lote,
+                       CABECALHO, TIPO_DADOS, TIPO_ACK, TIPO_EOF, TIPO_ACK_EOF, TIPO_ERRO, TIPO_INFO, TIPO_INFO_LOTE)
+from metricas import MetricasTransferencia, exportar_metricas, NIVEL_INFO, NIVEL_PACOTE
 
 # --- Configurações ---
 ENCODING = 'raw-unicode-escape'
 IP = socket.gethostbyname(socket.gethostname())
 PORTA = 10000
-BUFFER_SIZE = 2048 # Buffer maior para receber ACKs enquanto envia
-SEGMENT_SIZE = 1024 # Tamanho dos dados do arquivo por segmento
-WINDOW_SIZE = 2    # Tamanho da janela deslizante
-ACK_TIMEOUT = 0.5   # Timeout para esperar por ACKs (segundos) - Curto
-RETRANSMISSION_TIMEOUT = 1.5 # Timeout para reenviar segmento não confirmado (segundos) - Mais longo
+BUFFER_SIZE = TAMANHO_MAXIMO_UDP # Cabe o maior datagrama (um GET/INFO de lote lista muitos arquivos); reaproveitado a cada recepção
+SEGMENT_SIZE = 1024 # Tamanho padrão dos dados do arquivo por segmento (quando o cliente não pede outro)
+SEGMENT_SIZE_MINIMO = 256
+SEGMENT_SIZE_MAXIMO = 65000 # Maior segmento aceito no GET/INFO ('segmento=N'); com o cabeçalho cabe em um datagrama UDP
+DESCOBRIR_MTU = True # No INFO, limita o segmento ao MTU do caminho até o cliente (evita fragmentação IP; só Linux)
+MTU_PRESUMIDO = 1400 # Quando o MTU do caminho é desconhecido (fora do Linux) e o cliente não é local, conservador
+SO_SNDBUF_DESEJADO = 4 * 1024 * 1024 # Buffer de envio do socket, para caber rajadas de segmentos grandes
+WINDOW_SIZE = 2    # Tamanho inicial da janela deslizante (segmentos); depois ela varia com o controle de congestionamento
+JANELA_MINIMA = 1
+JANELA_MAXIMA = 1024 # Limite superior da janela de congestionamento (segmentos)
+JANELA_MAXIMA_BYTES = 16 * 1024 * 1024 # Limite da janela em bytes (com segmentos grandes, menos segmentos em voo)
+SSTHRESH_INICIAL = 64 # Limiar entre slow start e prevenção de congestionamento (segmentos)
+CONTROLE_CONGESTIONAMENTO = 'aimd' # 'aimd' (estilo Reno) ou 'cubic'
+TAXA_ENVIO = 'rtt' # Ritmo de envio: 'rtt' (janela / RTT medido), taxa fixa em bytes/s, ou None (sem pacing, envia em rajadas)
+RAJADA_MAXIMA = 4  # Segmentos que o balde de tokens acumula: maior rajada enviada de uma vez
+RETRANSMISSION_TIMEOUT = 1.5 # Timeout inicial para reenviar segmento não confirmado, antes da 1ª medição de RTT (segundos)
+RTO_MINIMO = 0.02   # Limites do timeout de retransmissão adaptativo (segundos)
+RTO_MAXIMO = 30.0
 MAX_RETRANSMISSIONS = 5 # Máximo de tentativas por segmento
+LIMIAR_PERDA_SACK = 3 # Segmento ultrapassado por esta quantidade de segmentos confirmados via SACK é dado como perdido
+MAX_PACOTES_POR_RODADA = 1024 # Limite de datagramas drenados de uma vez antes de cuidar dos timers
+CACHE_MAXIMO_BYTES = 64 * 1024 * 1024 # Memória máxima do cache de checksums por segmento
+DIRETORIO_MANIFESTOS = None # Onde gravar os manifestos de checksums (None = ao lado de cada arquivo)
+COMPRESSAO_HABILITADA = True # Comprime os segmentos com o 1º codec da lista 'codecs=' do GET que o servidor tiver
+FEC_HABILITADO = True # Aceita pedidos de FEC ('GET /arquivo?fec=N:K': K segmentos de paridade a cada N de dados)
+FEC_MAXIMO_BLOCO = 64 # Maior N aceito em um pedido de FEC
+DIGEST_NO_INFO_MAXIMO = 64 * 1024 * 1024 # Arquivos até este tamanho têm o digest do arquivo inteiro no INFO
+DIGEST_BLOCO = 1024 * 1024 # Bytes lidos por volta do loop ao calcular um digest (limita a pausa das sessões)
+DIGESTS_EM_CACHE = 1024 # Digests de arquivos inteiros guardados (por caminho, versão e algoritmo)
+MAX_ARQUIVOS_POR_LOTE = 4096 # Maior lote ('GET /arq1/arq2/...') aceito; a resposta ao INFO precisa caber em um datagrama
+PROCESSOS = 1 # > 1: supervisor + N processos trabalhadores na mesma porta (SO_REUSEPORT), um núcleo cada
+INTERVALO_RELATORIO = 30 # Segundos entre os relatórios de totais do supervisor (quando houve transferências)
+TEMPO_MINIMO_VIVO = 2.0 # Trabalhador que morre antes disso é reiniciado só depois desse tempo (evita reinícios em laço)
+NIVEL_LOG = NIVEL_INFO # NIVEL_PACOTE mostra cada envio/ACK (lento; só para depuração)
+EXPORTAR_METRICAS = None # None, 'json' (uma linha por transferência) ou 'prometheus' (totais desde o início do servidor)
+ARQUIVO_METRICAS = "metricas_servidor" # Recebe a extensão .jsonl ou .prom conforme o formato
 
-def calculate_hash(data_bytes):
-    """Calcula o hash MD5 dos bytes fornecidos."""
-    return hashlib.md5(data_bytes).hexdigest().encode(ENCODING)
+# Manifesto: MAGICO(4) | VERSAO_PROTOCOLO(1) | ID_CHECKSUM(1) | SEGMENT_SIZE(4) |
+#            TOTAL_SEGMENTOS(8) | TAMANHO_ARQUIVO(8) | MTIME_NS(8), seguido dos checksums
+CABECALHO_MANIFESTO = struct.Struct("!4sBBIQQQ")
+MAGICO_MANIFESTO = b"UDPM"
 
-# 1) --- Criação do Socket --- 
-servidor = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-try:
-    servidor.bind((IP, PORTA))
-    print(f"Servidor UDP escutando em {IP}:{PORTA}")
-except socket.error as e:
-    print(f"Erro no bind: {e}")
-    exit()
+# Digest do arquivo inteiro (INFO), gravado ao lado do manifesto: MAGICO(4) | ID_CHECKSUM(1) |
+#            TAMANHO_ARQUIVO(8) | MTIME_NS(8), seguido do digest
+CABECALHO_DIGEST = struct.Struct("!4sBQQ")
+MAGICO_DIGEST = b"UDPG"
 
-# 3) --- Loop Principal Aguardando Clientes ---
-while True:
-    print("\nAguardando nova requisição GET...")
-    client_address = None
-    segmentos = []
-    total_segmentos = 0
+# sendmsg (scatter-gather) não existe no Windows; lá as partes do segmento são concatenadas antes do envio
+ENVIO_VETORIAL = hasattr(socket.socket, "sendmsg")
+
+def enviar_erro(servidor, mensagem, address):
+    """Envia uma mensagem de Erro (binária) ao cliente."""
+    servidor.sendto(montar_pacote(TIPO_ERRO, payload=mensagem.encode(ENCODING)), address)
+
+def enviar_partes(servidor, partes, address):
+    """Envia um datagrama formado pelas partes (cabeçalho, payload) sem juntá-las em um bytes novo."""
+    if ENVIO_VETORIAL:
+        servidor.sendmsg(partes, (), 0, address)
+    else:
+        servidor.sendto(b"".join(partes), address)
+
+def tamanho_partes(partes):
+    return sum(len(parte) for parte in partes)
+
+class EstimadorRTT:
+    """Timeout de retransmissão adaptativo (RTO) a partir do RTT medido.
+
+    Segue o cálculo clássico do TCP (RFC 6298): SRTT e RTTVAR suavizados,
+    RTO = SRTT + 4 * RTTVAR, backoff exponencial a cada timeout. Pela regra
+    de Karn, só segmentos enviados uma única vez geram amostras.
+    """
+
+    ALFA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = RETRANSMISSION_TIMEOUT
+
+    def amostrar(self, rtt):
+        if self.srtt is None: # Primeira medição
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALFA) * self.srtt + self.ALFA * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MINIMO), RTO_MAXIMO)
+
+    def backoff(self):
+        """Dobra o RTO após um timeout (até RTO_MAXIMO)."""
+        self.rto = min(self.rto * 2, RTO_MAXIMO)
+
+
+class ControleCongestionamento:
+    """Janela de congestionamento dinâmica (em segmentos).
+
+    Começa em slow start (+1 segmento por ACK) até o ssthresh e depois
+    cresce em modo AIMD (+1 segmento por RTT) ou CUBIC (função cúbica do
+    tempo desde a última perda). Cada perda reduz a janela
+    multiplicativamente, no máximo uma vez por janela enviada.
+    """
+
+    C_CUBIC = 0.4
+
+    def __init__(self, modo=None):
+        modo = CONTROLE_CONGESTIONAMENTO if modo is None else modo
+        if modo not in ('aimd', 'cubic'):
+            raise ValueError(f"Controle de congestionamento desconhecido: {modo}")
+        self.modo = modo
+        self.janela = float(WINDOW_SIZE)
+        self.ssthresh = float(SSTHRESH_INICIAL)
+        self.beta = 0.7 if modo == 'cubic' else 0.5
+        self.recuperacao_ate = -1 # Perdas de segmentos abaixo disso já causaram redução
+        # --- Estado do CUBIC ---
+        self.w_max = None
+        self.k = 0.0
+        self.inicio_epoca = None
+
+    @property
+    def tamanho(self):
+        """Janela efetiva, em segmentos inteiros."""
+        return int(min(max(self.janela, JANELA_MINIMA), JANELA_MAXIMA))
+
+    def ao_confirmar(self, agora):
+        """Chamado para cada segmento novo confirmado por ACK."""
+        if self.janela < self.ssthresh: # Slow start
+            self.janela += 1
+        elif self.modo == 'cubic':
+            self._crescer_cubic(agora)
+        else: # AIMD: aumento aditivo de ~1 segmento por RTT
+            self.janela += 1 / self.janela
+        self.janela = min(self.janela, JANELA_MAXIMA)
+
+    def _crescer_cubic(self, agora):
+        if self.inicio_epoca is None:
+            self.inicio_epoca = agora
+            if self.w_max is None or self.w_max <= self.janela:
+                self.w_max = self.janela
+                self.k = 0.0
+            else:
+                self.k = ((self.w_max - self.janela) / self.C_CUBIC) ** (1 / 3)
+        t = agora - self.inicio_epoca
+        alvo = self.C_CUBIC * (t - self.k) ** 3 + self.w_max
+        if alvo > self.janela:
+            self.janela += (alvo - self.janela) / self.janela
+        else:
+            self.janela += 0.01 / self.janela
+
+    def ao_perder(self, seq_num, proximo_seq_num, retransmissao):
+        """Chamado quando o segmento seq_num expira sem ACK ou o SACK indica que ele se perdeu."""
+        if retransmissao:
+            # A própria retransmissão se perdeu: o caminho está congestionado, recomeça do mínimo
+            self.ssthresh = max(self.janela * self.beta, 2)
+            self.janela = JANELA_MINIMA
+            self.inicio_epoca = None
+            self.recuperacao_ate = proximo_seq_num
+            return
+        if seq_num < self.recuperacao_ate:
+            return # Já houve redução para esta janela
+        self.recuperacao_ate = proximo_seq_num
+        self.w_max = self.janela
+        self.janela = max(self.janela * self.beta, JANELA_MINIMA)
+        self.ssthresh = max(self.janela, 2)
+        self.inicio_epoca = None
 
-    while client_address is None: # Espera por um GET válido
+
+class BaldeTokens:
+    """Pacing: espaça o envio dos segmentos em vez de mandar a janela inteira de uma vez.
+
+    Token bucket em bytes: os tokens chegam à 'taxa' (bytes/s) até a
+    capacidade de RAJADA_MAXIMA segmentos, e cada pacote enviado consome o
+    seu tamanho. Com taxa None o envio não é limitado. Retransmissões e
+    paridades também consomem tokens (podendo deixar o saldo negativo).
+    """
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.taxa = None
+        self.ultimo = time.time()
+
+    def reabastecer(self, agora):
+        if self.taxa is None:
+            self.tokens = self.capacidade
+        else:
+            self.tokens = min(self.tokens + (agora - self.ultimo) * self.taxa, self.capacidade)
+        self.ultimo = agora
+
+    def disponivel(self, tamanho):
+        return self.taxa is None or self.tokens >= tamanho
+
+    def consumir(self, tamanho):
+        self.tokens -= tamanho
+
+    def liberacao(self, tamanho):
+        """Momento em que haverá tokens para um pacote deste tamanho."""
+        return self.ultimo + (tamanho - self.tokens) / self.taxa
+
+
+def caminho_manifesto(caminho, segment_size, checksum=CHECKSUM_PADRAO):
+    """Caminho do manifesto de checksums de um arquivo servido (um por tamanho de segmento e algoritmo)."""
+    diretorio, nome = os.path.split(caminho)
+    sufixo = "" if segment_size == SEGMENT_SIZE else f".{segment_size}"
+    if checksum != CHECKSUM_PADRAO:
+        sufixo += f".{checksum}"
+    if DIRETORIO_MANIFESTOS is not None:
+        return os.path.join(DIRETORIO_MANIFESTOS, f"{nome}{sufixo}.manifesto")
+    return os.path.join(diretorio, f".{nome}{sufixo}.manifesto")
+
+def caminho_digest(caminho, checksum):
+    """Caminho do arquivo com o digest do arquivo inteiro (um por algoritmo), no mesmo lugar dos manifestos."""
+    diretorio, nome = os.path.split(caminho)
+    if DIRETORIO_MANIFESTOS is not None:
+        return os.path.join(DIRETORIO_MANIFESTOS, f"{nome}.{checksum}.digest")
+    return os.path.join(diretorio, f".{nome}.{checksum}.digest")
+
+
+class EntradaCache:
+    """Checksums dos segmentos de uma versão (mtime/tamanho) de um arquivo.
+
+    É preenchida aos poucos, conforme as sessões montam os segmentos; quando
+    fica completa, é gravada em disco como manifesto.
+    """
+
+    def __init__(self, chave, total_segmentos, caminho, checksum=CHECKSUM_PADRAO):
+        self.chave = chave
+        self.caminho = caminho
+        self.checksum = checksum
+        self.tam_checksum = CHECKSUMS[checksum][1]
+        self.total_segmentos = total_segmentos
+        self.checksums = bytearray(total_segmentos * self.tam_checksum)
+        self.prontos = bytearray(total_segmentos) # 1 = checksum já calculado
+        self.faltando = total_segmentos
+        self.custo = len(self.checksums) + len(self.prontos)
+
+    def obter(self, num_seq):
+        if not self.prontos[num_seq]:
+            return None
+        inicio = num_seq * self.tam_checksum
+        return bytes(self.checksums[inicio:inicio+self.tam_checksum])
+
+    def guardar(self, num_seq, checksum):
+        inicio = num_seq * self.tam_checksum
+        self.checksums[inicio:inicio+self.tam_checksum] = checksum
+        if not self.prontos[num_seq]:
+            self.prontos[num_seq] = 1
+            self.faltando -= 1
+            if self.faltando == 0:
+                self.salvar_manifesto()
+
+    def salvar_manifesto(self):
+        """Grava os checksums completos em disco (arquivo temporário + rename atômico)."""
+        mtime_ns, tamanho, segment_size = self.chave
+        destino = caminho_manifesto(self.caminho, segment_size, self.checksum)
         try:
-            # Espera indefinidamente pelo primeiro GET
-            servidor.settimeout(None)
-            dados, temp_address = servidor.recvfrom(BUFFER_SIZE)
-            mensagem_cliente = dados.decode(ENCODING)
-
-            if mensagem_cliente.startswith("GET "):
-                caminho_arquivo = mensagem_cliente[4:].strip().replace("/", "")
-                print(f"Cliente {temp_address} solicitou: {caminho_arquivo}")
-
-                # Verificar existência e segmentar o arquivo
-                if not os.path.exists(caminho_arquivo):
-                    print(f"Arquivo não encontrado: {caminho_arquivo}")
-                    erro_msg = f"Erro|Arquivo '{caminho_arquivo}' não encontrado".encode(ENCODING)
-                    servidor.sendto(erro_msg, temp_address)
-                    continue # Volta a esperar por GET
+            if DIRETORIO_MANIFESTOS is not None:
+                os.makedirs(DIRETORIO_MANIFESTOS, exist_ok=True)
+            temporario = destino + ".tmp"
+            with open(temporario, 'wb') as f:
+                f.write(CABECALHO_MANIFESTO.pack(MAGICO_MANIFESTO, VERSAO, CHECKSUMS[self.checksum][0], segment_size,
+                                                 self.total_segmentos, tamanho, mtime_ns))
+                f.write(self.checksums)
+            os.replace(temporario, destino)
+            print(f"[MANIFESTO] Checksums de '{self.caminho}' gravados em '{destino}'.")
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar o manifesto '{destino}': {e}")
 
-                try:
-                    with open(caminho_arquivo, 'rb') as f:
-                        dados_arquivo = f.read()
-
-                    segmentos = []
-                    num_seq = 0
-                    for i in range(0, len(dados_arquivo), SEGMENT_SIZE):
-                        payload = dados_arquivo[i:i+SEGMENT_SIZE]
-                        hash_seg = calculate_hash(payload)
-                        # Formato: SEQ|HASH|PAYLOAD
-                        segmento = f"{num_seq}|".encode(ENCODING) + hash_seg + b'|' + payload
-                        segmentos.append(segmento)
-                        num_seq += 1
-
-                    total_segmentos = len(segmentos)
-                    client_address = temp_address # Confirma o endereço do cliente
-                    print(f"Arquivo '{caminho_arquivo}' segmentado em {total_segmentos} partes para {client_address}.")
-                    
-                except Exception as e:
-                    print(f"Erro ao ler/segmentar arquivo {caminho_arquivo}: {e}")
-                    erro_msg = "Erro|Falha ao processar arquivo no servidor".encode(ENCODING)
-                    servidor.sendto(erro_msg, temp_address)
-                    continue # Volta a esperar por GET
+
+class EntradaManifesto:
+    """Checksums lidos de um manifesto em disco (somente leitura).
+
+    O manifesto é lido inteiro e fechado: a entrada não prende descritor
+    nenhum e custa o tamanho real dos checksums, então o LRU do cache a
+    descarta como as demais.
+    """
+
+    def __init__(self, chave, checksums, tam_checksum):
+        self.chave = chave
+        self.checksums = checksums
+        self.tam_checksum = tam_checksum
+        self.custo = len(checksums)
+
+    def obter(self, num_seq):
+        inicio = num_seq * self.tam_checksum
+        return self.checksums[inicio:inicio+self.tam_checksum]
+
+    def guardar(self, num_seq, checksum):
+        pass # Manifesto já está completo
+
+    @classmethod
+    def carregar(cls, caminho, chave, total_segmentos, checksum=CHECKSUM_PADRAO):
+        """Abre o manifesto do arquivo, se existir e ainda corresponder a ele; senão retorna None."""
+        checksum_id, tam_checksum, _, _ = CHECKSUMS[checksum]
+        try:
+            with open(caminho_manifesto(caminho, chave[2], checksum), 'rb') as f:
+                tamanho_esperado = CABECALHO_MANIFESTO.size + total_segmentos * tam_checksum
+                if os.fstat(f.fileno()).st_size != tamanho_esperado:
+                    return None
+                conteudo = f.read(tamanho_esperado)
+        except OSError:
+            return None
+        if len(conteudo) != tamanho_esperado:
+            return None
+        mtime_ns, tamanho, segment_size = chave
+        esperado = (MAGICO_MANIFESTO, VERSAO, checksum_id, segment_size, total_segmentos, tamanho, mtime_ns)
+        if CABECALHO_MANIFESTO.unpack_from(conteudo, 0) != esperado:
+            return None
+        return cls(chave, conteudo[CABECALHO_MANIFESTO.size:], tam_checksum)
+
+
+class EntradaComprimida:
+    """Segmentos já comprimidos (flags, checksum e payload) de uma versão de um arquivo, para um codec.
+
+    Cresce conforme as sessões montam os segmentos; o custo é informado ao
+    cache a cada segmento guardado. Segmentos que não compensaram comprimir
+    guardam só o checksum (o payload continua vindo do mmap).
+    """
+
+    def __init__(self, chave, chave_cache, cache):
+        self.chave = chave
+        self.chave_cache = chave_cache
+        self.cache = cache
+        self.segmentos = {} # {num_seq: (flags, checksum, payload comprimido ou None)}
+        self.custo = 0
+        self.ativa = True # False depois de sair do cache: para de guardar
+
+    def obter(self, num_seq):
+        return self.segmentos.get(num_seq)
+
+    def guardar(self, num_seq, flags, checksum, payload):
+        if not self.ativa or num_seq in self.segmentos:
+            return
+        self.segmentos[num_seq] = (flags, checksum, payload if flags else None)
+        crescimento = len(checksum) + (len(payload) if flags else 0)
+        self.custo += crescimento
+        self.cache.crescer(self, crescimento)
+
+    def descartar(self):
+        self.ativa = False
+        self.segmentos.clear()
+
+
+class EntradaDescartavel:
+    """Usada no lugar de uma entrada do cache quando nada pode ser reaproveitado.
+
+    Em um lote, o SEQ de cada segmento (coberto pelo checksum) depende da
+    posição do arquivo no pedido, então os checksums só valem para a sessão.
+    """
+
+    custo = 0
+
+    def obter(self, num_seq):
+        return None
+
+    def guardar(self, num_seq, *valores):
+        pass
+
+
+class CacheSegmentos:
+    """Cache LRU, limitado em bytes, dos checksums por segmento de cada arquivo.
+
+    A chave inclui mtime, tamanho e tamanho do segmento; se o arquivo muda,
+    a entrada antiga é invalidada no próximo GET. Pedidos repetidos do mesmo
+    arquivo não precisam recalcular nenhum hash. Com compressão, cada codec
+    tem a sua entrada, com os segmentos já comprimidos.
+    """
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self.uso_bytes = 0
+        self.entradas = OrderedDict() # {(caminho, codec, segment_size, checksum): entrada}, do menos para o mais recente
+
+    def obter(self, caminho, estado_arquivo, total_segmentos, codec=None, segment_size=SEGMENT_SIZE, checksum=CHECKSUM_PADRAO):
+        chave = (estado_arquivo.st_mtime_ns, estado_arquivo.st_size, segment_size)
+        chave_cache = (caminho, codec, segment_size, checksum)
+        descricao = f"Checksums de '{caminho}'" if codec is None else f"Segmentos de '{caminho}' comprimidos com {codec}"
+        entrada = self.entradas.get(chave_cache)
+        if entrada is not None:
+            if entrada.chave == chave:
+                self.entradas.move_to_end(chave_cache)
+                print(f"[CACHE] {descricao} reaproveitados do cache.")
+                return entrada
+            print(f"[CACHE] '{caminho}' mudou no disco. Invalidando entrada.")
+            self.remover(chave_cache)
+
+        if codec is not None:
+            entrada = EntradaComprimida(chave, chave_cache, self)
+        else:
+            entrada = EntradaManifesto.carregar(caminho, chave, total_segmentos, checksum)
+            if entrada is not None:
+                print(f"[MANIFESTO] Checksums de '{caminho}' carregados do manifesto em disco.")
             else:
-                 print(f"Recebido '{mensagem_cliente[:50]}' de {temp_address}. Esperando GET.")
+                entrada = EntradaCache(chave, total_segmentos, caminho, checksum)
+        if entrada.custo > self.limite_bytes:
+            return entrada # Grande demais para o cache; vale só para esta sessão
+        while self.entradas and self.uso_bytes + entrada.custo > self.limite_bytes:
+            self.remover(next(iter(self.entradas)))
+        self.entradas[chave_cache] = entrada
+        self.uso_bytes += entrada.custo
+        return entrada
 
-        except (UnicodeDecodeError, ConnectionResetError) as e:
-             print(f"Erro de decodificação ou conexão resetada: {e}. Aguardando novamente.")
-             continue # Ignora pacotes malformados ou erros de conexão UDP
-        except Exception as e:
-             print(f"Erro inesperado ao aguardar GET: {e}")
-             time.sleep(1) # Evita loop de erro muito rápido
-
-
-    # --- Lógica da Janela Deslizante ---
-    base = 0
-    proximo_seq_num = 0
-    acks_recebidos = set()
-    timers_envio = {} # {seq_num: timestamp}
-    contagem_tentativas = {} # {seq_num: count}
-    transferencia_ativa = True
-
-    while base < total_segmentos and transferencia_ativa:
-        # 1. Enviar novos segmentos dentro da janela
-        while proximo_seq_num < base + WINDOW_SIZE and proximo_seq_num < total_segmentos:
-            if proximo_seq_num not in timers_envio: # Enviar apenas se não foi enviado ou timeout ocorreu
+    def crescer(self, entrada, crescimento):
+        """Contabiliza o crescimento de uma entrada de segmentos comprimidos, liberando espaço se preciso."""
+        if self.entradas.get(entrada.chave_cache) is not entrada:
+            return
+        self.uso_bytes += crescimento
+        while self.uso_bytes > self.limite_bytes:
+            # Remove primeiro as outras entradas; a própria só se ela sozinha passar do limite
+            vitima = next((chave for chave in self.entradas if chave != entrada.chave_cache), entrada.chave_cache)
+            self.remover(vitima)
+            if vitima == entrada.chave_cache:
+                break
+
+    def remover(self, chave_cache):
+        entrada = self.entradas.pop(chave_cache, None)
+        if entrada is not None:
+            print(f"[CACHE] Removendo '{chave_cache[0]}'{f' ({chave_cache[1]})' if chave_cache[1] else ''} do cache.")
+            self.uso_bytes -= entrada.custo
+            if isinstance(entrada, EntradaComprimida):
+                entrada.descartar()
+
+
+class DigestsArquivos:
+    """Digests de arquivos inteiros para o INFO, calculados fora do caminho do INFO.
+
+    Ler o arquivo inteiro ao responder um INFO pararia todas as sessões
+    durante a leitura. Aqui o INFO só consulta a memória ou o '.digest'
+    gravado ao lado do manifesto; se o digest ainda não existe, o cálculo
+    entra na fila e avança DIGEST_BLOCO bytes por volta do loop principal
+    (o INFO sai sem digest e os seguintes já o levam). Arquivos de até um
+    bloco são calculados na hora. A versão (mtime e tamanho) faz parte da
+    chave: um arquivo alterado é calculado de novo.
+    """
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self.guardados = OrderedDict() # {(caminho, checksum): ((mtime_ns, tamanho), digest)}, do menos para o mais recente
+        self.fila = OrderedDict() # {(caminho, checksum): (mtime_ns, tamanho)} à espera de cálculo
+        self.atual = None # (chave, versão, arquivo, digesto) em cálculo; só um arquivo aberto por vez
+        self.buffer = bytearray(DIGEST_BLOCO)
+
+    def obter(self, caminho, estado_arquivo, checksum):
+        """Digest da versão atual do arquivo, ou None (ainda em cálculo ou arquivo grande demais)."""
+        chave = (os.path.abspath(caminho), checksum)
+        versao = (estado_arquivo.st_mtime_ns, estado_arquivo.st_size)
+        guardado = self.guardados.get(chave)
+        if guardado is not None and guardado[0] == versao:
+            self.guardados.move_to_end(chave)
+            return guardado[1]
+        if estado_arquivo.st_size > DIGEST_NO_INFO_MAXIMO:
+            return None
+        digesto = self.carregar(chave, versao)
+        if digesto is None and estado_arquivo.st_size <= DIGEST_BLOCO:
+            digesto = self.calcular_pequeno(chave, versao)
+        if digesto is not None:
+            self.guardar(chave, versao, digesto)
+            return digesto
+        if self.atual is None or self.atual[:2] != (chave, versao):
+            self.fila[chave] = versao
+        return None
+
+    def pendente(self):
+        return self.atual is not None or bool(self.fila)
+
+    def avancar(self):
+        """Lê mais um bloco do digest em cálculo, começando o próximo da fila se preciso."""
+        if self.atual is None:
+            if not self.fila:
+                return
+            chave, versao = self.fila.popitem(last=False)
+            try:
+                arquivo = open(chave[0], 'rb')
+            except OSError:
+                return
+            self.atual = (chave, versao, arquivo, novo_digesto(chave[1]))
+        chave, versao, arquivo, digesto = self.atual
+        try:
+            lidos = arquivo.readinto(self.buffer)
+            if lidos:
+                digesto.update(memoryview(self.buffer)[:lidos])
+                return
+            estado_arquivo = os.fstat(arquivo.fileno())
+        except OSError as e:
+            print(f"Aviso: não foi possível calcular o digest de '{chave[0]}': {e}")
+            estado_arquivo = None
+        self.atual = None
+        arquivo.close()
+        # Se o arquivo mudou durante a leitura, o digest é descartado; o próximo INFO pede de novo
+        if estado_arquivo is not None and (estado_arquivo.st_mtime_ns, estado_arquivo.st_size) == versao:
+            self.guardar(chave, versao, digesto.digest())
+            self.salvar(chave, versao, digesto.digest())
+
+    def calcular_pequeno(self, chave, versao):
+        try:
+            with open(chave[0], 'rb') as f:
+                lidos = f.readinto(self.buffer)
+        except OSError:
+            return None
+        if lidos != versao[1]:
+            return None
+        digesto = novo_digesto(chave[1])
+        digesto.update(memoryview(self.buffer)[:lidos])
+        return digesto.digest()
+
+    def guardar(self, chave, versao, digesto):
+        self.guardados[chave] = (versao, digesto)
+        self.guardados.move_to_end(chave)
+        if len(self.guardados) > self.maximo:
+            self.guardados.popitem(last=False)
+
+    def carregar(self, chave, versao):
+        """Digest gravado em disco por uma execução anterior (ou outro trabalhador), se for desta versão."""
+        caminho, checksum = chave
+        checksum_id, tam_digest, _, _ = CHECKSUMS[checksum]
+        try:
+            with open(caminho_digest(caminho, checksum), 'rb') as f:
+                conteudo = f.read(CABECALHO_DIGEST.size + tam_digest + 1)
+        except OSError:
+            return None
+        if len(conteudo) != CABECALHO_DIGEST.size + tam_digest:
+            return None
+        if CABECALHO_DIGEST.unpack_from(conteudo) != (MAGICO_DIGEST, checksum_id, versao[1], versao[0]):
+            return None
+        return conteudo[CABECALHO_DIGEST.size:]
+
+    def salvar(self, chave, versao, digesto):
+        """Grava o digest em disco (arquivo temporário + rename atômico), como os manifestos."""
+        caminho, checksum = chave
+        destino = caminho_digest(caminho, checksum)
+        try:
+            if DIRETORIO_MANIFESTOS is not None:
+                os.makedirs(DIRETORIO_MANIFESTOS, exist_ok=True)
+            temporario = f"{destino}.{os.getpid()}.tmp" # Trabalhadores podem calcular o mesmo digest ao mesmo tempo
+            with open(temporario, 'wb') as f:
+                f.write(CABECALHO_DIGEST.pack(MAGICO_DIGEST, CHECKSUMS[checksum][0], versao[1], versao[0]) + digesto)
+            os.replace(temporario, destino)
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar o digest '{destino}': {e}")
+
+
+class ArquivoAlterado(Exception):
+    """O arquivo servido mudou no disco (tamanho ou mtime) durante a transferência."""
+
+
+def montar_paridades(dados, inicio_bloco, segmentos_no_bloco, paridades_no_bloco, segment_size, checksum=CHECKSUM_PADRAO):
+    """Monta os pacotes de paridade (XOR) dos grupos intercalados de um bloco; dados(seq) dá o payload original de cada segmento."""
+    pacotes = []
+    for indice in range(paridades_no_bloco):
+        grupo = range(inicio_bloco + indice, inicio_bloco + segmentos_no_bloco, paridades_no_bloco)
+        if grupo:
+            # Gerador: cada payload entra no XOR antes da próxima leitura (dados() pode reaproveitar o buffer)
+            pacotes.append(montar_paridade(inicio_bloco, indice, segmentos_no_bloco, paridades_no_bloco,
+                                           (dados(seq) for seq in grupo), segment_size, checksum))
+    return pacotes
+
+
+class FonteSegmentos:
+    """Gera os segmentos de dados (cabeçalho binário + payload) sob demanda, à medida que a janela avança.
+
+    O arquivo é mapeado em memória (mmap) e apenas os segmentos ainda não
+    confirmados ficam montados, então o uso de memória acompanha o
+    WINDOW_SIZE e não o tamanho do arquivo. Com um codec, cada segmento é
+    comprimido isoladamente (uma vez por arquivo, graças ao cache).
+
+    Um segmento montado é o par (cabeçalho + checksum, payload): o payload
+    é um memoryview do mmap, nunca copiado, e as duas partes seguem juntas
+    no sendmsg. Os buffers de cabeçalho dos segmentos confirmados voltam
+    para uma lista de livres e são reaproveitados pelos próximos.
+
+    Em um lote, 'deslocamento' é o SEQ do primeiro segmento do arquivo; os
+    números de sequência recebidos e enviados são os do lote.
+
+    O Python nunca lê o mmap: se o arquivo for truncado por outro processo,
+    tocar em uma página que deixou de existir mata o servidor inteiro com
+    SIGBUS, e nenhuma conferência prévia elimina essa corrida. Checksum,
+    compressão, paridade e digest leem os dados com pread para um buffer
+    reaproveitado (dados); o mmap só vai para o sendmsg, em que o kernel
+    copia as páginas e, no pior caso, falha com EFAULT (OSError). Uma
+    leitura curta, ou tamanho/mtime diferentes (conferidos uma vez por
+    segmento), geram ArquivoAlterado, que aborta só a sessão do arquivo.
+    """
+
+    def __init__(self, caminho_arquivo, cache, codec=None, segment_size=SEGMENT_SIZE, deslocamento=0, checksum=CHECKSUM_PADRAO):
+        self.caminho = caminho_arquivo
+        self.arquivo = open(caminho_arquivo, 'rb')
+        estado_arquivo = os.fstat(self.arquivo.fileno())
+        self.tamanho = estado_arquivo.st_size
+        self.versao = (estado_arquivo.st_size, estado_arquivo.st_mtime_ns)
+        # mmap não aceita arquivos vazios
+        self.mapa = mmap.mmap(self.arquivo.fileno(), 0, access=mmap.ACCESS_READ) if self.tamanho > 0 else None
+        self.visao = memoryview(self.mapa) if self.mapa is not None else None
+        self.segment_size = segment_size
+        self.leitura = memoryview(bytearray(segment_size)) # Buffer de dados(), reaproveitado a cada leitura
+        self.total_segmentos = math.ceil(self.tamanho / segment_size)
+        self.em_voo = {} # {seq_num: (cabeçalho, payload)} - apenas os da janela
+        self.codec = codec
+        self.checksum = checksum # Algoritmo do checksum dos pacotes
+        self.tam_cabecalho = CABECALHO.size + CHECKSUMS[checksum][1]
+        self.cabecalhos_livres = [] # Buffers de cabeçalho de segmentos já confirmados
+        self.deslocamento = deslocamento
+        if deslocamento == 0:
+            self.checksums = cache.obter(os.path.abspath(caminho_arquivo), estado_arquivo, self.total_segmentos, codec, segment_size, checksum)
+        else:
+            self.checksums = EntradaDescartavel()
+
+    def conferir(self):
+        """Levanta ArquivoAlterado se o arquivo mudou desde que foi aberto."""
+        estado_arquivo = os.fstat(self.arquivo.fileno())
+        if (estado_arquivo.st_size, estado_arquivo.st_mtime_ns) != self.versao:
+            raise ArquivoAlterado(f"'{self.caminho}' foi alterado durante a transferência "
+                                  f"({self.versao[0]} -> {estado_arquivo.st_size} bytes)")
+
+    def dados(self, num_seq):
+        """Payload original (sem compressão) do segmento, lido com pread; vale só até a próxima chamada (buffer reaproveitado)."""
+        inicio = (num_seq - self.deslocamento) * self.segment_size
+        tamanho = self.tamanho_segmento(num_seq)
+        destino = self.leitura[:tamanho]
+        if hasattr(os, 'preadv'):
+            lidos = os.preadv(self.arquivo.fileno(), [destino], inicio)
+        else: # Windows não tem preadv
+            self.arquivo.seek(inicio)
+            lidos = self.arquivo.readinto(destino)
+        if lidos != tamanho:
+            raise ArquivoAlterado(f"'{self.caminho}' foi truncado durante a transferência (segmento {num_seq} com {lidos} de {tamanho} bytes)")
+        return destino
+
+    def fatia(self, num_seq):
+        """Payload original do segmento como memoryview do mmap (sem cópia), só para o sendmsg."""
+        inicio = (num_seq - self.deslocamento) * self.segment_size
+        return self.visao[inicio:inicio+self.segment_size]
+
+    def tamanho_segmento(self, num_seq):
+        return min(self.segment_size, self.tamanho - (num_seq - self.deslocamento) * self.segment_size)
+
+    def segmento(self, num_seq, digesto=None):
+        """Retorna as partes (cabeçalho, payload) do segmento, montando-o (e calculando o hash) se necessário.
+
+        Ao montar, os dados são lidos uma única vez e, se houver 'digesto'
+        (o do EOF), somados a ele com a mesma leitura.
+        """
+        segmento = self.em_voo.get(num_seq)
+        if segmento is None:
+            self.conferir()
+            dados = self.dados(num_seq)
+            if digesto is not None:
+                digesto.update(dados)
+            cabecalho = self.cabecalhos_livres.pop() if self.cabecalhos_livres else bytearray(self.tam_cabecalho)
+            if self.codec is not None:
+                payload = self.montar_comprimido(num_seq, cabecalho, dados)
+            else:
+                payload = self.fatia(num_seq)
+                escrever_cabecalho(cabecalho, TIPO_DADOS, num_seq, len(payload), checksum=self.checksum)
+                checksum = self.checksums.obter(num_seq - self.deslocamento)
+                if checksum is None:
+                    checksum = calcular_checksum(memoryview(cabecalho)[:CABECALHO.size], dados, algoritmo=self.checksum)
+                    self.checksums.guardar(num_seq - self.deslocamento, checksum)
+                cabecalho[CABECALHO.size:] = checksum
+            segmento = (cabecalho, payload)
+            self.em_voo[num_seq] = segmento
+        return segmento
+
+    def montar_comprimido(self, num_seq, cabecalho, dados):
+        """Escreve o cabeçalho do segmento comprimido e retorna o payload, reaproveitando o cache quando possível."""
+        cacheado = self.checksums.obter(num_seq - self.deslocamento)
+        if cacheado is None:
+            flags, payload = comprimir(self.codec, dados)
+            escrever_cabecalho(cabecalho, TIPO_DADOS, num_seq, len(payload), flags, self.checksum)
+            checksum = calcular_checksum(memoryview(cabecalho)[:CABECALHO.size], payload, algoritmo=self.checksum)
+            self.checksums.guardar(num_seq - self.deslocamento, flags, checksum, payload)
+        else:
+            flags, checksum, payload = cacheado
+            escrever_cabecalho(cabecalho, TIPO_DADOS, num_seq, len(payload) if payload is not None else len(dados), flags, self.checksum)
+        if not flags: # Não compensou comprimir: o payload vem do mmap, como sem codec
+            payload = self.fatia(num_seq)
+        cabecalho[CABECALHO.size:] = checksum
+        return payload
+
+    def paridades(self, inicio_bloco, segmentos_no_bloco, paridades_no_bloco):
+        """Monta os pacotes de paridade (XOR) dos grupos intercalados de um bloco."""
+        return montar_paridades(self.dados, inicio_bloco, segmentos_no_bloco, paridades_no_bloco, self.segment_size, self.checksum)
+
+    def liberar(self, num_seq):
+        """Descarta o segmento montado após a confirmação (ACK); o buffer do cabeçalho volta para os livres."""
+        segmento = self.em_voo.pop(num_seq, None)
+        if segmento is not None:
+            self.cabecalhos_livres.append(segmento[0])
+
+    def fechar(self):
+        self.em_voo.clear()
+        self.cabecalhos_livres.clear()
+        if self.mapa is not None:
+            self.visao.release()
+            try:
+                self.mapa.close()
+            except BufferError:
+                pass # Ainda há uma fatia do mmap em uso; ele é fechado quando ela for coletada
+        self.arquivo.close()
+
+
+class FonteLote:
+    """Segmentos de vários arquivos enviados em uma única sessão (GET de lote).
+
+    Cada arquivo é um fluxo, identificado pela posição no pedido, e ocupa
+    uma faixa contígua de números de sequência (ver bases_do_lote). Assim a
+    janela, os ACKs/SACK, o FEC e o EOF funcionam como em um arquivo só, e
+    há um único encerramento para o lote inteiro. Cada arquivo só é aberto
+    quando um segmento dele é pedido e é fechado quando todos foram
+    confirmados: milhares de arquivos pequenos não esgotam os descritores.
+    """
+
+    def __init__(self, caminhos, cache, codec=None, segment_size=SEGMENT_SIZE, checksum=CHECKSUM_PADRAO):
+        self.caminhos = caminhos
+        self.cache = cache
+        self.codec = codec
+        self.segment_size = segment_size
+        self.checksum = checksum
+        self.tamanhos = [os.path.getsize(caminho) if os.path.isfile(caminho) else None for caminho in caminhos]
+        self.bases, self.total_segmentos = bases_do_lote(self.tamanhos, segment_size)
+        self.tamanho = sum(tamanho or 0 for tamanho in self.tamanhos)
+        self.nao_confirmados = [math.ceil((tamanho or 0) / segment_size) for tamanho in self.tamanhos]
+        self.abertas = {} # {fluxo: FonteSegmentos}
+
+    def fluxo(self, num_seq):
+        # Arquivos vazios têm a mesma base do seguinte; bisect_right fica com o último, que é o dono do segmento
+        return bisect_right(self.bases, num_seq) - 1
+
+    def fonte(self, num_seq):
+        fluxo = self.fluxo(num_seq)
+        fonte = self.abertas.get(fluxo)
+        if fonte is None:
+            fonte = FonteSegmentos(self.caminhos[fluxo], self.cache, self.codec, self.segment_size, self.bases[fluxo], self.checksum)
+            self.abertas[fluxo] = fonte
+        return fonte
+
+    def segmento(self, num_seq, digesto=None):
+        return self.fonte(num_seq).segmento(num_seq, digesto)
+
+    def dados(self, num_seq):
+        return self.fonte(num_seq).dados(num_seq)
+
+    def tamanho_segmento(self, num_seq):
+        fluxo = self.fluxo(num_seq)
+        return min(self.segment_size, self.tamanhos[fluxo] - (num_seq - self.bases[fluxo]) * self.segment_size)
+
+    def paridades(self, inicio_bloco, segmentos_no_bloco, paridades_no_bloco):
+        """Os grupos de FEC podem atravessar arquivos: só dependem de dados().
+
+        Arquivos do bloco já confirmados (e fechados por liberar) são
+        reabertos só para montar as paridades e fechados logo em seguida.
+        """
+        abertas_antes = set(self.abertas)
+        try:
+            return montar_paridades(self.dados, inicio_bloco, segmentos_no_bloco, paridades_no_bloco, self.segment_size, self.checksum)
+        finally:
+            for fluxo in [fluxo for fluxo in self.abertas if fluxo not in abertas_antes and self.nao_confirmados[fluxo] == 0]:
+                self.abertas.pop(fluxo).fechar()
+
+    def liberar(self, num_seq):
+        fluxo = self.fluxo(num_seq)
+        fonte = self.abertas.get(fluxo)
+        if fonte is not None:
+            fonte.liberar(num_seq)
+        self.nao_confirmados[fluxo] -= 1
+        if self.nao_confirmados[fluxo] == 0 and fonte is not None: # Arquivo inteiro confirmado
+            fonte.fechar()
+            del self.abertas[fluxo]
+
+    def fechar(self):
+        for fonte in self.abertas.values():
+            fonte.fechar()
+        self.abertas.clear()
+
+
+class SessaoTransferencia:
+    """Estado da transferência de um arquivo para um único cliente.
+
+    Cada cliente tem sua própria janela deslizante, timers e contagem de
+    tentativas, de forma que um cliente lento ou com perdas não bloqueia
+    os demais que compartilham o mesmo socket do servidor.
+    """
+
+    def __init__(self, client_address, caminho_arquivo, fonte, inicio=0, fim=None, fec=None):
+        self.client_address = client_address
+        self.caminho_arquivo = caminho_arquivo
+        self.fonte = fonte
+        # Faixa de segmentos [inicio, fim) pedida pelo cliente; os números de
+        # sequência continuam absolutos (posição do segmento no arquivo)
+        self.inicio = inicio
+        self.fim = fonte.total_segmentos if fim is None else fim
+        self.total_segmentos = self.fim - self.inicio
+        # FEC: (N, K) = K paridades a cada N segmentos, em blocos contados a partir de 'inicio'
+        self.fec = fec
+        # Digest dos dados da faixa, atualizado no 1º envio de cada segmento (que é sempre em ordem) e enviado no EOF
+        self.digesto = novo_digesto(fonte.checksum)
+
+        # --- Estado da Janela Deslizante ---
+        self.base = inicio
+        self.proximo_seq_num = inicio
+        self.acks_recebidos = set()
+        self.timers_envio = {} # {seq_num: timestamp}
+        self.contagem_tentativas = {} # {seq_num: count}
+        self.prazos = [] # Heap de (prazo, seq_num, timestamp do envio) para retransmissão
+        self.transferencia_ativa = True
+        self.rtt = EstimadorRTT()
+        self.cc = ControleCongestionamento()
+        self.balde = BaldeTokens(RAJADA_MAXIMA * (fonte.segment_size + SOBRECARGA_PACOTE))
+        self.liberacao_ritmo = None # Quando o pacing volta a permitir envio (None = não está esperando)
+        self.metricas = MetricasTransferencia('servidor', arquivo=caminho_arquivo, cliente=f"{client_address[0]}:{client_address[1]}")
+        self.metricas.entrar_fase('envio')
+
+        # --- Estado do Envio Confiável do EOF ---
+        self.enviando_eof = False
+        self.eof_confirmado = False
+        self.tentativas_eof = 0
+        self.timer_eof = None
+        self.finalizada = False
+
+    def abortar(self, motivo):
+        print(motivo)
+        print(f"Transferência para {self.client_address} foi abortada.")
+        self.transferencia_ativa = False
+        self.finalizada = True
+
+    def abortar_alterado(self, servidor, erro):
+        """O arquivo mudou no meio do envio: avisa o cliente (que pode pedir de novo) e encerra só esta sessão."""
+        try:
+            enviar_erro(servidor, "Arquivo alterado no servidor durante a transferência; tente novamente.", self.client_address)
+        except socket.error:
+            pass
+        self.abortar(f"[ERRO] {erro}. Abortando envio para {self.client_address}.")
+
+    def atualizar_ritmo(self, janela):
+        """Taxa do balde: fixa (TAXA_ENVIO) ou a janela atual espalhada ao longo de um RTT."""
+        if TAXA_ENVIO != 'rtt':
+            self.balde.taxa = TAXA_ENVIO
+        elif self.rtt.srtt: # Sem medição de RTT ainda, não limita (a janela inicial é pequena)
+            # Como no pacing do Linux: folga de 2x em slow start e de 1,25x depois
+            ganho = 2.0 if self.cc.janela < self.cc.ssthresh else 1.25
+            self.balde.taxa = ganho * janela * self.fonte.segment_size / self.rtt.srtt
+
+    def enviar_janela(self, servidor):
+        """Envia os segmentos novos que cabem na janela, no ritmo permitido pelo balde de tokens."""
+        janela = min(self.cc.tamanho, max(JANELA_MAXIMA_BYTES // self.fonte.segment_size, JANELA_MINIMA))
+        self.atualizar_ritmo(janela)
+        agora = time.time()
+        self.balde.reabastecer(agora)
+        self.liberacao_ritmo = None
+        while self.proximo_seq_num < self.base + janela and self.proximo_seq_num < self.fim:
+            seq_num = self.proximo_seq_num
+            if seq_num not in self.timers_envio: # Enviar apenas se não foi enviado ou timeout ocorreu
                 try:
-                    servidor.sendto(segmentos[proximo_seq_num], client_address)
-                    timers_envio[proximo_seq_num] = time.time()
-                    contagem_tentativas[proximo_seq_num] = 1
-                    # print(f"[ENVIO] Segmento {proximo_seq_num} enviado (tentativa 1)")
+                    segmento = self.fonte.segmento(seq_num, self.digesto) # Montado uma vez, em ordem: soma ao digest do EOF
+                    tamanho = tamanho_partes(segmento)
+                    if not self.balde.disponivel(tamanho):
+                        self.liberacao_ritmo = self.balde.liberacao(tamanho)
+                        return # Continua quando o balde tiver tokens
+                    enviar_partes(servidor, segmento, self.client_address)
+                    self.balde.consumir(tamanho)
+                    self.armar_timer(seq_num, agora)
+                    self.contagem_tentativas[seq_num] = 1
+                    self.metricas.contar("segmentos_enviados")
+                    self.metricas.contar("bytes_rede", tamanho)
+                    if NIVEL_LOG >= NIVEL_PACOTE:
+                        print(f"[ENVIO] Segmento {seq_num} enviado (tentativa 1)")
+                    if self.fec is not None:
+                        self.enviar_paridades(servidor, seq_num)
+                except ArquivoAlterado as e:
+                    self.abortar_alterado(servidor, e)
+                    return
                 except socket.error as e:
-                     print(f"Erro de socket ao enviar seg {proximo_seq_num}: {e}")
-                     # Poderia abortar aqui ou tentar mais tarde
-                     transferencia_ativa = False; break # Abortar transferência neste caso
+                    self.abortar(f"Erro de socket ao enviar seg {seq_num}: {e}")
+                    return
                 except Exception as e:
-                     print(f"Erro inesperado ao enviar seg {proximo_seq_num}: {e}")
-                     transferencia_ativa = False; break
-            proximo_seq_num += 1
-        if not transferencia_ativa: break
+                    self.abortar(f"Erro inesperado ao enviar seg {seq_num}: {e}")
+                    return
+            self.proximo_seq_num += 1
 
-        # 2. Verificar Timeouts e Retransmitir
-        agora = time.time()
-        for seq_num in range(base, proximo_seq_num):
-            if seq_num not in acks_recebidos:
-                tempo_envio = timers_envio.get(seq_num)
-                if tempo_envio is not None and agora - tempo_envio > RETRANSMISSION_TIMEOUT:
-                    if contagem_tentativas.get(seq_num, 0) >= MAX_RETRANSMISSIONS:
-                        print(f"[ERRO FATAL] Segmento {seq_num} excedeu {MAX_RETRANSMISSIONS} tentativas. Abortando envio para {client_address}.")
-                        transferencia_ativa = False
-                        break # Sai do loop de verificação de timeout
-
-                    print(f"[TIMEOUT] Timeout para ACK do segmento {seq_num}. Reenviando...")
-                    try:
-                        servidor.sendto(segmentos[seq_num], client_address)
-                        timers_envio[seq_num] = agora # Atualiza timer
-                        contagem_tentativas[seq_num] = contagem_tentativas.get(seq_num, 0) + 1
-                        print(f"[REENVIO] Segmento {seq_num} reenviado (tentativa {contagem_tentativas[seq_num]})")
-                    except socket.error as e:
-                        print(f"Erro de socket ao reenviar seg {seq_num}: {e}")
-                        transferencia_ativa = False; break
-                    except Exception as e:
-                        print(f"Erro inesperado ao reenviar seg {seq_num}: {e}")
-                        transferencia_ativa = False; break
-        if not transferencia_ativa: break
-
-        # 3. Tentar Receber ACKs (com timeout curto)
-        try:
-            servidor.settimeout(ACK_TIMEOUT) # Timeout curto para ACKs
-            dados_ack, addr_ack = servidor.recvfrom(BUFFER_SIZE)
-
-            if addr_ack == client_address: # Processar apenas ACKs do cliente atual
-                ack_str = dados_ack.decode(ENCODING)
-                if ack_str.startswith("ACK|"):
-                    ack_seq = int(ack_str.split('|')[1])
-                    # print(f"[ACK] Recebido ACK para {ack_seq}")
-                    acks_recebidos.add(ack_seq)
-
-                    # Avançar a base da janela
-                    while base in acks_recebidos:
-                        # Remover do gerenciamento de timer/tentativas para economizar memória
-                        timers_envio.pop(base, None)
-                        contagem_tentativas.pop(base, None)
-                        base += 1
-                    # print(f"Janela avançou para base {base}")
+    def enviar_paridades(self, servidor, seq_num):
+        """Depois do último segmento de um bloco, envia as K paridades dele (sem ACK nem retransmissão)."""
+        segmentos_por_bloco, paridades_no_bloco = self.fec
+        inicio_bloco = self.inicio + (seq_num - self.inicio) // segmentos_por_bloco * segmentos_por_bloco
+        segmentos_no_bloco = seq_num - inicio_bloco + 1
+        if segmentos_no_bloco != segmentos_por_bloco and seq_num != self.fim - 1:
+            return # Bloco ainda incompleto
+        for pacote in self.fonte.paridades(inicio_bloco, segmentos_no_bloco, paridades_no_bloco):
+            servidor.sendto(pacote, self.client_address)
+            self.balde.consumir(len(pacote))
+            self.metricas.contar("paridades")
+            self.metricas.contar("bytes_rede", len(pacote))
+
+    def verificar_timeouts(self, servidor, agora):
+        """Retransmite segmentos (ou o EOF) cujo timer expirou."""
+        if self.enviando_eof:
+            if agora >= self.timer_eof + self.rtt.rto:
+                print(f"[TIMEOUT EOF] Timeout esperando por ACK_EOF de {self.client_address}.")
+                self.tentativas_eof += 1
+                self.rtt.backoff()
+                if self.tentativas_eof >= MAX_RETRANSMISSIONS:
+                    print(f"[FALHA EOF] Cliente {self.client_address} não confirmou recebimento de EOF após {self.tentativas_eof} tentativas.")
+                    print(f"[SUCESSO] Transferência para {self.client_address} finalizada.")
+                    self.finalizada = True
                 else:
-                    print(f"Recebido msg não ACK de {client_address}: {ack_str[:50]}")
-            else:
-                 print(f"Recebido pacote de endereço inesperado {addr_ack}. Ignorando.")
+                    self.enviar_eof(servidor)
+            return
 
-        except socket.timeout:
-            # Timeout esperando por ACK é normal, apenas continua o loop
-            pass
-        except (UnicodeDecodeError, ValueError, IndexError) as e:
-             print(f"Erro ao processar ACK recebido: {e}. Ignorando.")
-        except ConnectionResetError:
-             print(f"Erro: Conexão resetada pelo cliente {client_address}. Abortando transferência.")
-             transferencia_ativa = False
+        # Retira do heap apenas os prazos vencidos; entradas de segmentos já
+        # confirmados ou reenviados desde então são descartadas ao sair do heap
+        expirados = []
+        while self.prazos and self.prazos[0][0] <= agora:
+            _, seq_num, tempo_envio = heapq.heappop(self.prazos)
+            if seq_num >= self.base and seq_num not in self.acks_recebidos and self.timers_envio.get(seq_num) == tempo_envio:
+                expirados.append(seq_num)
+        if not expirados:
+            return
+
+        rto = self.rtt.rto
+        self.rtt.backoff() # Uma vez por rodada, não por segmento
+        for seq_num in expirados:
+            if self.contagem_tentativas.get(seq_num, 0) >= MAX_RETRANSMISSIONS:
+                self.abortar(f"[ERRO FATAL] Segmento {seq_num} excedeu {MAX_RETRANSMISSIONS} tentativas. Abortando envio para {self.client_address}.")
+                return
+
+            if NIVEL_LOG >= NIVEL_PACOTE:
+                print(f"[TIMEOUT] Timeout ({rto:.3f}s) para ACK do segmento {seq_num} ({self.client_address}). Reenviando...")
+            self.cc.ao_perder(seq_num, self.proximo_seq_num, self.contagem_tentativas.get(seq_num, 0) > 1)
+            try:
+                segmento = self.fonte.segmento(seq_num)
+                tamanho = tamanho_partes(segmento)
+                enviar_partes(servidor, segmento, self.client_address)
+                self.balde.consumir(tamanho)
+                self.armar_timer(seq_num, agora) # Atualiza timer
+                self.contagem_tentativas[seq_num] = self.contagem_tentativas.get(seq_num, 0) + 1
+                self.metricas.contar("segmentos_retransmitidos")
+                self.metricas.contar("bytes_rede", tamanho)
+                if NIVEL_LOG >= NIVEL_PACOTE:
+                    print(f"[REENVIO] Segmento {seq_num} reenviado (tentativa {self.contagem_tentativas[seq_num]})")
+            except ArquivoAlterado as e:
+                self.abortar_alterado(servidor, e)
+                return
+            except socket.error as e:
+                self.abortar(f"Erro de socket ao reenviar seg {seq_num}: {e}")
+                return
+            except Exception as e:
+                self.abortar(f"Erro inesperado ao reenviar seg {seq_num}: {e}")
+                return
+
+    def armar_timer(self, seq_num, agora):
+        """Registra o envio de seq_num e agenda o prazo de retransmissão no heap."""
+        self.timers_envio[seq_num] = agora
+        heapq.heappush(self.prazos, (agora + self.rtt.rto, seq_num, agora))
+
+    def proximo_prazo(self):
+        """Momento em que esta sessão precisa ser verificada de novo (ou None)."""
+        if self.enviando_eof:
+            return self.timer_eof + self.rtt.rto if self.timer_eof is not None else None
+        prazos = [prazo for prazo in (self.prazos[0][0] if self.prazos else None, self.liberacao_ritmo) if prazo is not None]
+        return min(prazos) if prazos else None
+
+    def processar_pacote(self, dados, servidor):
+        """Trata um pacote (ACK ou ACK_EOF) vindo do cliente desta sessão."""
+        try:
+            tipo, flags, ack_seq, payload, checksum_ok = analisar_pacote(dados)
+        except ValueError as e:
+            print(f"Erro ao processar ACK recebido de {self.client_address}: {e}. Ignorando.")
+            return
+        if not checksum_ok:
+            print(f"[CORRUPÇÃO] Checksum inválido em pacote de {self.client_address}. Ignorando.")
+            self.metricas.contar("segmentos_corrompidos")
+            return
+
+        if self.enviando_eof:
+            if tipo == TIPO_ACK_EOF:
+                self.eof_confirmado = True
+                self.finalizada = True
+                print(f"[EOF CONFIRMADO] Cliente {self.client_address} reconheceu EOF.")
+                print(f"[SUCESSO] Transferência para {self.client_address} finalizada.")
+            elif tipo != TIPO_ACK: # ACKs atrasados de dados são esperados
+                print(f"Recebido msg inesperada ({NOMES_TIPOS.get(tipo, tipo)}) de {self.client_address} esperando ACK_EOF.")
+            return
+
+        if tipo == TIPO_ACK:
+            # ACK cumulativo: todos os segmentos antes de 'ack_seq' chegaram; o bitmap SACK
+            # confirma os recebidos fora de ordem. Um único ACK pode confirmar vários segmentos.
+            self.metricas.contar("acks")
+            cumulativo = min(ack_seq, self.proximo_seq_num) # Não confirma o que nem foi enviado
+            confirmados = list(range(self.base, cumulativo))
+            confirmados += [seq for seq in ler_sack(ack_seq, payload) if seq < self.proximo_seq_num]
+            agora = time.time()
+            amostra_rtt = None
+            for seq in confirmados:
+                if seq < self.base or seq in self.acks_recebidos:
+                    continue # ACKs antigos (duplicados) não interessam mais
+                # Regra de Karn: segmentos retransmitidos não geram amostra de RTT
+                if self.contagem_tentativas.get(seq) == 1:
+                    amostra_rtt = agora - self.timers_envio[seq] # Fica com a do segmento mais recente
+                self.cc.ao_confirmar(agora)
+                self.acks_recebidos.add(seq)
+                self.metricas.contar("segmentos_confirmados")
+            if amostra_rtt is not None:
+                self.rtt.amostrar(amostra_rtt)
+                self.metricas.observar_rtt(amostra_rtt)
+
+            # Avançar a base da janela
+            while self.base in self.acks_recebidos:
+                # Remover do gerenciamento de timer/tentativas para economizar memória
+                self.timers_envio.pop(self.base, None)
+                self.contagem_tentativas.pop(self.base, None)
+                self.acks_recebidos.discard(self.base)
+                self.fonte.liberar(self.base)
+                self.metricas.contar("bytes_dados", self.fonte.tamanho_segmento(self.base))
+                self.base += 1
+            if NIVEL_LOG >= NIVEL_PACOTE:
+                print(f"Janela avançou para base {self.base}")
+
+            # Perda indicada pelo SACK: a base continua faltando, mas LIMIAR_PERDA_SACK segmentos
+            # depois dela já chegaram. Reduz a janela sem esperar o timeout (ao_perder só reduz
+            # uma vez por janela); a retransmissão continua a cargo do timer.
+            if self.base < self.proximo_seq_num and len(self.acks_recebidos) >= LIMIAR_PERDA_SACK:
+                if NIVEL_LOG >= NIVEL_PACOTE and self.base >= self.cc.recuperacao_ate:
+                    print(f"[PERDA SACK] Segmento {self.base} ultrapassado por {len(self.acks_recebidos)} segmentos confirmados ({self.client_address}).")
+                self.cc.ao_perder(self.base, self.proximo_seq_num, False)
+
+            if self.base == self.fim:
+                print(f"\nTodos os {self.total_segmentos} segmentos de dados confirmados para {self.client_address} (ACKs recebidos, janela final {self.cc.tamanho}). Enviando EOF...")
+                if self.fec is not None:
+                    print(f"[FEC] {self.metricas.contadores['paridades']} segmentos de paridade enviados ({self.fec[1]} a cada {self.fec[0]}).")
+                self.enviando_eof = True
+                self.enviar_eof(servidor)
+        else:
+            print(f"Recebido msg não ACK ({NOMES_TIPOS.get(tipo, tipo)}) de {self.client_address}. Ignorando.")
+
+    def enviar_eof(self, servidor):
+        # Sem número de sequência; o payload é o digest de tudo que foi enviado, para o cliente conferir
+        segmento_eof = montar_pacote(TIPO_EOF, payload=self.digesto.digest(), checksum=self.fonte.checksum)
+        if self.metricas.fase_atual != 'eof':
+            self.metricas.entrar_fase('eof')
+        print(f"[ENVIO EOF] Enviando sinal de EOF para {self.client_address} (tentativa {self.tentativas_eof + 1})...")
+        try:
+            servidor.sendto(segmento_eof, self.client_address)
+            self.timer_eof = time.time()
         except Exception as e:
-             print(f"Erro inesperado ao receber ACK: {e}")
-             transferencia_ativa = False
+            self.abortar(f"Erro ao enviar EOF: {e}")
+
+
+class SupervisorTrabalhadores:
+    """Modo multiprocesso: mantém N trabalhadores (este mesmo script) escutando a mesma porta.
 
+    Cada trabalhador abre o socket com SO_REUSEPORT e o kernel distribui os
+    clientes entre eles pelo hash do fluxo (endereço e porta de origem),
+    então todos os pacotes de um cliente vão sempre para o mesmo processo e
+    cada um tem o seu GIL, cache e sessões. Os trabalhadores mandam as
+    métricas de cada transferência encerrada por um pipe; o supervisor soma,
+    exporta e relata os totais, e reinicia quem morrer.
 
-    # --- Fim da Janela Deslizante ou Abort ---
+    Quando um trabalhador morre, o kernel redistribui os fluxos entre os
+    sockets que sobraram: transferências em andamento em outros processos
+    podem perder a sessão e o cliente precisa pedir de novo.
+    """
 
-    if not transferencia_ativa:
-        print(f"Transferência para {client_address} foi abortada.")
-        continue # Volta ao loop principal esperando por GET
+    def __init__(self, processos, argumentos_trabalhador):
+        self.processos = processos
+        self.argumentos_trabalhador = argumentos_trabalhador
+        self.seletor = selectors.DefaultSelector()
+        self.trabalhadores = {} # {índice: [processo, fd do pipe de métricas, buffer, instante de início]}
+        self.reinicios_pendentes = {} # {índice: instante do reinício}
+        self.reinicios = 0
+        self.totais = MetricasTransferencia('servidor')
+        self.totais.transferencias = 0
+        self.totais.tempo_ativo = 0.0 # Goodput pelo tempo das transferências, não pelo tempo de vida do supervisor
+        self.transferencias_por_trabalhador = [0] * processos
+        self.ultimo_relatorio = time.time()
+        self.transferencias_relatadas = 0
 
-    if base == total_segmentos:
-        print(f"\nTodos os {total_segmentos} segmentos de dados confirmados (ACKs recebidos). Enviando EOF...")
-        # --- Envio Confiável do EOF ---
-        eof_confirmado = False
-        tentativas_eof = 0
-        # Formato: EOF|HASH_DO_PAYLOAD_EOF (payload é só b"EOF")
-        eof_payload = b"EOF"
-        eof_hash = calculate_hash(eof_payload)
-        segmento_eof = b"EOF|" + eof_hash # Não precisa de numero de sequencia
+    def iniciar(self, indice):
+        leitura, escrita = os.pipe()
+        comando = [sys.executable, os.path.abspath(sys.argv[0]), *self.argumentos_trabalhador,
+                   "--trabalhador", str(indice), "--canal-metricas", str(escrita)]
+        processo = subprocess.Popen(comando, pass_fds=(escrita,))
+        os.close(escrita)
+        self.seletor.register(leitura, selectors.EVENT_READ, indice)
+        self.trabalhadores[indice] = [processo, leitura, b"", time.time()]
+        print(f"[SUPERVISOR] Trabalhador {indice} iniciado (pid {processo.pid}).")
 
-        while not eof_confirmado and tentativas_eof < MAX_RETRANSMISSIONS:
-            print(f"[ENVIO EOF] Enviando sinal de EOF (tentativa {tentativas_eof + 1})...")
+    def receber_metricas(self, indice):
+        """Lê do pipe do trabalhador as métricas (uma linha JSON por transferência) e soma aos totais."""
+        trabalhador = self.trabalhadores[indice]
+        dados = os.read(trabalhador[1], 65536)
+        if not dados: # Trabalhador fechou o pipe (morreu); o poll() cuida do reinício
+            self.seletor.unregister(trabalhador[1])
+            return
+        *linhas, trabalhador[2] = (trabalhador[2] + dados).split(b"\n")
+        for linha in linhas:
             try:
-                servidor.sendto(segmento_eof, client_address)
-            except Exception as e:
-                 print(f"Erro ao enviar EOF: {e}")
-                 break # Aborta se não conseguir enviar EOF
+                conteudo = json.loads(linha)
+                metricas = MetricasTransferencia.de_dict(conteudo)
+            except (ValueError, KeyError) as e:
+                print(f"[SUPERVISOR] Métricas inválidas do trabalhador {indice}: {e}")
+                continue
+            self.totais.somar(metricas)
+            self.transferencias_por_trabalhador[indice] += metricas.transferencias
+            if EXPORTAR_METRICAS == 'json':
+                exportar_metricas(metricas, 'json', ARQUIVO_METRICAS + ".jsonl")
+            elif EXPORTAR_METRICAS == 'prometheus':
+                exportar_metricas(self.totais, 'prometheus', ARQUIVO_METRICAS + ".prom")
 
-            # Espera pelo ACK_EOF
+    def verificar_trabalhadores(self, agora):
+        """Agenda o reinício de quem morreu e reinicia os que já podem voltar."""
+        for indice, (processo, leitura, _, inicio) in list(self.trabalhadores.items()):
+            if processo.poll() is None:
+                continue
             try:
-                servidor.settimeout(RETRANSMISSION_TIMEOUT) # Usa timeout maior para ACK_EOF
-                data_eof_ack, addr_eof_ack = servidor.recvfrom(BUFFER_SIZE)
-                if addr_eof_ack == client_address and data_eof_ack == b"ACK_EOF":
-                    eof_confirmado = True
-                    print("[EOF CONFIRMADO] Cliente reconheceu EOF.")
-                else:
-                    print(f"Recebido msg inesperada ({data_eof_ack[:50]}) de {addr_eof_ack} esperando ACK_EOF.")
+                while self.seletor.get_key(leitura): # Métricas que ficaram no pipe
+                    self.receber_metricas(indice)
+            except KeyError:
+                pass
+            os.close(leitura)
+            del self.trabalhadores[indice]
+            espera = max(TEMPO_MINIMO_VIVO - (agora - inicio), 0)
+            print(f"[SUPERVISOR] Trabalhador {indice} (pid {processo.pid}) terminou com código {processo.returncode}. "
+                  f"Reiniciando{f' em {espera:.1f}s' if espera else ''}.")
+            self.reinicios_pendentes[indice] = agora + espera
+        for indice, instante in list(self.reinicios_pendentes.items()):
+            if instante <= agora:
+                del self.reinicios_pendentes[indice]
+                self.reinicios += 1
+                self.iniciar(indice)
 
-            except socket.timeout:
-                print("[TIMEOUT EOF] Timeout esperando por ACK_EOF.")
-                tentativas_eof += 1
-            except Exception as e:
-                 print(f"Erro recebendo ACK_EOF: {e}")
-                 break # Sai do loop de EOF
+    def relatar(self):
+        por_trabalhador = ", ".join(f"{indice}: {quantidade}" for indice, quantidade in enumerate(self.transferencias_por_trabalhador))
+        print(f"[SUPERVISOR] {len(self.trabalhadores)}/{self.processos} trabalhadores ativos, {self.reinicios} reinício(s). "
+              f"Transferências por trabalhador: {por_trabalhador}.")
+        print(f"[SUPERVISOR] Totais: {self.totais.transferencias} transferências, {self.totais.resumo()}")
+        self.ultimo_relatorio = time.time()
+        self.transferencias_relatadas = self.totais.transferencias
+
+    def executar(self):
+        # SIGTERM encerra como o Ctrl+C: os trabalhadores são finalizados junto
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        for indice in range(self.processos):
+            self.iniciar(indice)
+        try:
+            while True:
+                for chave, _ in self.seletor.select(1.0):
+                    self.receber_metricas(chave.data)
+                agora = time.time()
+                self.verificar_trabalhadores(agora)
+                if agora - self.ultimo_relatorio >= INTERVALO_RELATORIO and self.totais.transferencias > self.transferencias_relatadas:
+                    self.relatar()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for processo, _, _, _ in self.trabalhadores.values():
+                processo.terminate()
+            for processo, _, _, _ in self.trabalhadores.values():
+                try:
+                    processo.wait(5)
+                except subprocess.TimeoutExpired:
+                    processo.kill()
+            print("\n[SUPERVISOR] Encerrando.")
+            self.relatar()
+
+
+def interpretar_requisicao(mensagem_cliente):
+    """Separa 'GET /arquivo?chave=valor&...' em ([caminhos], {chave: valor}).
+
+    Um lote lista vários arquivos no mesmo alvo: 'GET /arq1/arq2/arq3?...'.
+    """
+    alvo = mensagem_cliente.split(" ", 1)[1].strip()
+    alvo, _, consulta = alvo.partition("?")
+    opcoes = {}
+    for parametro in consulta.split("&"):
+        if "=" in parametro:
+            chave, valor = parametro.split("=", 1)
+            opcoes[chave.strip()] = valor.strip()
+    return [caminho for caminho in alvo.split("/") if caminho] or [""], opcoes
+
+
+def mtu_do_caminho(endereco):
+    """MTU conhecido pelo kernel para a rota até o endereço (Linux, IP_MTU), ou None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    sonda = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sonda.setsockopt(socket.IPPROTO_IP, getattr(socket, "IP_MTU_DISCOVER", 10), getattr(socket, "IP_PMTUDISC_DO", 2))
+        sonda.connect(endereco)
+        return sonda.getsockopt(socket.IPPROTO_IP, getattr(socket, "IP_MTU", 14))
+    except OSError:
+        return None
+    finally:
+        sonda.close()
+
+
+def negociar_segmento(opcoes, endereco, limitar_ao_mtu):
+    """Tamanho de segmento de uma requisição ('segmento=N'), limitado ao máximo configurado.
+
+    Gera ValueError se o valor não for um número. No INFO o pedido também é
+    reduzido para caber no MTU do caminho, se DESCOBRIR_MTU estiver ativo;
+    sem como descobri-lo, um cliente remoto recebe segmentos que cabem em
+    MTU_PRESUMIDO (datagramas fragmentados se perdem por inteiro).
+    """
+    if "segmento" not in opcoes:
+        return SEGMENT_SIZE
+    tamanho = min(int(opcoes["segmento"]), SEGMENT_SIZE_MAXIMO, TAMANHO_MAXIMO_UDP - SOBRECARGA_PACOTE)
+    if limitar_ao_mtu and DESCOBRIR_MTU:
+        mtu = mtu_do_caminho(endereco)
+        if mtu is None and not ipaddress.ip_address(endereco[0]).is_loopback:
+            mtu = MTU_PRESUMIDO
+        if mtu is not None:
+            tamanho = min(tamanho, mtu - 28 - SOBRECARGA_PACOTE) # 28 = cabeçalhos IP + UDP
+    return max(tamanho, SEGMENT_SIZE_MINIMO)
+
+
+def responder_info(servidor, mensagem_cliente, temp_address):
+    """Responde a 'INFO /arquivo' com os metadados do arquivo (payload_info).
+
+    Tamanho, tamanho de segmento negociado, total de segmentos, versão e,
+    se o arquivo não passar de DIGEST_NO_INFO_MAXIMO e o digest dele no
+    algoritmo de 'checksum=' já estiver pronto (DigestsArquivos): com isso o cliente pré-aloca o destino, mostra o
+    progresso e confere o arquivo montado por várias faixas ou retomado.
+
+    Para um lote ('INFO /arq1/arq2/...') responde com INFO_LOTE: o tamanho
+    de cada arquivo, ou TAMANHO_AUSENTE para os que não existem.
+    """
+    caminhos, opcoes = interpretar_requisicao(mensagem_cliente)
+    try:
+        segment_size = negociar_segmento(opcoes, temp_address, limitar_ao_mtu=True)
+    except ValueError as e:
+        enviar_erro(servidor, f"Tamanho de segmento inválido ({e})", temp_address)
+        return
+    if len(caminhos) > 1:
+        if len(caminhos) > MAX_ARQUIVOS_POR_LOTE:
+            enviar_erro(servidor, f"Lote com {len(caminhos)} arquivos; o máximo é {MAX_ARQUIVOS_POR_LOTE}", temp_address)
+            return
+        tamanhos = [os.path.getsize(caminho) if os.path.isfile(caminho) else None for caminho in caminhos]
+        servidor.sendto(montar_pacote(TIPO_INFO_LOTE, payload=payload_info_lote(segment_size, tamanhos)), temp_address)
+        return
+    caminho_arquivo = caminhos[0]
+    checksum = opcoes.get("checksum", CHECKSUM_PADRAO)
+    if checksum not in CHECKSUMS:
+        enviar_erro(servidor, f"Checksum '{checksum}' não suportado; use {', '.join(CHECKSUMS)}", temp_address)
+        return
+    try:
+        if not os.path.isfile(caminho_arquivo): # Diretórios e afins também não são servidos, como no lote
+            raise FileNotFoundError(caminho_arquivo)
+        estado_arquivo = os.stat(caminho_arquivo)
+        digesto = digests_arquivos.obter(caminho_arquivo, estado_arquivo, checksum)
+    except OSError:
+        print(f"INFO de {temp_address} para arquivo não encontrado: {caminho_arquivo}")
+        enviar_erro(servidor, f"Arquivo '{caminho_arquivo}' não encontrado", temp_address)
+        return
+    payload = payload_info(estado_arquivo.st_size, segment_size, estado_arquivo.st_mtime_ns, digesto or b"")
+    servidor.sendto(montar_pacote(TIPO_INFO, payload=payload, checksum=checksum), temp_address)
+
+
+def iniciar_sessao(servidor, mensagem_cliente, temp_address):
+    """Valida um GET e cria a sessão correspondente (ou responde com Erro).
+
+    Aceita uma faixa opcional de segmentos: 'GET /arquivo?inicio=A&fim=B'
+    envia só os segmentos A até B-1. Com 'fec=N:K', envia também K
+    segmentos de paridade a cada N segmentos de dados. Com
+    'codecs=c1,c2,...', comprime os segmentos com o primeiro codec suportado.
+    'segmento=N' escolhe o tamanho dos segmentos (o cliente usa o valor
+    negociado no INFO) e 'checksum=' o algoritmo do checksum dos pacotes
+    e do digest enviado no EOF (CHECKSUMS). Com vários arquivos ('GET /arq1/arq2/...'), todos
+    vão na mesma sessão (FonteLote); 'assinatura=' confere que os tamanhos
+    ainda são os informados no INFO_LOTE.
+    """
+    caminhos, opcoes = interpretar_requisicao(mensagem_cliente)
+    lote = len(caminhos) > 1
+    caminho_arquivo = f"lote de {len(caminhos)} arquivos" if lote else caminhos[0]
+    print(f"Cliente {temp_address} solicitou: {caminho_arquivo} {opcoes if opcoes else ''}")
+    if len(caminhos) > MAX_ARQUIVOS_POR_LOTE:
+        enviar_erro(servidor, f"Lote com {len(caminhos)} arquivos; o máximo é {MAX_ARQUIVOS_POR_LOTE}", temp_address)
+        return None
+
+    # Verificar existência e segmentar o arquivo
+    if not lote and not os.path.exists(caminho_arquivo):
+        print(f"Arquivo não encontrado: {caminho_arquivo}")
+        enviar_erro(servidor, f"Arquivo '{caminho_arquivo}' não encontrado", temp_address)
+        return None
+
+    codec = None
+    if COMPRESSAO_HABILITADA and "codecs" in opcoes:
+        codec = next((nome for nome in opcoes["codecs"].split(",") if nome in CODECS), None)
+
+    checksum = opcoes.get("checksum", CHECKSUM_PADRAO)
+    if checksum not in CHECKSUMS:
+        print(f"Checksum desconhecido pedido por {temp_address}: {checksum}")
+        enviar_erro(servidor, f"Checksum '{checksum}' não suportado; use {', '.join(CHECKSUMS)}", temp_address)
+        return None
+
+    try:
+        segment_size = negociar_segmento(opcoes, temp_address, limitar_ao_mtu=False)
+        if "segmento" in opcoes and segment_size != int(opcoes["segmento"]):
+            raise ValueError(f"use entre {SEGMENT_SIZE_MINIMO} e {SEGMENT_SIZE_MAXIMO}")
+    except ValueError as e:
+        print(f"Tamanho de segmento inválido pedido por {temp_address}: {e}")
+        enviar_erro(servidor, f"Tamanho de segmento inválido ({e})", temp_address)
+        return None
+
+    try:
+        if lote:
+            fonte = FonteLote(caminhos, cache_segmentos, codec, segment_size, checksum)
+        else:
+            fonte = FonteSegmentos(caminho_arquivo, cache_segmentos, codec, segment_size, checksum=checksum)
+    except Exception as e:
+        print(f"Erro ao ler/segmentar arquivo {caminho_arquivo}: {e}")
+        enviar_erro(servidor, "Falha ao processar arquivo no servidor", temp_address)
+        return None
+    if lote:
+        ausentes = sum(tamanho is None for tamanho in fonte.tamanhos)
+        if ausentes:
+            print(f"{ausentes} arquivo(s) do lote não encontrado(s); serão enviados sem segmentos.")
+        if "assinatura" in opcoes and opcoes["assinatura"] != assinatura_lote(fonte.tamanhos, segment_size):
+            print(f"Lote pedido por {temp_address} mudou desde o INFO.")
+            enviar_erro(servidor, "Arquivos do lote mudaram desde o INFO; consulte de novo", temp_address)
+            fonte.fechar()
+            return None
 
-        if not eof_confirmado:
-            print(f"[FALHA EOF] Cliente {client_address} não confirmou recebimento de EOF após {tentativas_eof} tentativas.")
+    try:
+        inicio = int(opcoes.get("inicio", 0))
+        fim = min(int(opcoes.get("fim", fonte.total_segmentos)), fonte.total_segmentos)
+        if not 0 <= inicio <= fim:
+            raise ValueError(f"inicio={inicio}, fim={fim}")
+    except ValueError as e:
+        print(f"Faixa inválida pedida por {temp_address}: {e}")
+        enviar_erro(servidor, f"Faixa de segmentos inválida ({e})", temp_address)
+        fonte.fechar()
+        return None
+
+    fec = None
+    if "fec" in opcoes:
+        try:
+            segmentos_por_bloco, paridades_no_bloco = map(int, opcoes["fec"].split(":"))
+            if not 1 <= paridades_no_bloco <= segmentos_por_bloco <= FEC_MAXIMO_BLOCO:
+                raise ValueError(f"fec={opcoes['fec']}")
+        except ValueError as e:
+            print(f"FEC inválido pedido por {temp_address}: {e}")
+            enviar_erro(servidor, f"Parâmetros de FEC inválidos ({e}); use N:K com 1 <= K <= N <= {FEC_MAXIMO_BLOCO}", temp_address)
+            fonte.fechar()
+            return None
+        if FEC_HABILITADO:
+            fec = (segmentos_por_bloco, paridades_no_bloco)
+        else:
+            print(f"FEC pedido por {temp_address}, mas está desabilitado neste servidor. Enviando sem paridade.")
+
+    sessao = SessaoTransferencia(temp_address, caminho_arquivo, fonte, inicio, fim, fec)
+    print(f"Arquivo '{caminho_arquivo}' ({fonte.tamanho} bytes) será enviado em {sessao.total_segmentos} segmentos de {segment_size} bytes "
+          f"[{inicio}, {fim}) para {temp_address}{f' com FEC {fec[1]}/{fec[0]}' if fec else ''}"
+          f"{f', comprimidos com {codec}' if codec else ''}, checksum {checksum}.")
+    if sessao.total_segmentos == 0: # Arquivo (ou faixa) vazio: vai direto para o EOF
+        sessao.enviando_eof = True
+        sessao.enviar_eof(servidor)
+    return sessao
+
+
+def encerrar_sessao(sessao):
+    """Libera o arquivo da sessão e contabiliza/exporta as métricas dela."""
+    sessao.fonte.fechar()
+    sessao.metricas.encerrar()
+    metricas_servidor.somar(sessao.metricas)
+    if NIVEL_LOG >= NIVEL_INFO:
+        print(f"[MÉTRICAS] {sessao.client_address}: {sessao.metricas.resumo()}")
+    if canal_metricas is not None: # Trabalhador: quem exporta é o supervisor
+        linha = json.dumps({**sessao.metricas.para_dict(), "trabalhador": argumentos.trabalhador}, ensure_ascii=False)
+        try:
+            os.write(canal_metricas, linha.encode('utf-8') + b"\n")
+        except OSError as e:
+            print(f"Aviso: não foi possível enviar as métricas ao supervisor: {e}")
+    elif EXPORTAR_METRICAS == 'json':
+        exportar_metricas(sessao.metricas, 'json', ARQUIVO_METRICAS + ".jsonl")
+    elif EXPORTAR_METRICAS == 'prometheus':
+        exportar_metricas(metricas_servidor, 'prometheus', ARQUIVO_METRICAS + ".prom")
+
+
+def tratar_datagrama(servidor, sessoes, dados, endereco):
+    """Encaminha um datagrama recebido: GET cria uma sessão, o resto vai para a sessão do endereço."""
+    try:
+        if dados.startswith(b"GET "):
+            if endereco in sessoes:
+                print(f"Cliente {endereco} enviou novo GET. Substituindo a transferência anterior.")
+                encerrar_sessao(sessoes.pop(endereco))
+            sessao = iniciar_sessao(servidor, dados.decode(ENCODING), endereco)
+            if sessao is not None:
+                if sessao.finalizada:
+                    encerrar_sessao(sessao)
+                else:
+                    sessoes[endereco] = sessao
+        elif dados.startswith(b"INFO "):
+            responder_info(servidor, dados.decode(ENCODING), endereco)
+        elif endereco in sessoes and eh_pacote_binario(dados):
+            sessoes[endereco].processar_pacote(dados, servidor)
+        else:
+            print(f"Recebido {dados[:50]} de {endereco} sem sessão ativa. Esperando GET.")
+    except UnicodeDecodeError as e:
+        print(f"Erro de decodificação: {e}. Aguardando novamente.")
+    except Exception as e:
+        print(f"Erro inesperado ao tratar pacote de {endereco}: {e}")
 
-        print(f"[SUCESSO] Transferência para {client_address} finalizada.")
 
+# 0) --- Opções de Linha de Comando (todas opcionais; sem elas valem as configurações acima) ---
+parser = argparse.ArgumentParser(description="Servidor UDP de transferência de arquivos.")
+parser.add_argument("--ip", default=IP, help=f"endereço para o bind (padrão: {IP})")
+parser.add_argument("--porta", type=int, default=PORTA, help=f"porta UDP (padrão: {PORTA})")
+parser.add_argument("--janela-maxima", type=int, default=JANELA_MAXIMA, help="limite da janela de congestionamento, em segmentos")
+parser.add_argument("--segmento-maximo", type=int, default=SEGMENT_SIZE_MAXIMO, help="maior tamanho de segmento negociável, em bytes")
+parser.add_argument("--controle", choices=('aimd', 'cubic'), default=CONTROLE_CONGESTIONAMENTO, help="controle de congestionamento")
+parser.add_argument("--metricas", choices=('json', 'prometheus'), default=EXPORTAR_METRICAS, help="exporta as métricas de cada transferência")
+parser.add_argument("--processos", type=int, default=PROCESSOS, help="número de processos trabalhadores (SO_REUSEPORT)")
+parser.add_argument("--trabalhador", type=int, default=None, help=argparse.SUPPRESS) # Uso interno do supervisor
+parser.add_argument("--canal-metricas", type=int, default=None, help=argparse.SUPPRESS)
+argumentos = parser.parse_args()
+IP, PORTA = argumentos.ip, argumentos.porta
+JANELA_MAXIMA = argumentos.janela_maxima
+SEGMENT_SIZE_MAXIMO = argumentos.segmento_maximo
+CONTROLE_CONGESTIONAMENTO = argumentos.controle
+EXPORTAR_METRICAS = argumentos.metricas
+canal_metricas = argumentos.canal_metricas # Pipe para o supervisor (só nos trabalhadores)
+
+if argumentos.processos > 1 and argumentos.trabalhador is None:
+    if not hasattr(socket, "SO_REUSEPORT"):
+        print("SO_REUSEPORT não está disponível neste sistema. Usando um único processo.")
     else:
-         print(f"Transferência para {client_address} finalizou inesperadamente (base={base}, total={total_segmentos}).")
+        print(f"Iniciando {argumentos.processos} processos trabalhadores em {IP}:{PORTA}.")
+        SupervisorTrabalhadores(argumentos.processos, [
+            "--ip", IP, "--porta", str(PORTA), "--janela-maxima", str(JANELA_MAXIMA),
+            "--segmento-maximo", str(SEGMENT_SIZE_MAXIMO), "--controle", CONTROLE_CONGESTIONAMENTO]).executar()
+        sys.exit()
+
+# 1) --- Criação do Socket ---
+servidor = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+try:
+    if argumentos.trabalhador is not None:
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C chega ao grupo todo; quem encerra os trabalhadores é o supervisor
+        # Todos os trabalhadores fazem bind na mesma porta; o kernel reparte os clientes entre eles
+        servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    servidor.bind((IP, PORTA))
+    print(f"Servidor UDP escutando em {IP}:{PORTA}" + (f" (trabalhador {argumentos.trabalhador})" if argumentos.trabalhador is not None else ""))
+except socket.error as e:
+    print(f"Erro no bind: {e}")
+    exit()
+
+try:
+    servidor.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SO_SNDBUF_DESEJADO)
+except OSError as e:
+    print(f"Aviso: Não foi possível alterar SO_SNDBUF: {e}")
+
+# 2) --- Registro no Seletor (modo não bloqueante) ---
+servidor.setblocking(False)
+seletor = selectors.DefaultSelector()
+seletor.register(servidor, selectors.EVENT_READ)
+
+sessoes = {} # {client_address: SessaoTransferencia}
+cache_segmentos = CacheSegmentos(CACHE_MAXIMO_BYTES)
+digests_arquivos = DigestsArquivos(DIGESTS_EM_CACHE)
+metricas_servidor = MetricasTransferencia('servidor') # Totais de todas as transferências encerradas
+metricas_servidor.transferencias = 0
+metricas_servidor.tempo_ativo = 0.0
+buffer_recepcao = memoryview(bytearray(BUFFER_SIZE))
+pid_supervisor = os.getppid()
+
+# 3) --- Loop Principal Orientado a Eventos ---
+print("\nAguardando requisições GET...")
+while True:
+    # Espera por pacotes só até o próximo prazo de retransmissão entre todas as
+    # sessões; sem nenhum prazo pendente, espera indefinidamente por um GET
+    prazos = [prazo for prazo in (sessao.proximo_prazo() for sessao in sessoes.values()) if prazo is not None]
+    timeout_espera = max(min(prazos) - time.time(), 0) if prazos else None
+    if digests_arquivos.pendente():
+        timeout_espera = 0 # Digest em cálculo: só verifica os pacotes e volta para o próximo bloco
+    if argumentos.trabalhador is not None:
+        # Trabalhador acorda de vez em quando para ver se o supervisor ainda existe (senão ficaria órfão)
+        timeout_espera = 1.0 if timeout_espera is None else min(timeout_espera, 1.0)
+        if os.getppid() != pid_supervisor:
+            print(f"Supervisor terminou. Encerrando o trabalhador {argumentos.trabalhador}.")
+            break
+    eventos = seletor.select(timeout_espera)
+
+    if eventos:
+        # Drena todos os datagramas já disponíveis (ACKs de todas as sessões) antes
+        # de reenviar/preencher as janelas, em vez de um recvfrom por volta do loop
+        for _ in range(MAX_PACOTES_POR_RODADA):
+            try:
+                tamanho, endereco = servidor.recvfrom_into(buffer_recepcao)
+            except (BlockingIOError, InterruptedError):
+                break # Fila do socket vazia
+            except ConnectionResetError as e:
+                # Em UDP não é possível saber qual cliente causou o erro; os timers de cada sessão cuidam disso
+                print(f"Conexão resetada: {e}. Aguardando novamente.")
+                continue
+            except Exception as e:
+                print(f"Erro inesperado ao receber pacote: {e}")
+                break
+            tratar_datagrama(servidor, sessoes, buffer_recepcao[:tamanho].tobytes(), endereco)
+
+    # Avança todas as sessões ativas: retransmissões e novos envios
+    agora = time.time()
+    for endereco, sessao in list(sessoes.items()):
+        sessao.verificar_timeouts(servidor, agora)
+        if not sessao.finalizada and not sessao.enviando_eof:
+            sessao.enviar_janela(servidor)
+        if sessao.finalizada:
+            encerrar_sessao(sessao)
+            del sessoes[endereco]
+    digests_arquivos.avancar()
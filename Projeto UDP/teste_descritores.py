@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import random
+import shutil
+import filecmp
+import tempfile
+import subprocess
+import argparse
+from benchmark import porta_livre, IP, DIRETORIO_SCRIPTS
+
+# --- Configurações ---
+LIMITE_DESCRITORES = 200 # RLIMIT_NOFILE do servidor durante o teste
+# Descritores que o servidor pode ter abertos ao mesmo tempo (o teste falha acima disso). Arquivos ainda
+# não confirmados ficam abertos, então com arquivos de um segmento o pico acompanha a janela (~130), não o lote
+MAXIMO_ABERTOS = 160
+TIMEOUT_DOWNLOAD = 120   # Segundos
+
+def limitar_descritores():
+    import resource
+    resource.setrlimit(resource.RLIMIT_NOFILE, (LIMITE_DESCRITORES, LIMITE_DESCRITORES))
+
+def descritores_abertos(pid):
+    """Número de descritores abertos do processo (Linux, via /proc), ou None."""
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lote grande com FEC: o servidor não pode acumular arquivos abertos.")
+    parser.add_argument("--arquivos", type=int, default=600, help="arquivos no lote")
+    parser.add_argument("--fec", default="64:1", help="proporção de FEC N:K")
+    parser.add_argument("--manter", action="store_true", help="mantém o diretório temporário")
+    argumentos = parser.parse_args()
+    if not sys.platform.startswith("linux"):
+        print("Teste disponível apenas no Linux (RLIMIT_NOFILE e /proc).")
+        sys.exit(0)
+
+    diretorio = tempfile.mkdtemp(prefix="teste_descritores_")
+    dir_servidor = os.path.join(diretorio, "servidor")
+    dir_cliente = os.path.join(diretorio, "cliente")
+    os.makedirs(dir_servidor)
+    os.makedirs(dir_cliente)
+    rng = random.Random(1)
+    nomes = [f"arquivo_{i}.bin" for i in range(argumentos.arquivos)]
+    for nome in nomes:
+        with open(os.path.join(dir_servidor, nome), 'wb') as f:
+            f.write(rng.randbytes(rng.randrange(1, 3000)))
+
+    porta = porta_livre()
+    log = open(os.path.join(diretorio, "servidor.log"), 'w')
+    servidor = subprocess.Popen([sys.executable, "-u", os.path.join(DIRETORIO_SCRIPTS, "servidor.py"), "--ip", IP, "--porta", str(porta)],
+                                cwd=dir_servidor, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                preexec_fn=limitar_descritores)
+    maximo_abertos = 0
+    try:
+        time.sleep(1)
+        entrada = f"{IP}\n{porta}\n{','.join(nomes)}\n\n\n{argumentos.fec}\n"
+        cliente = subprocess.Popen([sys.executable, "-u", os.path.join(DIRETORIO_SCRIPTS, "cliente1.py")], cwd=dir_cliente,
+                                   stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, text=True)
+        cliente.stdin.write(entrada)
+        cliente.stdin.close()
+        limite = time.time() + TIMEOUT_DOWNLOAD
+        while cliente.poll() is None and time.time() < limite:
+            maximo_abertos = max(maximo_abertos, descritores_abertos(servidor.pid) or 0)
+            time.sleep(0.005)
+        if cliente.poll() is None:
+            cliente.kill()
+    finally:
+        servidor.kill()
+        servidor.wait()
+        log.close()
+
+    salvos = sum(filecmp.cmp(os.path.join(dir_servidor, nome), os.path.join(dir_cliente, f"recebido_{nome}"), shallow=False)
+                 for nome in nomes if os.path.exists(os.path.join(dir_cliente, f"recebido_{nome}")))
+    print(f"{salvos} de {len(nomes)} arquivos recebidos corretamente; máximo de {maximo_abertos} descritores abertos no servidor.")
+    ok = salvos == len(nomes) and maximo_abertos <= MAXIMO_ABERTOS
+    if ok and not argumentos.manter:
+        shutil.rmtree(diretorio, ignore_errors=True)
+    else:
+        print(f"Arquivos e log do servidor em '{diretorio}'.")
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)